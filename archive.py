@@ -0,0 +1,141 @@
+import logging
+import os
+import re
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from config import ARCHIVE_DIR
+
+logger = logging.getLogger('telegram_online')
+
+# Схема помесячного архивного файла: те же столбцы, что и у messages основной базы.
+# ID сообщений в основной базе не переиспользуются (AUTOINCREMENT), поэтому
+# остаются уникальными и в архиве
+ARCHIVE_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS {schema}.messages (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        message_text TEXT,
+        timestamp TIMESTAMP,
+        is_incoming BOOLEAN
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_messages_user_time ON messages (user_id, timestamp, id)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_messages_time ON messages (timestamp, id)",
+)
+
+_FILE_RE = re.compile(r'^messages_(\d{4})_(\d{2})\.db$')
+
+# Ключ сообщения для курсора: (timestamp, id)
+MessageKey = Tuple[Any, int]
+
+
+class ArchiveStore:
+    """Помесячные архивные файлы истории сообщений.
+
+    Сообщения за месяц YYYY-MM лежат в файле messages_YYYY_MM.db. Старые
+    месяцы не меняются, поэтому их удобно хранить и копировать отдельно от
+    основной базы. Запись выполняет поток записи MessageDatabase через
+    ATTACH; здесь — расположение файлов и чтение.
+    """
+
+    def __init__(self, archive_dir: str = ARCHIVE_DIR):
+        self.archive_dir = archive_dir
+
+    def path_for(self, month: str) -> str:
+        """Путь к архивному файлу месяца в формате 'YYYY-MM'."""
+        return os.path.join(self.archive_dir, f"messages_{month.replace('-', '_')}.db")
+
+    def months(self, since: Optional[str] = None, until: Optional[str] = None) -> List[str]:
+        """Месяцы, за которые есть архивные файлы, по возрастанию.
+
+        since и until — границы по времени (строки 'YYYY-MM-DD ...'); месяцы
+        целиком вне диапазона пропускаются.
+        """
+        try:
+            names = os.listdir(self.archive_dir)
+        except FileNotFoundError:
+            return []
+        months = []
+        for name in names:
+            match = _FILE_RE.match(name)
+            if match:
+                months.append(f"{match.group(1)}-{match.group(2)}")
+        months.sort()
+        if since:
+            months = [month for month in months if month >= since[:7]]
+        if until:
+            months = [month for month in months if month <= until[:7]]
+        return months
+
+    def connect(self, month: str):
+        """Соединение только для чтения с архивным файлом месяца."""
+        uri = f"{Path(self.path_for(month)).absolute().as_uri()}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA query_only = 1")
+        return conn
+
+    def find_key(self, message_id: int) -> Optional[MessageKey]:
+        """Ключ (timestamp, id) архивного сообщения или None."""
+        for month in reversed(self.months()):
+            conn = self.connect(month)
+            try:
+                row = conn.execute("SELECT timestamp, id FROM messages WHERE id = ?", (message_id,)).fetchone()
+            finally:
+                conn.close()
+            if row:
+                return row['timestamp'], row['id']
+        return None
+
+    def iter_history(self, user_id: int, before: Optional[MessageKey] = None, after: Optional[MessageKey] = None,
+                     ascending: bool = False, chunk_size: int = 50) -> Iterator[Dict[str, Any]]:
+        """Ленивое чтение архивной истории пользователя с курсором по (timestamp, id).
+
+        Файлы открываются по одному и только когда до них дошло чтение,
+        поэтому страница, целиком попавшая в основную базу, архив не трогает.
+        """
+        query = "SELECT * FROM messages WHERE user_id = ?"
+        params = [user_id]
+        if before is not None:
+            query += " AND (timestamp, id) < (?, ?)"
+            params.extend(before)
+        if after is not None:
+            query += " AND (timestamp, id) > (?, ?)"
+            params.extend(after)
+        order = "ASC" if ascending else "DESC"
+        query += f" ORDER BY timestamp {order}, id {order}"
+
+        months = self.months()
+        for month in (months if ascending else reversed(months)):
+            yield from self._iter_rows(month, query, params, chunk_size)
+
+    def iter_export(self, query: str, params: list, since: Optional[str] = None, until: Optional[str] = None,
+                    attach: Optional[str] = None, chunk_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        """Выполнение запроса экспорта по всем архивным файлам диапазона в хронологическом порядке.
+
+        attach — URI основной базы, подключаемой как схема hot (для данных пользователей).
+        """
+        for month in self.months(since, until):
+            yield from self._iter_rows(month, query, params, chunk_size, attach)
+
+    def _iter_rows(self, month, query, params, chunk_size, attach=None):
+        try:
+            conn = self.connect(month)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка открытия архива {self.path_for(month)}: {e}")
+            return
+        try:
+            if attach:
+                conn.execute("ATTACH DATABASE ? AS hot", (attach,))
+            cursor = conn.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(row)
+        finally:
+            conn.close()
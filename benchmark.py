@@ -0,0 +1,447 @@
+"""Нагрузочный тест конвейера обработки сообщений без сети.
+
+Прогоняет поток синтетических сообщений (текст, фото, стикеры, документы)
+через MultiAccountTelegramBot.handle_new_message, NotificationBot.send_notification
+и MessageDatabase.save_envelope с поддельными клиентами Telegram и выводит
+пропускную способность, задержки p50/p99 и пиковое потребление памяти.
+
+Примеры:
+    python benchmark.py                           # все сценарии
+    python benchmark.py pipeline --messages 20000 --senders 500
+    python benchmark.py --save-baseline           # сохранить результаты как эталон
+    python benchmark.py --compare                 # сравнить с эталоном (код выхода 1 при регрессии)
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(REPO_DIR, 'benchmark_baselines.json')
+
+SCENARIOS = ('pipeline', 'notify', 'db')
+
+# Разница задержек меньше этого значения считается шумом измерения, мс
+LATENCY_NOISE_MS = 1.0
+
+# Доли типов сообщений в синтетическом потоке
+MESSAGE_MIX = (('text', 0.7), ('photo', 0.1), ('sticker', 0.1), ('document', 0.1))
+
+
+class FakeClient:
+    """Клиент аккаунта: методы, которые вызывает конвейер, с задержкой вместо сети."""
+
+    def __init__(self, user_id, latency=0.0, bot=None, factory=None):
+        self.user_id = user_id
+        self.latency = latency
+        self.calls = 0
+        self.bot = bot  # Бот, которому доставляются пересланные медиа
+        self.factory = factory  # Источник медиа сообщений по ID
+
+    async def _rpc(self):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+
+    def is_connected(self):
+        return True
+
+    async def __call__(self, request):
+        await self._rpc()
+        return True
+
+    async def send_read_acknowledge(self, entity, max_id=None):
+        await self._rpc()
+        return True
+
+    async def forward_messages(self, entity, messages, from_peer=None):
+        await self._rpc()
+        if self.bot is not None:
+            self.bot.deliver(self.user_id, self.factory.media.pop(messages, None))
+        return messages
+
+    async def get_me(self, input_peer=False):
+        return SimpleNamespace(user_id=self.user_id, id=self.user_id)
+
+
+class FakeBot(FakeClient):
+    """Клиент бота уведомлений."""
+
+    def __init__(self, latency=0.0):
+        super().__init__(user_id=1, latency=latency)
+        self._ids = itertools.count(1)
+        self._handlers = []
+
+    def add_event_handler(self, callback, event=None):
+        self._handlers.append(callback)
+
+    def deliver(self, sender_id, media):
+        """Входящее сообщение бота с медиа, пересланным аккаунтом."""
+        event = SimpleNamespace(message=SimpleNamespace(media=media), sender_id=sender_id, is_private=True)
+        for handler in self._handlers:
+            asyncio.create_task(handler(event))
+
+    async def send_message(self, entity, message, **kwargs):
+        await self._rpc()
+        return SimpleNamespace(id=next(self._ids))
+
+    async def edit_message(self, entity, message, text=None, **kwargs):
+        await self._rpc()
+        return message
+
+    async def send_file(self, entity, file, **kwargs):
+        await self._rpc()
+        return SimpleNamespace(id=next(self._ids))
+
+    async def get_me(self, input_peer=False):
+        return SimpleNamespace(id=1, username='benchmark_bot')
+
+
+class _UnlimitedBucket:
+    async def acquire(self):
+        return
+
+
+class EventFactory:
+    """Синтетические события NewMessage от заданного числа отправителей."""
+
+    def __init__(self, senders, seed=0):
+        from telethon.tl import types
+
+        self.types = types
+        self.random = random.Random(seed)
+        self.users = [
+            types.User(id=100000 + i, first_name='Пользователь', last_name=str(i),
+                       username=f'bench_user_{i}' if i % 3 else None, bot=False)
+            for i in range(senders)
+        ]
+        self._ids = itertools.count(1)
+        self.created_at = {}  # ID сообщения -> момент создания события
+        self.media = {}  # ID сообщения -> медиа (для пересылки боту)
+        self._kinds = [kind for kind, _ in MESSAGE_MIX]
+        self._weights = [weight for _, weight in MESSAGE_MIX]
+
+    def _media(self, kind, message_id):
+        types = self.types
+        if kind == 'photo':
+            return types.MessageMediaPhoto(photo=types.Photo(
+                id=message_id, access_hash=0, file_reference=b'', date=None, sizes=[], dc_id=2
+            ))
+        if kind == 'sticker':
+            # Стикеры повторяются, как в реальной переписке
+            return types.MessageMediaDocument(document=types.Document(
+                id=message_id % 50, access_hash=0, file_reference=b'', date=None, mime_type='image/webp',
+                size=1024, dc_id=2, attributes=[types.DocumentAttributeSticker(
+                    alt='🙂', stickerset=types.InputStickerSetEmpty()
+                )]
+            ))
+        if kind == 'document':
+            return types.MessageMediaDocument(document=types.Document(
+                id=message_id, access_hash=0, file_reference=b'', date=None, mime_type='application/pdf',
+                size=4096, dc_id=2, attributes=[]
+            ))
+        return None
+
+    def make(self):
+        types = self.types
+        user = self.random.choice(self.users)
+        kind = self.random.choices(self._kinds, self._weights)[0]
+        message_id = next(self._ids)
+        self.created_at[message_id] = time.perf_counter()
+        message = types.Message(
+            id=message_id,
+            peer_id=types.PeerUser(user.id),
+            date=datetime.now(),
+            message=f'Тестовое сообщение {message_id}' if kind == 'text' else '',
+            media=self._media(kind, message_id)
+        )
+        if message.media is not None:
+            self.media[message_id] = message.media
+
+        async def get_sender():
+            return user
+
+        return SimpleNamespace(
+            is_private=True,
+            sender_id=user.id,
+            sender=user,
+            chat_id=user.id,
+            message=message,
+            media=message.media,
+            get_sender=get_sender
+        ), user
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss — в килобайтах на Linux и в байтах на macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+async def make_notification_bot(args):
+    """Бот уведомлений с поддельным клиентом и без лимитов Telegram (если не задано --real-limits)."""
+    from notification_bot import NotificationBot
+    from media_relay import MediaRelay
+    from services import get_db
+
+    notifier = NotificationBot(get_db())
+    notifier.bot = FakeBot(args.rpc_latency)
+    notifier.media_relay = MediaRelay(notifier.bot, notifier.outbound)
+    # Username бота и обработчик пересланных медиа: без них новое медиа уходит текстом
+    await notifier.media_relay.start()
+    notifier.outbound.start()
+    if not args.real_limits:
+        notifier.outbound._global = _UnlimitedBucket()
+        notifier.outbound._chat_bucket = lambda chat_id: _UnlimitedBucket()
+    notifier.is_running = True
+    return notifier
+
+
+async def drain(notifier):
+    """Ожидание отправки всех уведомлений и отложенных правок."""
+    while notifier.outbound.depth or any(b['edit_task'] for b in notifier._bursts.values()):
+        await asyncio.sleep(0.01)
+
+
+async def pace(index, started, rate):
+    """Выдерживание заданной скорости подачи сообщений."""
+    if rate:
+        delay = started + index / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+async def bench_pipeline(args, factory):
+    """Полный путь: обработчик аккаунта -> бот уведомлений -> база данных."""
+    from multi_account import MultiAccountTelegramBot
+    from read_receipts import ReadReceiptAggregator
+    from services import get_db
+
+    notifier = await make_notification_bot(args)
+    bot = MultiAccountTelegramBot(accounts=[])
+    bot.notification_bot = notifier
+    clients = {}
+    for i in range(args.accounts):
+        phone = f'+7000000{i:04d}'
+        clients[phone] = FakeClient(200000 + i, args.rpc_latency, bot=notifier.bot, factory=factory)
+        bot.read_receipts[phone] = ReadReceiptAggregator(clients[phone], phone)
+    phones = list(clients)
+
+    latencies = []
+    send_notification = notifier.send_notification
+
+    async def timed_send(envelope, client=None, message_count=1, queued=None):
+        try:
+            return await send_notification(envelope, client, message_count, queued)
+        finally:
+            latencies.append(time.perf_counter() - factory.created_at.pop(envelope.message_id))
+
+    notifier.send_notification = timed_send
+
+    started = time.perf_counter()
+    tasks = set()
+    for index in range(args.messages):
+        await pace(index, started, args.rate)
+        event, _ = factory.make()
+        phone = phones[index % len(phones)]
+        task = asyncio.create_task(bot.handle_new_message(clients[phone], event, phone))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        if len(tasks) >= args.concurrency:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    await asyncio.gather(*tasks)
+    while len(latencies) < args.messages:
+        await asyncio.sleep(0.01)
+    await drain(notifier)
+    get_db().flush()
+    elapsed = time.perf_counter() - started
+
+    for receipts in bot.read_receipts.values():
+        await receipts.close()
+    await notifier.outbound.stop()
+    return elapsed, latencies
+
+
+async def bench_notify(args, factory):
+    """Только бот уведомлений: объединение серий, очередь отправки, запись в БД."""
+    from envelope import MessageEnvelope
+    from services import get_db
+
+    notifier = await make_notification_bot(args)
+    client = FakeClient(200000, args.rpc_latency, bot=notifier.bot, factory=factory)
+    latencies = []
+
+    async def one(event, user):
+        await notifier.send_notification(MessageEnvelope.from_event('bench', event, user), client)
+        latencies.append(time.perf_counter() - factory.created_at.pop(event.message.id))
+
+    started = time.perf_counter()
+    tasks = set()
+    for index in range(args.messages):
+        await pace(index, started, args.rate)
+        task = asyncio.create_task(one(*factory.make()))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        if len(tasks) >= args.concurrency:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    await asyncio.gather(*tasks)
+    await drain(notifier)
+    get_db().flush()
+    elapsed = time.perf_counter() - started
+    await notifier.outbound.stop()
+    return elapsed, latencies
+
+
+async def bench_db(args, factory):
+    """Только запись в БД; задержка — время вызова save_envelope, время — до фиксации всех пакетов."""
+    from envelope import MessageEnvelope
+    from services import get_db
+
+    db = get_db()
+    latencies = []
+    started = time.perf_counter()
+    for index in range(args.messages):
+        await pace(index, started, args.rate)
+        event, user = factory.make()
+        factory.created_at.pop(event.message.id)
+        envelope = MessageEnvelope.from_event('bench', event, user)
+        call_started = time.perf_counter()
+        db.save_envelope(envelope)
+        latencies.append(time.perf_counter() - call_started)
+        if index % 1000 == 999:
+            # Отдаем управление, как это происходит между событиями в реальном цикле
+            await asyncio.sleep(0)
+    db.flush()
+    return time.perf_counter() - started, latencies
+
+
+BENCHMARKS = {
+    'pipeline': bench_pipeline,
+    'notify': bench_notify,
+    'db': bench_db,
+}
+
+
+def run_scenario(name, args):
+    factory = EventFactory(args.senders, seed=args.seed)
+    elapsed, latencies = asyncio.run(BENCHMARKS[name](args, factory))
+    return {
+        'messages': args.messages,
+        'seconds': round(elapsed, 3),
+        'messages_per_second': round(args.messages / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+
+def load_baselines():
+    if not os.path.exists(BASELINE_FILE):
+        return {}
+    with open(BASELINE_FILE, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare(name, result, baseline, tolerance):
+    """Список регрессий относительно эталона."""
+    problems = []
+    if result['messages_per_second'] < baseline['messages_per_second'] * (1 - tolerance):
+        problems.append(f"пропускная способность {result['messages_per_second']} < "
+                        f"{baseline['messages_per_second']} сообщений/с")
+    if (result['p99_ms'] > baseline['p99_ms'] * (1 + tolerance)
+            and result['p99_ms'] - baseline['p99_ms'] > LATENCY_NOISE_MS):
+        problems.append(f"p99 {result['p99_ms']} > {baseline['p99_ms']} мс")
+    if result['peak_rss_mb'] > baseline['peak_rss_mb'] * (1 + tolerance):
+        problems.append(f"пиковая память {result['peak_rss_mb']} > {baseline['peak_rss_mb']} МБ")
+    return [f"{name}: {problem}" for problem in problems]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест обработки сообщений без сети')
+    parser.add_argument('scenarios', nargs='*', help='Сценарии: pipeline, notify, db (по умолчанию все)')
+    parser.add_argument('--messages', type=int, default=5000, help='Число сообщений в сценарии')
+    parser.add_argument('--senders', type=int, default=200, help='Число разных отправителей')
+    parser.add_argument('--accounts', type=int, default=4, help='Число аккаунтов (сценарий pipeline)')
+    parser.add_argument('--rate', type=float, default=0, help='Скорость подачи, сообщений/с (0 — без ограничения)')
+    parser.add_argument('--concurrency', type=int, default=1000, help='Максимум одновременно обрабатываемых событий')
+    parser.add_argument('--rpc-latency', type=float, default=0.0, help='Задержка поддельных запросов к Telegram, с')
+    parser.add_argument('--real-limits', action='store_true', help='Не отключать лимиты скорости бота')
+    parser.add_argument('--seed', type=int, default=0, help='Начальное значение генератора сообщений')
+    parser.add_argument('--verbose', action='store_true', help='Не отключать логи INFO')
+    parser.add_argument('--save-baseline', action='store_true', help='Сохранить результаты как эталон')
+    parser.add_argument('--compare', action='store_true', help='Сравнить с эталоном, код выхода 1 при регрессии')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Допустимое ухудшение относительно эталона')
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(sorted(unknown))}")
+    args.scenarios = args.scenarios or list(SCENARIOS)
+
+    # Модули бота создают базу, сессии и логи в текущей директории — работаем во временной
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    workdir = tempfile.mkdtemp(prefix='telegram_online_bench_')
+    os.chdir(workdir)
+
+    from log_setup import setup_logging
+    from services import close_services
+
+    setup_logging()
+
+    if not args.verbose:
+        for name in ('telegram_online', 'message_logger', 'notification_bot'):
+            logging.getLogger(name).setLevel(logging.WARNING)
+
+    results = {}
+    for name in args.scenarios:
+        results[name] = run_scenario(name, args)
+        result = results[name]
+        print(f"{name:<9} {result['messages_per_second']:>10.1f} сообщений/с   "
+              f"p50 {result['p50_ms']:>8.3f} мс   p99 {result['p99_ms']:>8.3f} мс   "
+              f"RSS {result['peak_rss_mb']:>7.1f} МБ")
+    close_services()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    problems = []
+    if args.compare:
+        baselines = load_baselines()
+        for name, result in results.items():
+            if name in baselines:
+                problems += compare(name, result, baselines[name], args.tolerance)
+            else:
+                print(f"{name}: эталон не найден")
+        for problem in problems:
+            print(f"РЕГРЕССИЯ {problem}")
+
+    if args.save_baseline:
+        baselines = load_baselines()
+        for name, result in results.items():
+            baselines[name] = dict(result, python=platform.python_version(), machine=platform.machine(),
+                                   senders=args.senders, rpc_latency=args.rpc_latency,
+                                   saved_at=datetime.now().isoformat(timespec='seconds'))
+        with open(BASELINE_FILE, 'w', encoding='utf-8') as f:
+            json.dump(baselines, f, ensure_ascii=False, indent=2)
+        print(f"Эталон сохранен в {BASELINE_FILE}")
+
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -17,14 +17,184 @@ IGNORED_USERS = [
         # Например: 123456789
 ]
 
-# Интервал обновления статуса онлайн (в секундах)
+# Интервал проверки подключения клиентов (в секундах)
 ONLINE_UPDATE_INTERVAL = 3
 
+# Время, в течение которого Telegram держит статус онлайн после обновления (в секундах)
+ONLINE_STATUS_TTL = 300
+
+# Запас до истечения статуса, с которым выполняется обновление (в секундах)
+PRESENCE_REFRESH_MARGIN = 60
+
+# Максимальный случайный сдвиг обновления, чтобы аккаунты не обновлялись одновременно (в секундах)
+PRESENCE_JITTER = 30
+
+# Минимальный интервал между обновлениями статуса разных аккаунтов (в секундах)
+PRESENCE_MIN_GAP = 0.2
+
+# Пауза перед повторной попыткой обновления статуса после ошибки (в секундах)
+PRESENCE_RETRY_DELAY = 5
+
+# Максимальное число аккаунтов (0 — без ограничения)
+MAX_ACCOUNTS = 0
+
+# Число рабочих процессов для аккаунтов (0 или 1 — все аккаунты в одном процессе, -1 — по числу ядер)
+SHARD_PROCESSES = 0
+
+# Размер очереди уведомлений между рабочими процессами и супервизором
+SHARD_EVENT_QUEUE_SIZE = 10000
+
+# Пауза перед перезапуском упавшего рабочего процесса (в секундах)
+SHARD_RESTART_DELAY = 5
+
+# Окно объединения сообщений от одного отправителя в одно уведомление (в секундах)
+NOTIFICATION_BURST_WINDOW = 10
+
+# Минимальная пауза между правками объединенного уведомления (в секундах)
+NOTIFICATION_EDIT_DELAY = 1.5
+
+# Окно распознавания повторной доставки и одинаковых сообщений, полученных несколькими аккаунтами (в секундах, 0 — выключено)
+DEDUP_WINDOW = 60
+
+# Максимальное число сообщений, которые помнит фильтр дубликатов
+DEDUP_MAX_ENTRIES = 20000
+
+# Максимальный размер очереди исходящих сообщений бота
+OUTBOUND_QUEUE_SIZE = 1000
+
+# Общий лимит сообщений бота в секунду и допустимый всплеск
+OUTBOUND_GLOBAL_RATE = 25
+OUTBOUND_GLOBAL_BURST = 25
+
+# Лимит сообщений бота в один чат в секунду и допустимый всплеск
+OUTBOUND_CHAT_RATE = 1
+OUTBOUND_CHAT_BURST = 3
+
+# Число повторов отправки после FloodWait
+OUTBOUND_MAX_RETRIES = 3
+
+# Число медиафайлов, которые бот помнит для повторной отправки без пересылки
+MEDIA_CACHE_SIZE = 1000
+
+# Максимальное время доставки админу медиа, пересланного аккаунтом через бота (в секундах);
+# после него вместо медиа отправляется текстовое уведомление
+MEDIA_RELAY_TIMEOUT = 30
+
+# Окно объединения отметок о прочтении в одном чате (в секундах)
+READ_ACK_WINDOW = 2
+
+# Время жизни записи в кэше пользователей (в секундах)
+ENTITY_CACHE_TTL = 7 * 24 * 3600
+
+# Максимальное число пользователей в кэше в памяти
+ENTITY_CACHE_SIZE = 100000
+
+# Число диалогов на странице при прогреве кэша
+DIALOGS_PAGE_SIZE = 100
+
+# Максимальное число аккаунтов, одновременно подключающихся при запуске
+STARTUP_CONCURRENCY = 10
+
+# Время жизни кэша данных аккаунта (get_me) для быстрого запуска, в секундах
+BOOTSTRAP_CACHE_TTL = 24 * 3600
+
+# Интервал повторной загрузки диалогов при запуске, в секундах
+DIALOGS_WARMUP_TTL = 6 * 3600
+
+# Директория для файлов логов
+LOG_DIR = 'logs'
+
+# Минимальный интервал между повторяющимися записями лога (обновление статуса и т.п.), в секундах
+LOG_SAMPLE_INTERVAL = 60
+
+# Максимальное число одновременных переподключений по всем аккаунтам
+RECONNECT_CONCURRENCY = 5
+
+# Начальная и максимальная задержка между попытками переподключения (в секундах)
+RECONNECT_BACKOFF_BASE = 1
+RECONNECT_BACKOFF_MAX = 120
+
+# Таймаут одной попытки подключения (в секундах)
+CONNECT_TIMEOUT = 30
+
+# Интервал и таймаут проверки соединения ping-запросом (в секундах)
+HEALTH_PROBE_INTERVAL = 60
+HEALTH_PROBE_TIMEOUT = 10
+
+# Порт HTTP-эндпоинта метрик Prometheus (0 — выключен, включается также флагом --metrics-port)
+METRICS_PORT = 0
+
+# Адрес, на котором слушает эндпоинт метрик
+METRICS_HOST = '127.0.0.1'
+
+# Контроль блокировок цикла событий (флаг --watchdog): порог блокировки в секундах,
+# интервал отчета о самых долгих блокировках, число мест в отчете и глубина сохраняемого стека
+WATCHDOG_THRESHOLD = 0.1
+WATCHDOG_REPORT_INTERVAL = 300
+WATCHDOG_TOP = 10
+WATCHDOG_STACK_DEPTH = 12
+
 # Путь к файлу с данными аккаунтов
 ACCOUNTS_FILE = 'telegram_accounts.json'
 
 # Настройки базы данных SQLite
 DB_FILE = 'message_history.db'
 
+# Максимальное число сообщений, записываемых в базу одной транзакцией
+DB_BATCH_SIZE = 500
+
+# Максимальная задержка записи сообщения в базу (в секундах)
+DB_FLUSH_INTERVAL = 0.5
+
+# Максимальный размер очереди сообщений на запись
+DB_QUEUE_SIZE = 100000
+
+# Число соединений только для чтения (запросы бота не ждут записи)
+DB_READ_POOL_SIZE = 4
+
+# Число профилей пользователей, которые поток записи помнит, чтобы не перезаписывать неизменившиеся строки users
+DB_PROFILE_CACHE_SIZE = 10000
+
+# Интервал записи времени последнего сообщения пользователей (накапливается в памяти), в секундах
+DB_LAST_SEEN_FLUSH_INTERVAL = 30
+
+# Хранилище сообщений: 'sqlite' — таблица messages в DB_FILE, 'segments' — журнал в сегментных файлах с чтением через mmap
+# (пользователи, статистика и кэши в обоих случаях остаются в DB_FILE)
+MESSAGE_STORE = 'sqlite'
+
+# Директория сегментных файлов журнала сообщений
+SEGMENT_DIR = 'segments'
+
+# Размер одного сегментного файла в мегабайтах
+SEGMENT_SIZE_MB = 64
+
+# Максимальное число сообщений на одной странице истории в боте
+HISTORY_PAGE_SIZE = 20
+
+# Хранение истории: сообщения старше RETENTION_DAYS дней переносятся в архив (0 — без ограничения).
+# Поиск /найти не просматривает архив
+RETENTION_DAYS = 0
+
+# Предельный размер данных основной базы в мегабайтах, сверх которого старые сообщения уходят в архив (0 — без ограничения)
+RETENTION_MAX_MB = 0
+
+# Директория помесячных архивных файлов истории
+ARCHIVE_DIR = 'archive'
+
+# Интервал проверки политик хранения (в секундах)
+RETENTION_INTERVAL = 3600
+
+# Число сообщений, переносимых в архив за один шаг
+RETENTION_BATCH_SIZE = 2000
+
+# Число страниц, освобождаемых за один шаг incremental_vacuum
+VACUUM_STEP_PAGES = 256
+
+# Пауза между шагами архивации и сжатия, чтобы не задерживать запись новых сообщений (в секундах)
+RETENTION_STEP_PAUSE = 0.2
+
+# Число строк, читаемых за один запрос при экспорте истории
+EXPORT_CHUNK_SIZE = 1000
+
 # Создание директории для логов, если её нет
 os.makedirs('logs', exist_ok=True)
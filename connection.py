@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import random
+import time
+
+from colorama import Fore, Style
+from telethon import functions
+
+from config import (ONLINE_UPDATE_INTERVAL, RECONNECT_BACKOFF_BASE, RECONNECT_BACKOFF_MAX,
+                    CONNECT_TIMEOUT, HEALTH_PROBE_INTERVAL, HEALTH_PROBE_TIMEOUT)
+from metrics import (ACCOUNT_CONNECTED, ACCOUNT_RECONNECTS, RECONNECT_ATTEMPTS, RECONNECT_DOWNTIME_SECONDS,
+                     HEALTH_PROBE_SECONDS, HEALTH_PROBE_FAILURES)
+
+logger = logging.getLogger('telegram_online')
+
+
+def backoff_delay(failures: int, base: float = RECONNECT_BACKOFF_BASE, cap: float = RECONNECT_BACKOFF_MAX) -> float:
+    """Экспоненциальная задержка со случайным разбросом (full jitter)."""
+    return random.uniform(0, min(cap, base * 2 ** (failures - 1)))
+
+
+class ConnectionSupervisor:
+    """Контроль подключения клиента одного аккаунта.
+
+    Раз в check_interval проверяет состояние клиента, а раз в probe_interval
+    отправляет ping: если ответа нет за probe_timeout, соединение считается
+    полуоткрытым и переустанавливается. Переподключения выполняются с
+    экспоненциальной задержкой со случайным разбросом, а их число
+    одновременно по всем аккаунтам ограничено общим семафором limit.
+    """
+
+    def __init__(self, client, phone, limit: asyncio.Semaphore, should_run, on_reconnected=None,
+                 check_interval: float = ONLINE_UPDATE_INTERVAL, probe_interval: float = HEALTH_PROBE_INTERVAL,
+                 probe_timeout: float = HEALTH_PROBE_TIMEOUT):
+        self.client = client
+        self.phone = phone
+        self.limit = limit
+        self.should_run = should_run
+        self.on_reconnected = on_reconnected
+        self.check_interval = check_interval
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+
+    async def run(self):
+        """Контроль подключения, пока should_run() возвращает True."""
+        phone = self.phone
+        failures = 0
+        down_since = None
+        next_probe = time.monotonic() + self.probe_interval
+
+        try:
+            while self.should_run():
+                connected = self.client.is_connected()
+                if connected and time.monotonic() >= next_probe:
+                    next_probe = time.monotonic() + self.probe_interval
+                    if not await self.probe():
+                        logger.warning(f"{Fore.YELLOW}[{phone}] Сервер не отвечает на ping, переподключение{Style.RESET_ALL}")
+                        await self._drop()
+                        connected = False
+                ACCOUNT_CONNECTED.set(int(connected), account=phone)
+
+                if connected:
+                    await asyncio.sleep(self.check_interval)
+                    continue
+
+                if down_since is None:
+                    down_since = time.monotonic()
+                    logger.warning(f"{Fore.YELLOW}[{phone}] Клиент не подключен{Style.RESET_ALL}")
+
+                if await self.reconnect():
+                    RECONNECT_DOWNTIME_SECONDS.observe(time.monotonic() - down_since, account=phone)
+                    logger.info(f"{Fore.GREEN}[{phone}] Клиент переподключен через "
+                                f"{time.monotonic() - down_since:.1f} с{Style.RESET_ALL}")
+                    failures = 0
+                    down_since = None
+                    next_probe = time.monotonic() + self.probe_interval
+                    if self.on_reconnected:
+                        self.on_reconnected()
+                    continue
+
+                failures += 1
+                delay = backoff_delay(failures)
+                logger.warning(f"{Fore.YELLOW}[{phone}] Попытка переподключения {failures} не удалась, "
+                               f"следующая через {delay:.1f} с{Style.RESET_ALL}",
+                               extra={'account': phone, 'sample_key': f'reconnect:{phone}'})
+                await self._sleep(delay)
+        finally:
+            ACCOUNT_CONNECTED.remove(account=phone)
+
+    async def probe(self) -> bool:
+        """Проверка, что соединение живое: ping с ограничением по времени."""
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(
+                self.client(functions.PingRequest(ping_id=random.getrandbits(63))),
+                self.probe_timeout
+            )
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            HEALTH_PROBE_FAILURES.inc(account=self.phone)
+            logger.error(f"{Fore.RED}[{self.phone}] Проверка соединения не удалась: {str(e) or 'таймаут'}{Style.RESET_ALL}")
+            return False
+        except Exception as e:
+            # Ошибка RPC означает, что сервер ответил — соединение работает
+            logger.warning(f"{Fore.YELLOW}[{self.phone}] Ошибка при проверке соединения: {e}{Style.RESET_ALL}")
+        HEALTH_PROBE_SECONDS.observe(time.monotonic() - started, account=self.phone)
+        return True
+
+    async def reconnect(self) -> bool:
+        """Одна попытка подключения с учетом общего ограничения на число переподключений."""
+        async with self.limit:
+            if not self.should_run():
+                return False
+            try:
+                await asyncio.wait_for(self.client.connect(), CONNECT_TIMEOUT)
+            except Exception as e:
+                RECONNECT_ATTEMPTS.inc(account=self.phone, result='error')
+                logger.error(f"{Fore.RED}[{self.phone}] Ошибка переподключения клиента: {str(e) or 'таймаут'}{Style.RESET_ALL}")
+                return False
+        if not self.client.is_connected():
+            RECONNECT_ATTEMPTS.inc(account=self.phone, result='error')
+            return False
+        RECONNECT_ATTEMPTS.inc(account=self.phone, result='ok')
+        ACCOUNT_RECONNECTS.inc(account=self.phone)
+        return True
+
+    async def _drop(self):
+        """Разрыв полуоткрытого соединения перед переподключением."""
+        try:
+            await asyncio.wait_for(self.client.disconnect(), CONNECT_TIMEOUT)
+        except Exception as e:
+            logger.error(f"{Fore.RED}[{self.phone}] Ошибка отключения клиента: {e}{Style.RESET_ALL}")
+
+    async def _sleep(self, delay: float):
+        """Ожидание с проверкой should_run, чтобы остановка не ждала конца задержки."""
+        deadline = time.monotonic() + delay
+        while self.should_run():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            await asyncio.sleep(min(remaining, self.check_interval))
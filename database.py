@@ -1,99 +1,930 @@
+import os
+import queue
+import re
 import sqlite3
 import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Dict, Any, Tuple, Optional
+from pathlib import Path
+from typing import List, Dict, Any, Tuple, Optional, Iterator, NamedTuple
 
-from config import DB_FILE
+from archive import ARCHIVE_SCHEMA, ArchiveStore
+from config import (DB_FILE, DB_BATCH_SIZE, DB_FLUSH_INTERVAL, DB_QUEUE_SIZE, DB_READ_POOL_SIZE, EXPORT_CHUNK_SIZE,
+                    DB_PROFILE_CACHE_SIZE, DB_LAST_SEEN_FLUSH_INTERVAL)
+from envelope import MEDIA_LABELS, MessageEnvelope
+from metrics import DB_SAVE_SECONDS, DB_WRITE_SECONDS, DB_BATCH_ROWS, DB_QUEUE_DEPTH
 
 logger = logging.getLogger('telegram_online')
 
+# Значение PRAGMA auto_vacuum для режима INCREMENTAL
+AUTO_VACUUM_INCREMENTAL = 2
+
+# Маркер остановки потока записи
+_STOP = object()
+
+# Настройки соединения для записи: WAL позволяет читать параллельно с записью
+WRITER_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -32000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA wal_autocheckpoint = 1000",
+)
+
+# Настройки соединений только для чтения
+READER_PRAGMAS = (
+    "PRAGMA query_only = 1",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA busy_timeout = 5000",
+)
+
+# Тип сообщения по сохраненному тексту: для медиа в истории хранится его подпись
+MEDIA_KIND_BY_LABEL = {label: kind for kind, label in MEDIA_LABELS.items()}
+_MEDIA_KIND_SQL = "CASE message_text " + " ".join(
+    f"WHEN '{label}' THEN '{kind}'" for kind, label in MEDIA_LABELS.items()
+) + " ELSE 'text' END"
+
+# Пересчет сводной статистики по контактам из таблицы {source}.messages.
+# Аккаунт, получивший сообщение, в истории не хранится, поэтому stats_account_daily
+# заполняется только при записи новых сообщений
+ROLLUP_BACKFILL = (
+    '''
+    INSERT INTO stats_daily (day, messages)
+    SELECT substr(timestamp, 1, 10), count(*) FROM {source}.messages WHERE timestamp IS NOT NULL GROUP BY 1
+    ON CONFLICT (day) DO UPDATE SET messages = messages + excluded.messages
+    ''',
+    '''
+    INSERT INTO stats_contact_daily (user_id, day, messages)
+    SELECT user_id, substr(timestamp, 1, 10), count(*) FROM {source}.messages WHERE timestamp IS NOT NULL GROUP BY 1, 2
+    ON CONFLICT (user_id, day) DO UPDATE SET messages = messages + excluded.messages
+    ''',
+    '''
+    INSERT INTO stats_contacts (user_id, first_seen, last_seen, messages)
+    SELECT user_id, min(timestamp), max(timestamp), count(*) FROM {source}.messages WHERE timestamp IS NOT NULL GROUP BY 1
+    ON CONFLICT (user_id) DO UPDATE SET first_seen = min(first_seen, excluded.first_seen),
+        last_seen = max(last_seen, excluded.last_seen), messages = messages + excluded.messages
+    ''',
+    '''
+    INSERT INTO stats_media (user_id, media_kind, messages)
+    SELECT user_id, {media_kind}, count(*) FROM {source}.messages WHERE timestamp IS NOT NULL GROUP BY 1, 2
+    ON CONFLICT (user_id, media_kind) DO UPDATE SET messages = messages + excluded.messages
+    ''',
+)
+ROLLUP_TABLES = ('stats_daily', 'stats_contact_daily', 'stats_contacts', 'stats_media')
+
+
+def rollup_backfill(source: str) -> List[str]:
+    """Запросы пересчета статистики из messages схемы source ('main' или подключенный архив)."""
+    return [statement.format(source=source, media_kind=_MEDIA_KIND_SQL) for statement in ROLLUP_BACKFILL]
+
+
+# Миграции схемы: (версия, список запросов). Текущая версия хранится в PRAGMA user_version
+MIGRATIONS = [
+    (1, [
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            phone TEXT,
+            last_message_time TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            message_text TEXT,
+            timestamp TIMESTAMP,
+            is_incoming BOOLEAN,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+    ]),
+    (2, [
+        "CREATE INDEX IF NOT EXISTS idx_users_username ON users (username)",
+        "CREATE INDEX IF NOT EXISTS idx_users_name ON users (lower(first_name), lower(last_name))",
+        "CREATE INDEX IF NOT EXISTS idx_messages_user_time ON messages (user_id, timestamp)",
+    ]),
+    # Полнотекстовый поиск: внешние FTS5-индексы, которые поддерживаются триггерами
+    (3, [
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            message_text, content='messages', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, message_text) VALUES (new.id, new.message_text);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, message_text) VALUES ('delete', old.id, old.message_text);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF message_text ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, message_text) VALUES ('delete', old.id, old.message_text);
+            INSERT INTO messages_fts (rowid, message_text) VALUES (new.id, new.message_text);
+        END
+        ''',
+        "INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')",
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+            username, first_name, last_name, content='users', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN
+            INSERT INTO users_fts (rowid, username, first_name, last_name)
+            VALUES (new.id, new.username, new.first_name, new.last_name);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN
+            INSERT INTO users_fts (users_fts, rowid, username, first_name, last_name)
+            VALUES ('delete', old.id, old.username, old.first_name, old.last_name);
+        END
+        ''',
+        # Индекс обновляется только при реальном изменении имени, а не на каждое сообщение
+        '''
+        CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF username, first_name, last_name ON users
+        WHEN old.username IS NOT new.username OR old.first_name IS NOT new.first_name
+             OR old.last_name IS NOT new.last_name
+        BEGIN
+            INSERT INTO users_fts (users_fts, rowid, username, first_name, last_name)
+            VALUES ('delete', old.id, old.username, old.first_name, old.last_name);
+            INSERT INTO users_fts (rowid, username, first_name, last_name)
+            VALUES (new.id, new.username, new.first_name, new.last_name);
+        END
+        ''',
+        "INSERT INTO users_fts (users_fts) VALUES ('rebuild')",
+    ]),
+    # Общий для всех аккаунтов кэш сущностей и состояние прогрева диалогов
+    (4, [
+        '''
+        CREATE TABLE IF NOT EXISTS entities (
+            id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            phone TEXT,
+            bot BOOLEAN,
+            updated_at REAL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS dialog_pages (
+            account TEXT,
+            page INTEGER,
+            hash INTEGER,
+            offset_date INTEGER,
+            offset_id INTEGER,
+            offset_peer_id INTEGER,
+            is_last BOOLEAN,
+            PRIMARY KEY (account, page)
+        )
+        ''',
+    ]),
+    # Кэш данных аккаунтов для быстрого запуска без get_me и проверки авторизации
+    (5, [
+        '''
+        CREATE TABLE IF NOT EXISTS account_bootstrap (
+            session_file TEXT PRIMARY KEY,
+            user_id INTEGER,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            phone TEXT,
+            dialogs_warmed_at REAL,
+            updated_at REAL
+        )
+        ''',
+    ]),
+    # Освобождение места после архивации небольшими шагами (PRAGMA incremental_vacuum).
+    # Новая база создается сразу в режиме INCREMENTAL (см. create_tables); существующую
+    # переводит полный VACUUM, который запускается отдельно: --compact-db
+    (6, [
+        "CREATE INDEX IF NOT EXISTS idx_messages_time ON messages (timestamp, id)",
+    ]),
+    # Сводная статистика, обновляемая вместе с записью сообщений (см. _update_rollups)
+    (7, [
+        "CREATE TABLE IF NOT EXISTS stats_daily (day TEXT PRIMARY KEY, messages INTEGER)",
+        '''
+        CREATE TABLE IF NOT EXISTS stats_account_daily (
+            account TEXT,
+            day TEXT,
+            messages INTEGER,
+            PRIMARY KEY (account, day)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS stats_contact_daily (
+            user_id INTEGER,
+            day TEXT,
+            messages INTEGER,
+            PRIMARY KEY (user_id, day)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS stats_contacts (
+            user_id INTEGER PRIMARY KEY,
+            first_seen TIMESTAMP,
+            last_seen TIMESTAMP,
+            messages INTEGER
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_stats_contacts_messages ON stats_contacts (messages)",
+        '''
+        CREATE TABLE IF NOT EXISTS stats_media (
+            user_id INTEGER,
+            media_kind TEXT,
+            messages INTEGER,
+            PRIMARY KEY (user_id, media_kind)
+        )
+        ''',
+        # Первичное заполнение статистики из уже накопленной истории
+        *rollup_backfill('main'),
+    ]),
+]
+
+
+class WriteJob(NamedTuple):
+    """Запись через поток записи: запрос и параметры для executemany."""
+    sql: str
+    rows: list
+
+
+class CallJob(NamedTuple):
+    """Обслуживание базы в потоке записи: function(conn) вне транзакции пакета."""
+    function: Any
+    future: Future
+
+
+# Поля строк экспорта сообщений и пользователей
+EXPORT_MESSAGE_FIELDS = ('id', 'user_id', 'username', 'first_name', 'last_name', 'message_text', 'timestamp', 'is_incoming')
+EXPORT_USER_FIELDS = ('id', 'username', 'first_name', 'last_name', 'phone', 'last_message_time')
+
+
+def build_fts_query(text: str, prefix: bool = True) -> str:
+    """Преобразование пользовательского запроса в запрос FTS5.
+
+    Каждое слово берется в кавычки, чтобы спецсимволы FTS5 не ломали запрос,
+    и при prefix=True ищется как префикс. Слова объединяются через AND.
+    """
+    tokens = re.findall(r'\w+', text)
+    suffix = '*' if prefix else ''
+    return ' '.join(f'"{token}"{suffix}' for token in tokens)
+
+
+class ReadConnectionPool:
+    """Пул соединений только для чтения.
+
+    В режиме WAL читатели не ждут завершения записи, поэтому запросы бота
+    выполняются на отдельных соединениях, не пересекаясь с потоком записи.
+    """
+    
+    def __init__(self, db_file: str, size: int = DB_READ_POOL_SIZE):
+        self.uri = f"{Path(db_file).absolute().as_uri()}?mode=ro"
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+    
+    def _open(self):
+        conn = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma in READER_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+    
+    @contextmanager
+    def connection(self):
+        """Получение соединения из пула на время запроса."""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._created < self.size
+                if can_open:
+                    self._created += 1
+            # Пул исчерпан — ждем освобождения соединения
+            conn = self._open() if can_open else self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+    
+    def close(self):
+        """Закрытие всех свободных соединений пула."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        self._created = 0
+
+
+class ProfileCache:
+    """Ограниченный LRU-кэш профилей пользователей, уже записанных в users.
+    
+    Профиль — (username, first_name, last_name, phone). Используется только
+    потоком записи, поэтому без блокировок; обновляется после фиксации
+    транзакции, чтобы не расходиться с базой при ошибке записи.
+    """
+    
+    def __init__(self, size: int = DB_PROFILE_CACHE_SIZE):
+        self.size = size
+        self._profiles = OrderedDict()
+    
+    def matches(self, user_id: int, profile: tuple) -> bool:
+        """Совпадает ли профиль с записанным в базу."""
+        stored = self._profiles.get(user_id)
+        if stored is None:
+            return False
+        self._profiles.move_to_end(user_id)
+        return stored == profile
+    
+    def put(self, user_id: int, profile: tuple):
+        self._profiles[user_id] = profile
+        self._profiles.move_to_end(user_id)
+        if len(self._profiles) > self.size:
+            self._profiles.popitem(last=False)
+
+
 class MessageDatabase:
-    def __init__(self):
+    def __init__(self, batch_size: int = DB_BATCH_SIZE, flush_interval: float = DB_FLUSH_INTERVAL):
         """Инициализация базы данных сообщений."""
         self.conn = None
-        self.cursor = None
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=DB_QUEUE_SIZE)
+        self._writer = None
+        self.archive = ArchiveStore()
+        # Состояние потока записи: известные профили и накопленное время последних сообщений
+        self.profiles = ProfileCache()
+        self._last_seen = {}
+        self._last_seen_due = time.monotonic() + DB_LAST_SEEN_FLUSH_INTERVAL
         self.connect()
         self.create_tables()
+        self.readers = ReadConnectionPool(DB_FILE)
+        self.start_writer()
     
     def connect(self):
-        """Подключение к базе данных."""
+        """Подключение к базе данных (соединение для записи)."""
         try:
-            self.conn = sqlite3.connect(DB_FILE)
+            # После миграций соединение используется только потоком записи
+            self.conn = sqlite3.connect(DB_FILE, check_same_thread=False)
             self.conn.row_factory = sqlite3.Row
-            self.cursor = self.conn.cursor()
+            # Режим auto_vacuum задается до перевода новой базы в WAL и создания таблиц;
+            # у существующей базы он меняется только полным VACUUM (compact)
+            self.conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            for pragma in WRITER_PRAGMAS:
+                self.conn.execute(pragma)
             logger.info(f"Подключение к базе данных {DB_FILE} установлено")
         except Exception as e:
             logger.error(f"Ошибка подключения к базе данных: {e}")
     
     def create_tables(self):
-        """Создание необходимых таблиц, если они не существуют."""
-        try:
-            # Таблица для пользователей
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    first_name TEXT,
-                    last_name TEXT,
-                    phone TEXT,
-                    last_message_time TIMESTAMP
-                )
-            ''')
-            
-            # Таблица для сообщений
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS messages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    message_text TEXT,
-                    timestamp TIMESTAMP,
-                    is_incoming BOOLEAN,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            ''')
-            
-            self.conn.commit()
-            logger.info("Таблицы базы данных успешно созданы")
+        """Создание таблиц и применение недостающих миграций схемы."""
+        try:
+            version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+            for target, statements in MIGRATIONS:
+                if target <= version:
+                    continue
+                with self.conn:
+                    for statement in statements:
+                        self.conn.execute(statement)
+                    self.conn.execute(f"PRAGMA user_version = {target}")
+                version = target
+                logger.info(f"Схема базы данных обновлена до версии {target}")
+            logger.info(f"Таблицы базы данных готовы (версия схемы {version})")
+            if self.conn.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+                logger.warning(f"База данных {DB_FILE} не в режиме auto_vacuum = INCREMENTAL: место после архивации "
+                               f"не возвращается. Однократно выполните python telegram_online.py --compact-db")
         except Exception as e:
             logger.error(f"Ошибка создания таблиц базы данных: {e}")
     
+    def start_writer(self):
+        """Запуск фонового потока записи сообщений."""
+        if self._writer and self._writer.is_alive():
+            return
+        self._writer = threading.Thread(target=self._writer_loop, name='db-writer', daemon=True)
+        self._writer.start()
+        DB_QUEUE_DEPTH.set_function(self._queue.qsize)
+    
     def save_message(self, user_id: int, username: str, first_name: str = "", 
                     last_name: str = "", phone: str = "", message_text: str = "", 
                     is_incoming: bool = True):
-        """Сохранение сообщения в базе данных."""
+        """Постановка сообщения в очередь на запись (не блокирует вызывающий поток)."""
+        try:
+            with DB_SAVE_SECONDS.time():
+                self._queue.put_nowait(
+                    (user_id, username, first_name, last_name, phone, message_text, datetime.now(), is_incoming)
+                )
+            return True
+        except queue.Full:
+            logger.error("Ошибка сохранения сообщения: очередь записи переполнена")
+            return False
+    
+    def save_envelope(self, envelope: MessageEnvelope) -> bool:
+        """Постановка входящего сообщения в очередь на запись без преобразования."""
+        try:
+            with DB_SAVE_SECONDS.time():
+                self._queue.put_nowait(envelope)
+            return True
+        except queue.Full:
+            logger.error("Ошибка сохранения сообщения: очередь записи переполнена")
+            return False
+    
+    def enqueue_write(self, sql: str, rows: list) -> bool:
+        """Постановка произвольной записи в очередь потока записи."""
         try:
-            current_time = datetime.now()
+            self._queue.put_nowait(WriteJob(sql, rows))
+            return True
+        except queue.Full:
+            logger.error("Ошибка записи в базу данных: очередь записи переполнена")
+            return False
+    
+    def flush(self, timeout: float = None) -> bool:
+        """Ожидание записи всех сообщений, поставленных в очередь до вызова."""
+        if not (self._writer and self._writer.is_alive()):
+            return False
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+    
+    def _writer_loop(self):
+        """Поток записи: собирает сообщения из очереди в пакеты и пишет каждый пакет одной транзакцией."""
+        conn = self.conn
+        stopping = False
+        while not stopping:
+            try:
+                # Пока есть накопленное время последних сообщений, не ждем дольше срока его записи
+                item = self._queue.get(timeout=max(0, self._last_seen_due - time.monotonic()) if self._last_seen else None)
+            except queue.Empty:
+                self._flush_last_seen(conn)
+                continue
+            batch = []
+            waiters = []
+            deadline = time.monotonic() + self.flush_interval
             
-            # Проверяем, существует ли пользователь
-            self.cursor.execute(
-                "SELECT id FROM users WHERE id = ?", (user_id,)
-            )
-            user_exists = self.cursor.fetchone()
+            while True:
+                if item is _STOP:
+                    stopping = True
+                    break
+                if isinstance(item, (threading.Event, CallJob)):
+                    # Запрос flush или обслуживания: записываем накопленное без ожидания
+                    waiters.append(item)
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
             
-            # Если пользователя нет, добавляем его
-            if not user_exists:
-                self.cursor.execute(
-                    "INSERT INTO users (id, username, first_name, last_name, phone, last_message_time) VALUES (?, ?, ?, ?, ?, ?)",
-                    (user_id, username, first_name, last_name, phone, current_time)
+            if batch:
+                self._write_batch(conn, batch)
+            if stopping or waiters or time.monotonic() >= self._last_seen_due:
+                self._flush_last_seen(conn)
+            for waiter in waiters:
+                if isinstance(waiter, CallJob):
+                    self._run_call(conn, waiter)
+                else:
+                    waiter.set()
+    
+    @staticmethod
+    def _run_call(conn, job: CallJob):
+        if not job.future.set_running_or_notify_cancel():
+            return
+        try:
+            job.future.set_result(job.function(conn))
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            job.future.set_exception(e)
+    
+    def run_in_writer(self, function) -> Future:
+        """Выполнение function(conn) в потоке записи между пакетами сообщений.
+        
+        Так обслуживание базы не конкурирует с записью за блокировку, а
+        сообщения, пришедшие во время шага, просто ждут в очереди.
+        """
+        future = Future()
+        if not (self._writer and self._writer.is_alive()):
+            future.set_exception(RuntimeError("поток записи не запущен"))
+            return future
+        self._queue.put(CallJob(function, future))
+        return future
+    
+    def archive_messages(self, limit: int, cutoff: Optional[str] = None) -> Future:
+        """Перенос до limit самых старых сообщений (старше cutoff, если задан) в архив.
+        
+        Результат future — число перенесенных сообщений.
+        """
+        return self.run_in_writer(lambda conn: self._archive_batch(conn, limit, cutoff))
+    
+    def incremental_vacuum(self, pages: int) -> Future:
+        """Освобождение до pages свободных страниц; результат — число оставшихся свободных страниц."""
+        def step(conn):
+            conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+            return conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return self.run_in_writer(step)
+    
+    def compact(self) -> Future:
+        """Перевод базы в режим auto_vacuum = INCREMENTAL полным VACUUM.
+        
+        VACUUM переписывает файл целиком и на все время останавливает запись,
+        поэтому выполняется только по отдельной команде. Результат future —
+        размер файла базы после сжатия в байтах.
+        """
+        def vacuum(conn):
+            size = os.path.getsize(DB_FILE)
+            logger.warning(f"Полный VACUUM базы данных {DB_FILE} ({size / 1024 / 1024:.1f} МБ): "
+                           f"запись остановлена до его завершения")
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            return os.path.getsize(DB_FILE)
+        return self.run_in_writer(vacuum)
+    
+    def storage_stats(self) -> Future:
+        """Размер данных основной базы: страницы, свободные страницы и режим auto_vacuum."""
+        return self.run_in_writer(self._storage_stats)
+    
+    @staticmethod
+    def _storage_stats(conn) -> Dict[str, int]:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return {
+            'used_bytes': (page_count - freelist) * page_size,
+            'free_pages': freelist,
+            'auto_vacuum': conn.execute("PRAGMA auto_vacuum").fetchone()[0],
+        }
+    
+    def _archive_batch(self, conn, limit: int, cutoff: Optional[str]) -> int:
+        """Перенос пакета сообщений в помесячные архивные файлы (выполняется в потоке записи)."""
+        query = "SELECT id, substr(timestamp, 1, 7) AS month FROM messages WHERE timestamp IS NOT NULL"
+        params = []
+        if cutoff is not None:
+            query += " AND timestamp < ?"
+            params.append(cutoff)
+        query += " ORDER BY timestamp, id LIMIT ?"
+        params.append(limit)
+        
+        months = {}
+        for row in conn.execute(query, params):
+            months.setdefault(row['month'], []).append((row['id'],))
+        if not months:
+            return 0
+        
+        os.makedirs(self.archive.archive_dir, exist_ok=True)
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS archive_ids (id INTEGER PRIMARY KEY)")
+        moved = 0
+        for month, ids in sorted(months.items()):
+            conn.execute("ATTACH DATABASE ? AS archive", (self.archive.path_for(month),))
+            try:
+                for statement in ARCHIVE_SCHEMA:
+                    conn.execute(statement.format(schema='archive'))
+                # Основная база в режиме WAL, поэтому транзакция не атомарна между файлами;
+                # INSERT OR IGNORE делает повтор после сбоя безопасным
+                with conn:
+                    conn.execute("DELETE FROM temp.archive_ids")
+                    conn.executemany("INSERT INTO temp.archive_ids (id) VALUES (?)", ids)
+                    conn.execute(
+                        "INSERT OR IGNORE INTO archive.messages (id, user_id, message_text, timestamp, is_incoming) "
+                        "SELECT id, user_id, message_text, timestamp, is_incoming FROM main.messages "
+                        "WHERE id IN (SELECT id FROM temp.archive_ids)"
+                    )
+                    moved += conn.execute(
+                        "DELETE FROM main.messages WHERE id IN (SELECT id FROM temp.archive_ids)"
+                    ).rowcount
+                    conn.execute("DELETE FROM temp.archive_ids")
+            finally:
+                conn.execute("DETACH DATABASE archive")
+        return moved
+    
+    def _write_batch(self, conn, batch):
+        """Запись пакета сообщений и прочих записей одной транзакцией."""
+        jobs = [item for item in batch if isinstance(item, WriteJob)]
+        if jobs:
+            batch = [item for item in batch if not isinstance(item, WriteJob)]
+        # Для статистики: (ID отправителя, время, аккаунт, тип сообщения)
+        stats = [
+            (item.sender_id, item.received_at, item.account or "", item.media_kind or 'text')
+            if isinstance(item, MessageEnvelope) else
+            (item[0], item[6], "", MEDIA_KIND_BY_LABEL.get(item[5], 'text'))
+            for item in batch
+        ]
+        # Конверты сообщений приводятся к строке таблицы уже в потоке записи
+        batch = [
+            (item.sender_id, item.username or "", item.first_name, item.last_name, "",
+             item.notification_text, item.received_at, True)
+            if isinstance(item, MessageEnvelope) else item
+            for item in batch
+        ]
+        
+        # Для пользователя достаточно последних данных из пакета; строка users
+        # записывается, только если профиль отличается от уже записанного
+        users = {}
+        for user_id, username, first_name, last_name, phone, _, current_time, _ in batch:
+            users[user_id] = ((username, first_name, last_name, phone), current_time)
+        changed = [
+            (user_id, *profile, current_time)
+            for user_id, (profile, current_time) in users.items()
+            if not self.profiles.matches(user_id, profile)
+        ]
+        
+        try:
+            with conn:
+                started = time.perf_counter()
+                for job in jobs:
+                    conn.executemany(job.sql, job.rows)
+                # Профиль, которого нет в кэше (например, после перезапуска), может
+                # совпадать с записанным — тогда строка не изменяется
+                conn.executemany(
+                    "INSERT INTO users (id, username, first_name, last_name, phone, last_message_time) VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (id) DO UPDATE SET username = excluded.username, first_name = excluded.first_name, "
+                    "last_name = excluded.last_name, phone = excluded.phone "
+                    "WHERE username IS NOT excluded.username OR first_name IS NOT excluded.first_name "
+                    "OR last_name IS NOT excluded.last_name OR phone IS NOT excluded.phone",
+                    changed
                 )
-            else:
-                # Обновляем информацию о пользователе
-                self.cursor.execute(
-                    "UPDATE users SET username = ?, first_name = ?, last_name = ?, phone = ?, last_message_time = ? WHERE id = ?",
-                    (username, first_name, last_name, phone, current_time, user_id)
+                self._insert_messages(conn, batch)
+                self._update_rollups(conn, stats)
+            DB_WRITE_SECONDS.observe(time.perf_counter() - started)
+            DB_BATCH_ROWS.observe(len(batch))
+        except Exception as e:
+            logger.error(f"Ошибка сохранения пакета сообщений ({len(batch)} шт.): {e}")
+            return
+        
+        for user_id, (profile, current_time) in users.items():
+            self.profiles.put(user_id, profile)
+            self._last_seen[user_id] = current_time
+    
+    def _insert_messages(self, conn, batch):
+        """Запись строк сообщений пакета (в транзакции пакета)."""
+        conn.executemany(
+            "INSERT INTO messages (user_id, message_text, timestamp, is_incoming) VALUES (?, ?, ?, ?)",
+            [(rec[0], rec[5], rec[6], rec[7]) for rec in batch]
+        )
+    
+    def _flush_last_seen(self, conn):
+        """Запись накопленного времени последних сообщений одной транзакцией."""
+        self._last_seen_due = time.monotonic() + DB_LAST_SEEN_FLUSH_INTERVAL
+        if not self._last_seen:
+            return
+        rows = [(moment, user_id, moment) for user_id, moment in self._last_seen.items()]
+        try:
+            with conn:
+                conn.executemany(
+                    "UPDATE users SET last_message_time = ? WHERE id = ? "
+                    "AND (last_message_time IS NULL OR last_message_time < ?)",
+                    rows
                 )
-            
-            # Добавляем сообщение
-            self.cursor.execute(
-                "INSERT INTO messages (user_id, message_text, timestamp, is_incoming) VALUES (?, ?, ?, ?)",
-                (user_id, message_text, current_time, is_incoming)
-            )
-            
-            self.conn.commit()
-            return True
+            self._last_seen.clear()
         except Exception as e:
-            logger.error(f"Ошибка сохранения сообщения: {e}")
-            return False
+            logger.error(f"Ошибка записи времени последних сообщений ({len(rows)} шт.): {e}")
+    
+    @staticmethod
+    def _update_rollups(conn, stats):
+        """Обновление сводной статистики пакетом в транзакции записи сообщений.
+        
+        Счетчики сначала суммируются в памяти, поэтому на пакет приходится
+        по одному UPSERT на день, контакт и тип сообщения, а не на сообщение.
+        """
+        daily, account_daily, contact_daily, contacts, media = {}, {}, {}, {}, {}
+        for user_id, moment, account, media_kind in stats:
+            day = str(moment)[:10]
+            daily[day] = daily.get(day, 0) + 1
+            account_daily[account, day] = account_daily.get((account, day), 0) + 1
+            contact_daily[user_id, day] = contact_daily.get((user_id, day), 0) + 1
+            media[user_id, media_kind] = media.get((user_id, media_kind), 0) + 1
+            first, last, count = contacts.get(user_id, (moment, moment, 0))
+            contacts[user_id] = (min(first, moment), max(last, moment), count + 1)
+        
+        conn.executemany(
+            "INSERT INTO stats_daily (day, messages) VALUES (?, ?) "
+            "ON CONFLICT (day) DO UPDATE SET messages = messages + excluded.messages",
+            daily.items()
+        )
+        conn.executemany(
+            "INSERT INTO stats_account_daily (account, day, messages) VALUES (?, ?, ?) "
+            "ON CONFLICT (account, day) DO UPDATE SET messages = messages + excluded.messages",
+            [(account, day, count) for (account, day), count in account_daily.items()]
+        )
+        conn.executemany(
+            "INSERT INTO stats_contact_daily (user_id, day, messages) VALUES (?, ?, ?) "
+            "ON CONFLICT (user_id, day) DO UPDATE SET messages = messages + excluded.messages",
+            [(user_id, day, count) for (user_id, day), count in contact_daily.items()]
+        )
+        conn.executemany(
+            "INSERT INTO stats_contacts (user_id, first_seen, last_seen, messages) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (user_id) DO UPDATE SET first_seen = min(first_seen, excluded.first_seen), "
+            "last_seen = max(last_seen, excluded.last_seen), messages = messages + excluded.messages",
+            [(user_id, str(first), str(last), count) for user_id, (first, last, count) in contacts.items()]
+        )
+        conn.executemany(
+            "INSERT INTO stats_media (user_id, media_kind, messages) VALUES (?, ?, ?) "
+            "ON CONFLICT (user_id, media_kind) DO UPDATE SET messages = messages + excluded.messages",
+            [(user_id, kind, count) for (user_id, kind), count in media.items()]
+        )
+    
+    def rebuild_stats(self) -> Future:
+        """Пересчет статистики по контактам из истории, включая архив.
+        
+        Выполняется одним заданием в потоке записи, чтобы сообщения, пришедшие
+        во время пересчета, не были учтены дважды; они ждут в очереди записи.
+        Дневная статистика по аккаунтам не пересчитывается — аккаунт в истории
+        не хранится. Результат future — число учтенных сообщений.
+        """
+        def rebuild(conn):
+            with conn:
+                for table in ROLLUP_TABLES:
+                    conn.execute(f"DELETE FROM {table}")
+            for month in self.archive.months():
+                conn.execute("ATTACH DATABASE ? AS archive", (self.archive.path_for(month),))
+                try:
+                    with conn:
+                        for statement in rollup_backfill('archive'):
+                            conn.execute(statement)
+                finally:
+                    conn.execute("DETACH DATABASE archive")
+            self._backfill_rollups(conn)
+            return conn.execute("SELECT coalesce(sum(messages), 0) FROM stats_daily").fetchone()[0]
+        return self.run_in_writer(rebuild)
+    
+    def _backfill_rollups(self, conn):
+        """Пересчет статистики по сообщениям основной базы (после архива)."""
+        with conn:
+            for statement in rollup_backfill('main'):
+                conn.execute(statement)
+    
+    def get_daily_totals(self, since_day: str) -> Dict[str, int]:
+        """Число сообщений по дням начиная с since_day ('YYYY-MM-DD')."""
+        try:
+            with self.readers.connection() as conn:
+                rows = conn.execute(
+                    "SELECT day, messages FROM stats_daily WHERE day >= ? ORDER BY day", (since_day,)
+                ).fetchall()
+            return {row['day']: row['messages'] for row in rows}
+        except Exception as e:
+            logger.error(f"Ошибка получения статистики: {e}")
+            return {}
+    
+    def get_account_totals(self, since_day: str) -> Dict[str, int]:
+        """Число сообщений по аккаунтам начиная с since_day."""
+        try:
+            with self.readers.connection() as conn:
+                rows = conn.execute(
+                    "SELECT account, sum(messages) AS messages FROM stats_account_daily WHERE day >= ? "
+                    "GROUP BY account ORDER BY messages DESC", (since_day,)
+                ).fetchall()
+            return {row['account']: row['messages'] for row in rows}
+        except Exception as e:
+            logger.error(f"Ошибка получения статистики аккаунтов: {e}")
+            return {}
+    
+    def get_top_contacts(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """Контакты с наибольшим числом сообщений за все время."""
+        try:
+            with self.readers.connection() as conn:
+                rows = conn.execute(
+                    "SELECT s.user_id, s.first_seen, s.last_seen, s.messages, u.username, u.first_name, u.last_name "
+                    "FROM stats_contacts s LEFT JOIN users u ON u.id = s.user_id "
+                    "ORDER BY s.messages DESC LIMIT ?", (limit,)
+                ).fetchall()
+            return [dict(row) for row in rows]
+        except Exception as e:
+            logger.error(f"Ошибка получения статистики контактов: {e}")
+            return []
+    
+    def get_contact_stats(self, user_id: int, since_day: str) -> Optional[Dict[str, Any]]:
+        """Статистика контакта: итоги, сообщения по дням с since_day и по типам."""
+        try:
+            with self.readers.connection() as conn:
+                total = conn.execute("SELECT * FROM stats_contacts WHERE user_id = ?", (user_id,)).fetchone()
+                if not total:
+                    return None
+                daily = conn.execute(
+                    "SELECT day, messages FROM stats_contact_daily WHERE user_id = ? AND day >= ? ORDER BY day",
+                    (user_id, since_day)
+                ).fetchall()
+                media = conn.execute(
+                    "SELECT media_kind, messages FROM stats_media WHERE user_id = ? ORDER BY messages DESC",
+                    (user_id,)
+                ).fetchall()
+            result = dict(total)
+            result['daily'] = {row['day']: row['messages'] for row in daily}
+            result['media'] = {row['media_kind']: row['messages'] for row in media}
+            return result
+        except Exception as e:
+            logger.error(f"Ошибка получения статистики контакта: {e}")
+            return None
+    
+    def save_entities(self, rows: List[Tuple]) -> bool:
+        """Сохранение сущностей (id, username, first_name, last_name, phone, bot, updated_at) в кэш."""
+        return self.enqueue_write(
+            '''
+            INSERT INTO entities (id, username, first_name, last_name, phone, bot, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                username = excluded.username, first_name = excluded.first_name,
+                last_name = excluded.last_name, phone = excluded.phone,
+                bot = excluded.bot, updated_at = excluded.updated_at
+            ''',
+            rows
+        )
+    
+    def load_entities(self, updated_after: float, limit: int) -> List[Dict[str, Any]]:
+        """Загрузка сущностей, обновленных не раньше updated_after, начиная с самых свежих."""
+        try:
+            with self.readers.connection() as conn:
+                rows = conn.execute(
+                    "SELECT * FROM entities WHERE updated_at >= ? ORDER BY updated_at DESC LIMIT ?",
+                    (updated_after, limit)
+                ).fetchall()
+            return [dict(row) for row in rows]
+        except Exception as e:
+            logger.error(f"Ошибка загрузки кэша сущностей: {e}")
+            return []
+    
+    def get_dialog_pages(self, account: str) -> Dict[int, Dict[str, Any]]:
+        """Сохраненное состояние страниц диалогов аккаунта: номер страницы -> данные."""
+        try:
+            with self.readers.connection() as conn:
+                rows = conn.execute(
+                    "SELECT * FROM dialog_pages WHERE account = ?", (account,)
+                ).fetchall()
+            return {row['page']: dict(row) for row in rows}
+        except Exception as e:
+            logger.error(f"Ошибка загрузки состояния диалогов: {e}")
+            return {}
+    
+    def save_dialog_page(self, account: str, page: int, page_hash: int, offset_date: int,
+                         offset_id: int, offset_peer_id: int, is_last: bool) -> bool:
+        """Сохранение хэша и смещений страницы диалогов."""
+        return self.enqueue_write(
+            "INSERT OR REPLACE INTO dialog_pages (account, page, hash, offset_date, offset_id, offset_peer_id, is_last) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(account, page, page_hash, offset_date, offset_id, offset_peer_id, is_last)]
+        )
+    
+    def get_bootstrap(self, session_file: str) -> Optional[Dict[str, Any]]:
+        """Сохраненные данные аккаунта для быстрого запуска или None."""
+        try:
+            with self.readers.connection() as conn:
+                row = conn.execute(
+                    "SELECT * FROM account_bootstrap WHERE session_file = ?", (session_file,)
+                ).fetchone()
+            return dict(row) if row else None
+        except Exception as e:
+            logger.error(f"Ошибка загрузки данных запуска аккаунта: {e}")
+            return None
+    
+    def save_bootstrap(self, session_file: str, me) -> bool:
+        """Сохранение результата get_me; время прогрева диалогов сохраняется."""
+        return self.enqueue_write(
+            '''
+            INSERT INTO account_bootstrap (session_file, user_id, username, first_name, last_name, phone, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(session_file) DO UPDATE SET
+                user_id = excluded.user_id, username = excluded.username,
+                first_name = excluded.first_name, last_name = excluded.last_name,
+                phone = excluded.phone, updated_at = excluded.updated_at
+            ''',
+            [(session_file, me.id, me.username, me.first_name, me.last_name, me.phone, time.time())]
+        )
+    
+    def mark_dialogs_warmed(self, session_file: str) -> bool:
+        """Отметка о загрузке диалогов аккаунта."""
+        return self.enqueue_write(
+            "UPDATE account_bootstrap SET dialogs_warmed_at = ? WHERE session_file = ?",
+            [(time.time(), session_file)]
+        )
+    
+    def delete_bootstrap(self, session_file: str) -> bool:
+        """Удаление данных запуска, например, если сессия стала недействительной."""
+        return self.enqueue_write(
+            "DELETE FROM account_bootstrap WHERE session_file = ?", [(session_file,)]
+        )
     
     def get_user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
         """Получение пользователя по его username."""
@@ -102,10 +933,10 @@ class MessageDatabase:
             if username.startswith('@'):
                 username = username[1:]
             
-            self.cursor.execute(
-                "SELECT * FROM users WHERE username = ?", (username,)
-            )
-            user = self.cursor.fetchone()
+            with self.readers.connection() as conn:
+                user = conn.execute(
+                    "SELECT * FROM users WHERE username = ?", (username,)
+                ).fetchone()
             
             if user:
                 return dict(user)
@@ -114,35 +945,248 @@ class MessageDatabase:
             logger.error(f"Ошибка получения пользователя по username: {e}")
             return None
     
-    def get_messages_by_user_id(self, user_id: int, limit: int = 100) -> List[Dict[str, Any]]:
-        """Получение истории сообщений для указанного пользователя."""
+    def get_users_by_name(self, name: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Поиск пользователей по имени или по имени и фамилии."""
         try:
-            self.cursor.execute(
-                "SELECT * FROM messages WHERE user_id = ? ORDER BY timestamp ASC LIMIT ?",
-                (user_id, limit)
-            )
-            messages = self.cursor.fetchall()
+            parts = name.split(maxsplit=1)
+            if not parts:
+                return []
+            
+            # lower() в SQLite меняет регистр только латиницы, поэтому для
+            # кириллицы дополнительно проверяем написание с заглавной буквы
+            def variants(value):
+                return list(dict.fromkeys((value, value.lower(), value.capitalize())))
+            
+            first = variants(parts[0])
+            query = f"SELECT * FROM users WHERE lower(first_name) IN ({', '.join('?' * len(first))})"
+            params = first
+            if len(parts) > 1:
+                last = variants(parts[1])
+                query += f" AND lower(last_name) IN ({', '.join('?' * len(last))})"
+                params = first + last
+            
+            with self.readers.connection() as conn:
+                users = conn.execute(
+                    query + " ORDER BY last_message_time DESC LIMIT ?", (*params, limit)
+                ).fetchall()
             
+            return [dict(user) for user in users]
+        except Exception as e:
+            logger.error(f"Ошибка поиска пользователей по имени: {e}")
+            return []
+    
+    def search_users(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Полнотекстовый поиск пользователей по username, имени и фамилии."""
+        fts_query = build_fts_query(query.lstrip('@'))
+        if not fts_query:
+            return []
+        try:
+            with self.readers.connection() as conn:
+                users = conn.execute(
+                    '''
+                    SELECT u.* FROM users_fts
+                    JOIN users u ON u.id = users_fts.rowid
+                    WHERE users_fts MATCH ?
+                    ORDER BY bm25(users_fts, 2.0, 1.0, 1.0)
+                    LIMIT ?
+                    ''',
+                    (fts_query, limit)
+                ).fetchall()
+            return [dict(user) for user in users]
+        except Exception as e:
+            logger.error(f"Ошибка полнотекстового поиска пользователей: {e}")
+            return []
+    
+    def search_messages(self, query: str, limit: int = 20, prefix: bool = True) -> List[Dict[str, Any]]:
+        """Полнотекстовый поиск по истории сообщений с данными контакта, по убыванию релевантности."""
+        fts_query = build_fts_query(query, prefix)
+        if not fts_query:
+            return []
+        try:
+            with self.readers.connection() as conn:
+                messages = conn.execute(
+                    '''
+                    SELECT m.*, u.username, u.first_name, u.last_name
+                    FROM messages_fts
+                    JOIN messages m ON m.id = messages_fts.rowid
+                    LEFT JOIN users u ON u.id = m.user_id
+                    WHERE messages_fts MATCH ?
+                    ORDER BY bm25(messages_fts)
+                    LIMIT ?
+                    ''',
+                    (fts_query, limit)
+                ).fetchall()
             return [dict(message) for message in messages]
+        except Exception as e:
+            logger.error(f"Ошибка полнотекстового поиска сообщений: {e}")
+            return []
+    
+    def get_messages_by_user_id(self, user_id: int, limit: int = 100,
+                                include_archive: bool = False) -> List[Dict[str, Any]]:
+        """Получение истории сообщений для указанного пользователя.
+        
+        С include_archive=True история начинается с архивных сообщений.
+        """
+        try:
+            messages = []
+            if include_archive:
+                archived = self.archive.iter_history(user_id, ascending=True)
+                try:
+                    for message in archived:
+                        if len(messages) >= limit:
+                            break
+                        messages.append(message)
+                finally:
+                    archived.close()
+            if len(messages) < limit:
+                with self.readers.connection() as conn:
+                    rows = conn.execute(
+                        "SELECT * FROM messages WHERE user_id = ? ORDER BY timestamp ASC LIMIT ?",
+                        (user_id, limit - len(messages))
+                    ).fetchall()
+                messages.extend(dict(message) for message in rows)
+            return messages
         except Exception as e:
             logger.error(f"Ошибка получения истории сообщений: {e}")
             return []
     
-    def get_chat_history(self, username: str) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
-        """Получение пользователя и истории его сообщений по username."""
+    def _message_key(self, message_id: int, include_archive: bool):
+        """Ключ (timestamp, id) сообщения для курсора: из основной базы или архива."""
+        with self.readers.connection() as conn:
+            row = conn.execute("SELECT timestamp, id FROM messages WHERE id = ?", (message_id,)).fetchone()
+        if row:
+            return row['timestamp'], row['id']
+        return self.archive.find_key(message_id) if include_archive else None
+    
+    def iter_history(self, user_id: int, before_id: Optional[int] = None, after_id: Optional[int] = None,
+                     chunk_size: int = 50, include_archive: bool = False) -> Iterator[Dict[str, Any]]:
+        """Ленивое чтение истории пользователя с курсором по (timestamp, id).
+        
+        Без курсора и с before_id сообщения идут от новых к старым, начиная
+        с последнего или с сообщения старше before_id; с after_id — от старых
+        к новым после указанного сообщения. Строки читаются через fetchmany,
+        поэтому память не зависит от длины переписки.
+        
+        С include_archive=True чтение продолжается в архиве: в архив уходят
+        самые старые сообщения, поэтому от новых к старым он читается после
+        основной базы, а от старых к новым — до нее.
+        """
+        cursor_id = after_id if after_id is not None else before_id
+        key = None
+        if cursor_id is not None:
+            key = self._message_key(cursor_id, include_archive)
+            if key is None:
+                return
+        
+        query = "SELECT * FROM messages WHERE user_id = ?"
+        params = [user_id]
+        if after_id is not None:
+            query += " AND (timestamp, id) > (?, ?) ORDER BY timestamp ASC, id ASC"
+            params.extend(key)
+            if include_archive:
+                yield from self.archive.iter_history(user_id, after=key, ascending=True, chunk_size=chunk_size)
+        else:
+            if key is not None:
+                query += " AND (timestamp, id) < (?, ?)"
+                params.extend(key)
+            query += " ORDER BY timestamp DESC, id DESC"
+        
+        with self.readers.connection() as conn:
+            cursor = conn.execute(query, params)
+            try:
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield dict(row)
+            finally:
+                cursor.close()
+        
+        if include_archive and after_id is None:
+            yield from self.archive.iter_history(user_id, before=key, chunk_size=chunk_size)
+    
+    def get_chat_history(self, username: str, include_archive: bool = False) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Получение пользователя и истории его сообщений по username (с архивом по запросу)."""
         user = self.get_user_by_username(username)
         
         if user:
-            messages = self.get_messages_by_user_id(user['id'])
+            messages = self.get_messages_by_user_id(user['id'], include_archive=include_archive)
             return user, messages
         
         return None, []
     
+    def iter_export(self, user_id: Optional[int] = None, since: Optional[str] = None, until: Optional[str] = None,
+                    include_archive: bool = True, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+        """Потоковое чтение сообщений с данными отправителя для экспорта.
+        
+        Сообщения идут в хронологическом порядке: сначала архив, затем
+        основная база. since (включительно) и until (не включительно) —
+        границы по времени в формате 'YYYY-MM-DD[ HH:MM:SS]'. Строки читаются
+        через fetchmany по chunk_size, поэтому память не зависит от объема.
+        """
+        conditions = []
+        params = []
+        if user_id is not None:
+            conditions.append("m.user_id = ?")
+            params.append(user_id)
+        if since:
+            conditions.append("m.timestamp >= ?")
+            params.append(since)
+        if until:
+            conditions.append("m.timestamp < ?")
+            params.append(until)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        columns = ("m.id, m.user_id, u.username, u.first_name, u.last_name, "
+                   "m.message_text, m.timestamp, m.is_incoming")
+        order = " ORDER BY m.timestamp, m.id"
+        
+        if include_archive:
+            yield from self.archive.iter_export(
+                f"SELECT {columns} FROM messages m LEFT JOIN hot.users u ON u.id = m.user_id{where}{order}",
+                params, since, until, attach=self.readers.uri, chunk_size=chunk_size
+            )
+        
+        with self.readers.connection() as conn:
+            cursor = conn.execute(f"SELECT {columns} FROM messages m LEFT JOIN users u ON u.id = m.user_id{where}{order}", params)
+            try:
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield dict(row)
+            finally:
+                cursor.close()
+    
+    def iter_export_users(self, user_id: Optional[int] = None,
+                          chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+        """Потоковое чтение таблицы пользователей для экспорта."""
+        query = f"SELECT {', '.join(EXPORT_USER_FIELDS)} FROM users"
+        params = []
+        if user_id is not None:
+            query += " WHERE id = ?"
+            params.append(user_id)
+        query += " ORDER BY id"
+        with self.readers.connection() as conn:
+            cursor = conn.execute(query, params)
+            try:
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield dict(row)
+            finally:
+                cursor.close()
+    
     def close(self):
-        """Закрытие соединения с базой данных."""
+        """Запись оставшихся сообщений и закрытие соединения с базой данных."""
+        if self._writer and self._writer.is_alive():
+            self._queue.put(_STOP)
+            self._writer.join()
+            self._writer = None
+        self.readers.close()
         if self.conn:
             self.conn.close()
             logger.info("Соединение с базой данных закрыто")
-
-# Создание глобального экземпляра БД
-db = MessageDatabase()
@@ -0,0 +1,79 @@
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from config import DEDUP_WINDOW, DEDUP_MAX_ENTRIES
+from envelope import MessageEnvelope
+
+# Результаты проверки сообщения
+NEW = 'new'
+REDELIVERY = 'redelivery'  # То же сообщение того же аккаунта пришло повторно (например, после переподключения)
+DUPLICATE = 'duplicate'  # Такое же сообщение от того же отправителя уже получил другой аккаунт
+
+# Первое из одинаковых сообщений: (аккаунт, ID сообщения)
+FirstMessage = Tuple[Optional[str], int]
+
+
+def content_hash(envelope: MessageEnvelope) -> int:
+    """Хэш содержимого сообщения: текст и тип/ID медиа."""
+    return hash((envelope.text, envelope.media_kind, envelope.media_id))
+
+
+def content_key(envelope: MessageEnvelope) -> Tuple[int, int]:
+    """Ключ одинаковых сообщений отправителя: (ID отправителя, хэш содержимого)."""
+    return envelope.sender_id, content_hash(envelope)
+
+
+class MessageDeduplicator:
+    """Ограниченное по времени и размеру множество недавних сообщений.
+
+    Общий для всех аккаунтов процесса: ключ (чат, ID сообщения, аккаунт)
+    распознает повторную доставку, ключ (отправитель, хэш содержимого) —
+    одно и то же сообщение, разосланное нескольким аккаунтам. Записи старше
+    window секунд и сверх max_entries вытесняются в порядке добавления.
+    """
+
+    def __init__(self, window: float = DEDUP_WINDOW, max_entries: int = DEDUP_MAX_ENTRIES):
+        self.window = window
+        self.max_entries = max_entries
+        self._deliveries = OrderedDict()  # (chat_id, message_id, account) -> время получения
+        self._contents = OrderedDict()  # (sender_id, хэш) -> [время, первое сообщение, аккаунты]
+
+    def check(self, envelope: MessageEnvelope) -> Tuple[str, Optional[FirstMessage]]:
+        """Проверка сообщения и запоминание его ключей.
+
+        Возвращает (NEW | REDELIVERY | DUPLICATE, первое сообщение); первое
+        сообщение (аккаунт, ID) заполняется только для DUPLICATE.
+        """
+        if not self.window:
+            return NEW, None
+        now = time.monotonic()
+        self._expire(self._deliveries, now, lambda entry: entry)
+        self._expire(self._contents, now, lambda entry: entry[0])
+
+        delivery_key = (envelope.chat_id, envelope.message_id, envelope.account)
+        if delivery_key in self._deliveries:
+            return REDELIVERY, None
+        self._deliveries[delivery_key] = now
+
+        key = content_key(envelope)
+        entry = self._contents.get(key)
+        if entry is not None and envelope.account not in entry[2]:
+            entry[2].append(envelope.account)
+            return DUPLICATE, entry[1]
+
+        # Новое сообщение или повтор того же текста тем же аккаунтом — это отдельное сообщение
+        self._contents.pop(key, None)
+        self._contents[key] = [now, (envelope.account, envelope.message_id), [envelope.account]]
+        return NEW, None
+
+    def _expire(self, entries: OrderedDict, now: float, added_at):
+        """Удаление записей старше окна и сверх лимита (самые старые — в начале)."""
+        while entries:
+            key, entry = next(iter(entries.items()))
+            if len(entries) < self.max_entries and now - added_at(entry) <= self.window:
+                break
+            del entries[key]
+
+    def __len__(self):
+        return len(self._deliveries)
@@ -0,0 +1,186 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from colorama import Fore, Style
+from telethon import functions, types, utils
+
+from config import ENTITY_CACHE_TTL, ENTITY_CACHE_SIZE, DIALOGS_PAGE_SIZE
+
+logger = logging.getLogger('telegram_online')
+
+_HASH_MASK = (1 << 64) - 1
+
+
+class CachedEntity(NamedTuple):
+    """Данные пользователя, достаточные для обработки сообщения."""
+    id: int
+    username: Optional[str]
+    first_name: str
+    last_name: str
+    phone: Optional[str]
+    bot: bool
+    updated_at: float
+
+
+def telegram_hash(values) -> int:
+    """Хэш набора чисел по алгоритму Telegram для параметра hash (знаковое 64-битное число)."""
+    result = 0
+    for value in values:
+        result ^= result >> 21
+        result ^= (result << 35) & _HASH_MASK
+        result ^= result >> 4
+        result = (result + value) & _HASH_MASK
+    return result - (1 << 64) if result >= 1 << 63 else result
+
+
+class EntityCache:
+    """Общий для всех аккаунтов кэш пользователей с TTL.
+
+    Хранится в памяти (LRU) и в таблице entities базы данных, чтобы после
+    перезапуска отправители определялись без сетевых запросов. Обработчик
+    сообщений берет отправителя из обновления (и обновляет им запись), без
+    него — из памяти и обращается к Telegram, только если записи нет или
+    она устарела.
+    """
+
+    def __init__(self, database, ttl: float = ENTITY_CACHE_TTL, max_size: int = ENTITY_CACHE_SIZE):
+        self.db = database
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entities = OrderedDict()
+
+    def load(self):
+        """Загрузка непросроченных сущностей из базы данных."""
+        rows = self.db.load_entities(time.time() - self.ttl, self.max_size)
+        # Строки идут от свежих к старым, добавляем в обратном порядке для LRU
+        for row in reversed(rows):
+            self._entities[row['id']] = CachedEntity(
+                row['id'], row['username'], row['first_name'] or '', row['last_name'] or '',
+                row['phone'], bool(row['bot']), row['updated_at']
+            )
+        logger.info(f"{Fore.GREEN}Кэш сущностей загружен: {len(self._entities)} записей{Style.RESET_ALL}")
+
+    def get(self, user_id) -> Optional[CachedEntity]:
+        """Непросроченная запись о пользователе или None."""
+        entity = self._entities.get(user_id)
+        if entity is None:
+            return None
+        if time.time() - entity.updated_at > self.ttl:
+            del self._entities[user_id]
+            return None
+        self._entities.move_to_end(user_id)
+        return entity
+
+    def put_users(self, users):
+        """Добавление пользователей Telethon в кэш и сохранение в базу."""
+        now = time.time()
+        rows = []
+        for user in users:
+            if not isinstance(user, types.User):
+                continue
+            entity = CachedEntity(
+                user.id, user.username, user.first_name or '', user.last_name or '',
+                user.phone, bool(user.bot), now
+            )
+            cached = self._entities.get(user.id)
+            # Новые и изменившиеся записи обновляем сразу, остальные — раз в половину TTL
+            if cached is None or cached[:6] != entity[:6] or now - cached.updated_at > self.ttl / 2:
+                self._entities[user.id] = entity
+                rows.append(tuple(entity))
+            self._entities.move_to_end(user.id)
+        while len(self._entities) > self.max_size:
+            self._entities.popitem(last=False)
+        if rows:
+            self.db.save_entities(rows)
+
+    async def resolve_sender(self, event) -> Optional[CachedEntity]:
+        """Определение отправителя события: из данных обновления, из памяти или запросом.
+
+        Пользователь, пришедший вместе с обновлением, всегда актуальнее кэша,
+        поэтому он обновляет запись (смена username и имени видна сразу);
+        кэш используется, только если обновление пришло без отправителя.
+        """
+        sender = event.sender
+        # У min-пользователя может не быть части полей (например, телефона) — он кэш не заменяет
+        if isinstance(sender, types.User) and not sender.min:
+            self.put_users([sender])
+            return self._entities.get(sender.id)
+        entity = self.get(event.sender_id)
+        if entity is not None:
+            return entity
+        sender = sender or await event.get_sender()
+        if sender is None:
+            return None
+        self.put_users([sender])
+        return self._entities.get(sender.id) if isinstance(sender, types.User) else None
+
+    async def warm_up(self, client, phone) -> int:
+        """Постраничная загрузка всех диалогов аккаунта в кэш.
+
+        Для каждой страницы сохраняется хэш и смещение следующей страницы;
+        если страница не изменилась, сервер отвечает DialogsNotModified и
+        разбирать её не нужно. Возвращает число загруженных диалогов.
+        """
+        pages = self.db.get_dialog_pages(phone)
+        offset_date, offset_id, offset_peer = None, 0, types.InputPeerEmpty()
+        page = 0
+        loaded = 0
+        skipped = 0
+
+        while True:
+            known = pages.get(page)
+            result = await client(functions.messages.GetDialogsRequest(
+                offset_date=offset_date,
+                offset_id=offset_id,
+                offset_peer=offset_peer,
+                limit=DIALOGS_PAGE_SIZE,
+                hash=known['hash'] if known else 0
+            ))
+
+            if isinstance(result, types.messages.DialogsNotModified):
+                skipped += 1
+                if known['is_last']:
+                    break
+                offset_date = known['offset_date']
+                offset_id = known['offset_id']
+                offset_peer = await client.get_input_entity(known['offset_peer_id'])
+                page += 1
+                continue
+
+            self.put_users(result.users)
+            loaded += len(result.dialogs)
+            is_last = isinstance(result, types.messages.Dialogs) or len(result.dialogs) < DIALOGS_PAGE_SIZE
+            if not result.dialogs:
+                self.db.save_dialog_page(phone, page, 0, 0, 0, 0, True)
+                break
+
+            # Смещение следующей страницы — по последнему диалогу текущей
+            messages = {(utils.get_peer_id(m.peer_id), m.id): m for m in result.messages if getattr(m, 'peer_id', None)}
+            entities = {utils.get_peer_id(e): e for e in result.users + result.chats}
+            page_values = []
+            last_message = None
+            last_peer_id = None
+            for dialog in result.dialogs:
+                peer_id = utils.get_peer_id(dialog.peer)
+                message = messages.get((peer_id, dialog.top_message))
+                page_values += [abs(peer_id), dialog.top_message,
+                                int(message.date.timestamp()) if message and message.date else 0]
+                if message:
+                    last_message, last_peer_id = message, peer_id
+
+            if last_message is None or last_peer_id not in entities:
+                break
+
+            offset_date = int(last_message.date.timestamp())
+            offset_id = last_message.id
+            self.db.save_dialog_page(phone, page, telegram_hash(page_values), offset_date,
+                                     offset_id, last_peer_id, is_last)
+            if is_last:
+                break
+            offset_peer = utils.get_input_peer(entities[last_peer_id])
+            page += 1
+
+        logger.info(f"{Fore.GREEN}[{phone}] Диалоги загружены: {loaded} новых, страниц без изменений: {skipped}{Style.RESET_ALL}")
+        return loaded
@@ -0,0 +1,93 @@
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from telethon.tl.types import Document, DocumentAttributeSticker, MessageMediaDocument, MessageMediaPhoto
+
+# Подписи типов медиа в уведомлениях и истории
+MEDIA_LABELS = {
+    'photo': "📷 [Фото]",
+    'sticker': "📱 [Стикер]",
+    'video': "🎬 [Видео]",
+    'audio': "🎵 [Аудио]",
+    'image': "📷 [Изображение]",
+    'document': "📎 [Документ]",
+    'other': "📱 [Медиа]",
+}
+
+
+def classify_media(media):
+    """Тип медиа и ID фото/документа: ('photo' | 'sticker' | ... , ID) или (None, None)."""
+    if media is None:
+        return None, None
+    if isinstance(media, MessageMediaPhoto):
+        return ('photo', media.photo.id) if media.photo else ('other', None)
+    if isinstance(media, MessageMediaDocument) and isinstance(media.document, Document):
+        document = media.document
+        if any(isinstance(attribute, DocumentAttributeSticker) for attribute in document.attributes):
+            return 'sticker', document.id
+        mime_type = document.mime_type or ''
+        if 'video' in mime_type:
+            return 'video', document.id
+        if 'audio' in mime_type:
+            return 'audio', document.id
+        if 'image' in mime_type:
+            return 'image', document.id
+        return 'document', document.id
+    return 'other', None
+
+
+def media_cache_key(media_kind, media_id):
+    """Ключ кэша медиа бота: ('photo' | 'document', ID) или None."""
+    if media_id is None:
+        return None
+    return ('photo' if media_kind == 'photo' else 'document'), media_id
+
+
+class MessageEnvelope(NamedTuple):
+    """Неизменяемое описание входящего сообщения.
+
+    Создается один раз в обработчике аккаунта и без изменений передается
+    боту уведомлений, в базу данных и между процессами шардов, поэтому
+    дальше по конвейеру объекты Telethon не нужны.
+    """
+    account: Optional[str]
+    chat_id: int
+    message_id: int
+    sender_id: int
+    username: Optional[str]
+    first_name: str
+    last_name: str
+    text: str
+    media_kind: Optional[str]
+    media_id: Optional[int]
+    received_at: datetime
+
+    @classmethod
+    def from_event(cls, account, event, sender) -> 'MessageEnvelope':
+        """Сборка из события NewMessage и отправителя (User или CachedEntity)."""
+        message = event.message
+        media_kind, media_id = classify_media(message.media)
+        return cls(
+            account, event.chat_id, message.id, sender.id, sender.username,
+            sender.first_name or '', sender.last_name or '', message.message or '',
+            media_kind, media_id, datetime.now()
+        )
+
+    @property
+    def media_label(self) -> Optional[str]:
+        return MEDIA_LABELS[self.media_kind] if self.media_kind else None
+
+    @property
+    def media_key(self):
+        return media_cache_key(self.media_kind, self.media_id)
+
+    @property
+    def notification_text(self) -> str:
+        """Текст для уведомления и истории: для медиа — его тип."""
+        return self.media_label or self.text
+
+    @property
+    def display_name(self) -> str:
+        if self.username:
+            return f"@{self.username}"
+        return f"{self.first_name} {self.last_name}".strip() or f"user_id:{self.sender_id}"
@@ -0,0 +1,66 @@
+import csv
+import gzip
+import json
+from datetime import datetime, timedelta
+from typing import Optional
+
+from database import EXPORT_MESSAGE_FIELDS, EXPORT_USER_FIELDS
+
+# Форматы выгрузки и таблицы, которые можно выгрузить
+EXPORT_FORMATS = ('jsonl', 'csv')
+EXPORT_TABLES = ('messages', 'users')
+
+
+def parse_time_bound(value: Optional[str], end: bool = False) -> Optional[str]:
+    """Граница диапазона экспорта в формате, в котором хранится timestamp.
+
+    Принимает 'YYYY-MM-DD' или 'YYYY-MM-DD HH:MM[:SS]'. Для конца диапазона
+    дата без времени означает весь день включительно.
+    """
+    if not value:
+        return None
+    moment = datetime.fromisoformat(value.strip())
+    if end and len(value.strip()) == 10:
+        moment += timedelta(days=1)
+    return moment.isoformat(' ')
+
+
+def export_file_name(table: str, fmt: str, compress: bool) -> str:
+    """Имя файла выгрузки с отметкой времени."""
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"{table}_{stamp}.{fmt}" + (".gz" if compress else "")
+
+
+def write_export(database, path: str, fmt: str = 'jsonl', compress: bool = False, table: str = 'messages',
+                 user_id: Optional[int] = None, since: Optional[str] = None, until: Optional[str] = None) -> int:
+    """Потоковая выгрузка сообщений или пользователей в JSONL или CSV (при compress — gzip).
+
+    Строки берутся из генераторов базы по одной и сразу пишутся в файл,
+    поэтому память не зависит от объема выгрузки. Возвращает число строк.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"неизвестный формат {fmt}")
+    if table == 'users':
+        rows, fields = database.iter_export_users(user_id=user_id), EXPORT_USER_FIELDS
+    elif table == 'messages':
+        rows, fields = database.iter_export(user_id=user_id, since=since, until=until), EXPORT_MESSAGE_FIELDS
+    else:
+        raise ValueError(f"неизвестная таблица {table}")
+
+    opener = gzip.open if compress else open
+    count = 0
+    try:
+        with opener(path, 'wt', encoding='utf-8', newline='') as output:
+            if fmt == 'csv':
+                writer = csv.DictWriter(output, fieldnames=fields, extrasaction='ignore')
+                writer.writeheader()
+                for row in rows:
+                    writer.writerow(row)
+                    count += 1
+            else:
+                for row in rows:
+                    output.write(json.dumps(row, ensure_ascii=False, default=str) + '\n')
+                    count += 1
+    finally:
+        rows.close()
+    return count
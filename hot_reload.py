@@ -0,0 +1,43 @@
+import asyncio
+import importlib
+import logging
+import signal
+from typing import FrozenSet, NamedTuple
+
+import config
+
+logger = logging.getLogger('telegram_online')
+
+
+class MessageFilters(NamedTuple):
+    """Фильтры входящих сообщений.
+
+    Неизменяемый снимок: при перезагрузке объект заменяется целиком одним
+    присваиванием, поэтому обработчик всегда видит согласованный набор.
+    """
+    ignored_users: FrozenSet[int]
+
+
+def load_filters(reload_config: bool = False) -> MessageFilters:
+    """Фильтры из config.py; при reload_config=True файл конфигурации перечитывается.
+
+    Перечитывается только IGNORED_USERS, который берется из модуля config
+    при каждом вызове. ADMIN_ID, как и остальные настройки, применяется
+    после перезапуска: на него завязаны обработчики команд и отправка
+    уведомлений бота.
+    """
+    if reload_config:
+        importlib.reload(config)
+    return MessageFilters(frozenset(config.IGNORED_USERS))
+
+
+def add_reload_signal_handler(callback) -> bool:
+    """Вызов callback() по SIGHUP в текущем цикле событий (где сигнал поддерживается)."""
+    if not hasattr(signal, 'SIGHUP'):
+        return False
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, callback)
+        return True
+    except (NotImplementedError, RuntimeError, ValueError) as e:
+        logger.warning(f"Перезагрузка по SIGHUP недоступна: {e}")
+        return False
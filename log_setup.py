@@ -0,0 +1,174 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from config import LOG_DIR, LOG_SAMPLE_INTERVAL
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+TEXT_FORMAT = '%(asctime)s | %(levelname)-7s | %(message)s'
+
+# Логгеры приложения; message_logger пишет только в свой файл
+GENERAL_LOGGERS = ('telegram_online', 'notification_bot')
+MESSAGE_LOGGER = 'message_logger'
+
+# Дополнительные поля записи, попадающие в JSON (передаются через extra=)
+EXTRA_FIELDS = ('account', 'chat_id', 'sample_key', 'suppressed')
+
+_ANSI_RE = re.compile(r'\x1b\[[0-9;]*m')
+
+
+def strip_ansi(text: str) -> str:
+    """Удаление цветовых escape-последовательностей colorama."""
+    return _ANSI_RE.sub('', text)
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога одной строкой JSON без цветовых кодов."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, DATE_FORMAT),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': strip_ansi(record.getMessage()),
+        }
+        for field in EXTRA_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ConsoleFormatter(logging.Formatter):
+    """Текстовый формат консоли; цвет сохраняется только при выводе в терминал."""
+
+    def __init__(self, use_color: bool):
+        super().__init__(TEXT_FORMAT, DATE_FORMAT)
+        self.use_color = use_color
+
+    def format(self, record):
+        text = super().format(record)
+        suppressed = getattr(record, 'suppressed', None)
+        if suppressed:
+            text += f" (похожих записей пропущено: {suppressed})"
+        return text if self.use_color else strip_ansi(text)
+
+
+class SamplingFilter(logging.Filter):
+    """Прореживание повторяющихся записей.
+
+    Записи с одинаковым extra={'sample_key': ...} пропускаются не чаще одной
+    за interval секунд; число отброшенных записей добавляется к следующей
+    пропущенной в поле suppressed. Записи без sample_key не прореживаются.
+    """
+
+    def __init__(self, interval: float = LOG_SAMPLE_INTERVAL):
+        super().__init__()
+        self.interval = interval
+        self._windows = {}  # sample_key -> [начало окна, число отброшенных]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = getattr(record, 'sample_key', None)
+        if key is None:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is not None and now - window[0] < self.interval:
+                window[1] += 1
+                return False
+            if window and window[1]:
+                record.suppressed = window[1]
+            self._windows[key] = [now, 0]
+        return True
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """QueueHandler, не форматирующий запись в потоке вызывающего кода."""
+
+    def prepare(self, record):
+        # Форматирование и запись выполняет поток QueueListener
+        return record
+
+
+class _LogListener(QueueListener):
+    """QueueListener, который можно безопасно останавливать повторно."""
+
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+
+def _only(name):
+    return lambda record: record.name == name
+
+
+def _except(name):
+    return lambda record: record.name != name
+
+
+def setup_logging(log_dir: str = LOG_DIR, sample_interval: float = LOG_SAMPLE_INTERVAL) -> QueueListener:
+    """Настройка логирования через очередь.
+
+    Логгеры приложения только кладут записи в очередь; форматирование и
+    запись в файлы (JSON Lines с ротацией) и в консоль выполняет отдельный
+    поток QueueListener, поэтому цикл событий не блокируется на вводе-выводе.
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+    # Общий лог в файл с ротацией
+    file_handler = RotatingFileHandler(
+        os.path.join(log_dir, f'telegram_online_{stamp}.jsonl'),
+        maxBytes=10 * 1024 * 1024,  # 10 МБ
+        backupCount=5,
+        encoding='utf-8'
+    )
+    file_handler.setFormatter(JsonFormatter())
+    file_handler.addFilter(_except(MESSAGE_LOGGER))
+
+    # Консоль: цветной вывод только в терминале
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(ConsoleFormatter(use_color=console_handler.stream.isatty()))
+    console_handler.addFilter(_except(MESSAGE_LOGGER))
+
+    # Лог сообщений
+    message_file_handler = RotatingFileHandler(
+        os.path.join(log_dir, f'messages_{stamp}.jsonl'),
+        maxBytes=50 * 1024 * 1024,  # 50 МБ
+        backupCount=10,
+        encoding='utf-8'
+    )
+    message_file_handler.setFormatter(JsonFormatter())
+    message_file_handler.addFilter(_only(MESSAGE_LOGGER))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(sample_interval))
+
+    for name in GENERAL_LOGGERS + (MESSAGE_LOGGER,):
+        target = logging.getLogger(name)
+        for handler in list(target.handlers):
+            target.removeHandler(handler)
+        target.addHandler(queue_handler)
+        target.propagate = False
+    logging.getLogger('telegram_online').setLevel(logging.INFO)
+    logging.getLogger(MESSAGE_LOGGER).setLevel(logging.INFO)
+    # Бот уведомлений по-прежнему выводит только предупреждения и ошибки
+    logging.getLogger('notification_bot').setLevel(logging.WARNING)
+
+    listener = _LogListener(log_queue, file_handler, console_handler, message_file_handler,
+                              respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime
+
+from colorama import Fore, Style
+
+from config import LOG_DIR, WATCHDOG_THRESHOLD, WATCHDOG_REPORT_INTERVAL, WATCHDOG_TOP, WATCHDOG_STACK_DEPTH
+from metrics import EVENT_LOOP_LAG_SECONDS, EVENT_LOOP_STALLS, EVENT_LOOP_STALL_SECONDS
+
+logger = logging.getLogger('telegram_online')
+
+
+class _Offender:
+    """Накопленная статистика блокировок с одним и тем же стеком."""
+
+    __slots__ = ('stack', 'stalls', 'total', 'worst')
+
+    def __init__(self, stack: str):
+        self.stack = stack
+        self.stalls = 0
+        self.total = 0.0
+        self.worst = 0.0
+
+
+class LoopWatchdog:
+    """Обнаружение блокировок цикла событий.
+
+    Задача-пульс в цикле событий просыпается каждые threshold/2 секунд и
+    измеряет задержку пробуждения. Отдельный поток следит за пульсом: если
+    цикл не отвечает дольше threshold, он снимает стек потока цикла — это
+    и есть код, выполняющийся синхронно. Блокировки группируются по стеку,
+    а отчет о самых долгих раз в report_interval записывается в файл
+    loop_stalls_<PID>.txt в директории логов и кратко — в лог.
+    """
+
+    def __init__(self, threshold: float = WATCHDOG_THRESHOLD, report_interval: float = WATCHDOG_REPORT_INTERVAL,
+                 top: int = WATCHDOG_TOP, log_dir: str = LOG_DIR):
+        self.threshold = threshold
+        self.report_interval = report_interval
+        self.top = top
+        self.report_path = os.path.join(log_dir, f"loop_stalls_{os.getpid()}.txt")
+        self._interval = threshold / 2
+        self._beat = time.monotonic()
+        self._loop_thread = None
+        self._task = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._offenders = {}
+        self._stalls = 0
+        self._reported = 0
+
+    def start(self):
+        """Запуск пульса в текущем цикле событий и потока наблюдения."""
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._monitor, name='loop-watchdog', daemon=True)
+        self._thread.start()
+        logger.info(f"{Fore.CYAN}Контроль блокировок цикла событий включен (порог {self.threshold * 1000:.0f} мс, "
+                    f"отчет: {self.report_path}){Style.RESET_ALL}")
+
+    async def stop(self):
+        """Остановка наблюдения и запись итогового отчета."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.write_report()
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self._interval
+            await asyncio.sleep(self._interval)
+            now = time.monotonic()
+            EVENT_LOOP_LAG_SECONDS.observe(max(0.0, now - expected))
+            self._beat = now
+
+    def _monitor(self):
+        """Поток наблюдения: снимает стек цикла событий, пока тот не отвечает."""
+        stall_since = None
+        samples = {}
+        next_report = time.monotonic() + self.report_interval
+        while not self._stop.wait(self._interval / 2):
+            now = time.monotonic()
+            beat = self._beat
+            if now - beat > self._interval + self.threshold:
+                if stall_since is None:
+                    stall_since = beat
+                    samples = {}
+                stack = self._capture()
+                if stack:
+                    samples[stack] = samples.get(stack, 0) + 1
+            elif stall_since is not None:
+                # Пульс возобновился: блокировка длилась до последнего пробуждения
+                self._record(beat - stall_since - self._interval, samples)
+                stall_since = None
+            if now >= next_report:
+                next_report = now + self.report_interval
+                self.write_report()
+
+    def _capture(self):
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return None
+        entries = traceback.extract_stack(frame)[-WATCHDOG_STACK_DEPTH:]
+        return ''.join(traceback.format_list(entries))
+
+    def _record(self, duration: float, samples: dict):
+        """Учет завершившейся блокировки по самому частому стеку за ее время."""
+        if duration < self.threshold or not samples:
+            return
+        stack = max(samples, key=samples.get)
+        offender = self._offenders.get(stack)
+        if offender is None:
+            offender = self._offenders[stack] = _Offender(stack)
+        offender.stalls += 1
+        offender.total += duration
+        offender.worst = max(offender.worst, duration)
+        self._stalls += 1
+        EVENT_LOOP_STALLS.inc()
+        EVENT_LOOP_STALL_SECONDS.observe(duration)
+
+        location = stack.rstrip().splitlines()[-2].strip() if stack.count('\n') >= 2 else stack.strip()
+        logger.warning(f"{Fore.YELLOW}Цикл событий заблокирован на {duration * 1000:.0f} мс: {location}{Style.RESET_ALL}",
+                       extra={'sample_key': 'loop_stall'})
+
+    def write_report(self):
+        """Запись отчета о самых долгих блокировках (по суммарному времени), если были новые."""
+        if self._stalls == self._reported:
+            return
+        self._reported = self._stalls
+        offenders = sorted(self._offenders.values(), key=lambda item: item.total, reverse=True)[:self.top]
+        lines = [f"Блокировки цикла событий дольше {self.threshold * 1000:.0f} мс, "
+                 f"отчет от {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"]
+        for index, offender in enumerate(offenders, 1):
+            lines.append(f"#{index}: блокировок {offender.stalls}, всего {offender.total:.3f} с, "
+                         f"максимум {offender.worst * 1000:.0f} мс\n{offender.stack}")
+        try:
+            with open(self.report_path, 'w', encoding='utf-8') as report:
+                report.write('\n'.join(lines))
+        except OSError as e:
+            logger.error(f"{Fore.RED}Ошибка записи отчета о блокировках: {e}{Style.RESET_ALL}")
+            return
+        worst = offenders[0]
+        logger.info(f"{Fore.YELLOW}Блокировки цикла событий: {self._stalls}, "
+                    f"самая затратная — {worst.stalls} раз, {worst.total:.3f} с (отчет: {self.report_path}){Style.RESET_ALL}")
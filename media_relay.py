@@ -0,0 +1,166 @@
+import asyncio
+import logging
+from collections import OrderedDict, deque
+
+from telethon import events
+from telethon.errors import FileReferenceExpiredError, MediaEmptyError
+
+from config import BOT_TOKEN, ADMIN_ID, MEDIA_CACHE_SIZE, MEDIA_RELAY_TIMEOUT
+from envelope import classify_media, media_cache_key
+from outbound import PRIORITY_MEDIA, mark_queued
+
+logger = logging.getLogger('notification_bot')
+
+
+def media_key(message):
+    """Ключ кэша для медиа сообщения: ('photo' | 'document', ID) или None."""
+    return media_cache_key(*classify_media(message.media))
+
+
+class MediaRelay:
+    """Доставка медиа админу через бота с кэшем уже пересланных файлов.
+
+    Бот не может отправить файл, которого он не видел, поэтому новое медиа
+    пересылается аккаунтом боту, а бот, получив его, пересылает админу и
+    запоминает свою копию по ID фото/документа. Повторные стикеры, GIF и
+    файлы бот отправляет админу сам по ссылке из кэша, без участия
+    аккаунта — один запрос вместо двух.
+
+    Пересылка через аккаунт считается успешной, только когда бот доставил
+    медиа админу: до этого relay() ждет ответа обработчика бота.
+    """
+
+    def __init__(self, bot, outbound, cache_size: int = MEDIA_CACHE_SIZE, timeout: float = MEDIA_RELAY_TIMEOUT):
+        self.bot = bot
+        self.outbound = outbound
+        self.cache_size = cache_size
+        self.timeout = timeout
+        self._cache = OrderedDict()  # ключ медиа -> медиа в копии бота
+        self._sources = set()        # ID аккаунтов, пересылающих медиа боту
+        self._pending = {}           # (ID аккаунта, ключ медиа) -> очередь (future, подпись) ожидающих доставки
+        self.bot_username = None
+        # ID бота — первая часть токена до двоеточия
+        try:
+            self.bot_id = int(BOT_TOKEN.split(':')[0])
+        except ValueError:
+            self.bot_id = None
+
+    async def start(self):
+        """Получение username бота и регистрация обработчика пересланных медиа."""
+        me = await self.bot.get_me()
+        self.bot_id = me.id
+        self.bot_username = me.username
+        self.bot.add_event_handler(
+            self._on_relayed_media,
+            events.NewMessage(incoming=True, func=lambda e: e.is_private and e.sender_id in self._sources)
+        )
+
+    def _remember(self, key, media):
+        self._cache[key] = media
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def relay(self, client, envelope, caption: str = None, queued: asyncio.Future = None):
+        """Доставка медиа из сообщения аккаунта админу.
+
+        Возвращает сообщение с медиа в чате админа (например, чтобы потом
+        изменить подпись) или None, если доставить не удалось. queued
+        завершается, когда отправка поставлена в очередь или медиа переслано
+        в бота (см. NotificationBot.send_notification).
+
+        Без клиента аккаунта (например, в рабочем процессе шарда) доставить
+        можно только медиа из кэша бота.
+        """
+        key = envelope.media_key
+
+        cached = self._cache.get(key) if key else None
+        if cached is not None:
+            self._cache.move_to_end(key)
+            try:
+                sent = await self.outbound.submit(
+                    PRIORITY_MEDIA, ADMIN_ID,
+                    lambda: self.bot.send_file(ADMIN_ID, cached, caption=caption)
+                )
+                mark_queued(queued)
+                message = await sent
+                logger.info(f"Медиа {key[0]}:{key[1]} отправлено админу из кэша")
+                return message
+            except (FileReferenceExpiredError, MediaEmptyError):
+                # Ссылка на файл устарела — пересылаем заново через аккаунт
+                self._cache.pop(key, None)
+            except Exception as e:
+                logger.error(f"Ошибка отправки медиа из кэша: {e}")
+                return None
+
+        if client is None:
+            return None
+        target = self.bot_username or self.bot_id
+        if not target:
+            logger.error("Не удалось определить бота для пересылки медиа")
+            return None
+
+        pending = None
+        delivered = asyncio.get_running_loop().create_future()
+        try:
+            me = await client.get_me(input_peer=True)
+            self._sources.add(me.user_id)
+            # Бот узнает медиа по аккаунту-отправителю и ID фото/документа
+            pending = self._pending.setdefault((me.user_id, key), deque())
+            pending.append((delivered, caption))
+            await client.forward_messages(entity=target, messages=envelope.message_id, from_peer=envelope.chat_id)
+            mark_queued(queued)
+            logger.info(f"Медиа переслано в бота для доставки админу")
+            return await asyncio.wait_for(asyncio.shield(delivered), self.timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Бот не доставил медиа админу за {self.timeout} с")
+            return None
+        except Exception as e:
+            logger.error(f"Ошибка при пересылке медиа в бота: {e}")
+            return None
+        finally:
+            if pending is not None and not delivered.done():
+                # Опоздавшее медиа бот только запомнит: вызывающий уже отправит текст
+                delivered.cancel()
+                try:
+                    pending.remove((delivered, caption))
+                except ValueError:
+                    pass
+                if not pending and self._pending.get((me.user_id, key)) is pending:
+                    del self._pending[(me.user_id, key)]
+
+    async def _on_relayed_media(self, event):
+        """Пересылка админу медиа, полученного ботом от аккаунта, и сохранение в кэш."""
+        message = event.message
+        if not message.media:
+            return
+        key = media_key(message)
+        if key:
+            self._remember(key, message.media)
+        
+        # Доставка админу нужна, только если relay() еще ждет этого медиа
+        waiter = None
+        pending = self._pending.get((event.sender_id, key))
+        while pending:
+            delivered, caption = pending.popleft()
+            if not delivered.done():
+                waiter = delivered
+                break
+        if pending is not None and not pending:
+            self._pending.pop((event.sender_id, key), None)
+        if waiter is None:
+            logger.info(f"Медиа получено ботом без ожидающего уведомления, сохранено в кэш")
+            return
+        
+        try:
+            sent = await (await self.outbound.submit(
+                PRIORITY_MEDIA, ADMIN_ID,
+                lambda: self.bot.send_file(ADMIN_ID, message.media, caption=caption)
+            ))
+            logger.info(f"Медиа успешно переслано от бота админу!")
+            if not waiter.done():
+                waiter.set_result(sent)
+        except Exception as e:
+            logger.error(f"Ошибка при пересылке от бота админу: {e}")
+            if not waiter.done():
+                waiter.set_result(None)
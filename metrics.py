@@ -0,0 +1,219 @@
+import asyncio
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from config import METRICS_HOST
+
+logger = logging.getLogger('telegram_online')
+
+# Границы корзин гистограмм задержек, в секундах
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Границы корзин для размеров пакетов записи в БД
+BATCH_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Метрика с набором меток; значения хранятся по кортежу значений меток."""
+
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        # Метрики обновляются и из потока записи в БД
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels) -> tuple:
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик."""
+
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Текущее значение; может вычисляться при каждом запросе метрик."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def remove(self, **labels):
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+    def set_function(self, function):
+        """Значение без меток, получаемое вызовом function при каждом запросе."""
+        self._function = function
+
+    def render(self) -> list:
+        if self._function is not None:
+            try:
+                self.set(self._function())
+            except Exception as e:
+                logger.error(f"Ошибка вычисления метрики {self.name}: {e}")
+        return super().render()
+
+
+class Histogram(_Metric):
+    """Распределение значений по корзинам с суммой и количеством."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Измерение длительности блока with."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+REGISTRY = []
+
+
+def render_metrics() -> str:
+    """Все метрики в текстовом формате Prometheus."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# Аккаунты
+ACCOUNT_CONNECTED = Gauge('telegram_account_connected', 'Подключен ли клиент аккаунта (1/0)', ['account'])
+ACCOUNT_RECONNECTS = Counter('telegram_account_reconnects_total', 'Переподключения клиента аккаунта', ['account'])
+PRESENCE_REFRESH_SECONDS = Histogram('telegram_presence_refresh_seconds', 'Длительность запроса обновления статуса онлайн', ['account'])
+PRESENCE_REFRESH_ERRORS = Counter('telegram_presence_refresh_errors_total', 'Неудачные обновления статуса онлайн', ['account'])
+RECONNECT_ATTEMPTS = Counter('telegram_reconnect_attempts_total', 'Попытки переподключения по результату', ['account', 'result'])
+RECONNECT_DOWNTIME_SECONDS = Histogram('telegram_reconnect_downtime_seconds', 'Время от обнаружения разрыва до переподключения', ['account'],
+                                       buckets=(1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+HEALTH_PROBE_SECONDS = Histogram('telegram_health_probe_seconds', 'Время ответа на ping проверки соединения', ['account'])
+HEALTH_PROBE_FAILURES = Counter('telegram_health_probe_failures_total', 'Проверки соединения без ответа', ['account'])
+HANDLE_MESSAGE_SECONDS = Histogram('telegram_handle_message_seconds', 'Длительность обработки входящего сообщения', ['account'])
+
+# Цикл событий
+EVENT_LOOP_LAG_SECONDS = Histogram('event_loop_lag_seconds', 'Задержка пробуждения задачи-пульса цикла событий (--watchdog)')
+EVENT_LOOP_STALLS = Counter('event_loop_stalls_total', 'Блокировки цикла событий дольше порога (--watchdog)')
+EVENT_LOOP_STALL_SECONDS = Histogram('event_loop_stall_seconds', 'Длительность блокировок цикла событий (--watchdog)')
+
+# Уведомления
+NOTIFICATION_SEND_SECONDS = Histogram('notification_send_seconds', 'Длительность обработки уведомления ботом', ['kind'])
+OUTBOUND_QUEUE_WAIT_SECONDS = Histogram('outbound_queue_wait_seconds', 'Время ожидания запроса в очереди бота', ['priority'])
+OUTBOUND_QUEUE_DEPTH = Gauge('outbound_queue_depth', 'Число запросов в очереди бота')
+FLOOD_WAITS = Counter('telegram_flood_waits_total', 'Полученные FloodWaitError', ['source'])
+FLOOD_WAIT_SECONDS = Counter('telegram_flood_wait_seconds_total', 'Суммарное время FloodWait', ['source'])
+DUPLICATE_MESSAGES = Counter('duplicate_messages_total', 'Отброшенные повторные доставки и дубликаты между аккаунтами', ['kind'])
+
+# База данных
+DB_SAVE_SECONDS = Histogram('db_save_message_seconds', 'Длительность постановки сообщения в очередь записи')
+DB_WRITE_SECONDS = Histogram('db_write_batch_seconds', 'Длительность записи пакета в БД')
+DB_BATCH_ROWS = Histogram('db_write_batch_size', 'Число сообщений в пакете записи', buckets=BATCH_BUCKETS)
+DB_QUEUE_DEPTH = Gauge('db_write_queue_depth', 'Число записей в очереди потока записи')
+
+
+async def _handle_request(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        # Заголовки запроса не нужны, но их нужно дочитать
+        while (await asyncio.wait_for(reader.readline(), 5)).strip():
+            pass
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+            status, body = '200 OK', render_metrics().encode('utf-8')
+        else:
+            status, body = '404 Not Found', b'Not Found\n'
+        writer.write(
+            f'HTTP/1.1 {status}\r\nContent-Type: {CONTENT_TYPE}\r\n'
+            f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(port: int, host: str = METRICS_HOST):
+    """Запуск HTTP-эндпоинта /metrics в текущем цикле событий."""
+    server = await asyncio.start_server(_handle_request, host, port)
+    logger.info(f"Метрики доступны по адресу http://{host}:{port}/metrics")
+    return server
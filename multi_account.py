@@ -0,0 +1,730 @@
+import asyncio
+import json
+import logging
+import os
+import queue
+import signal
+import time
+import traceback
+
+from colorama import Fore, Style, init
+from telethon import TelegramClient, events
+
+# Импортируем конфигурацию и компоненты
+from config import (API_ID, API_HASH, ACCOUNTS_FILE, ADMIN_ID, MAX_ACCOUNTS,
+                    STARTUP_CONCURRENCY, BOOTSTRAP_CACHE_TTL, DIALOGS_WARMUP_TTL, RECONNECT_CONCURRENCY)
+from connection import ConnectionSupervisor
+from dedup import DUPLICATE, NEW, REDELIVERY, MessageDeduplicator
+from entity_cache import EntityCache
+from envelope import MessageEnvelope
+from hot_reload import add_reload_signal_handler, load_filters
+from log_setup import setup_logging
+from loop_watchdog import LoopWatchdog
+from metrics import DUPLICATE_MESSAGES, HANDLE_MESSAGE_SECONDS, start_metrics_server
+from presence import PresenceScheduler
+from read_receipts import ReadReceiptAggregator
+from services import close_services, get_db, get_notification_bot
+from sharding import QueueNotifier
+
+logger = logging.getLogger('telegram_online')
+message_logger = logging.getLogger('message_logger')
+
+class MultiAccountTelegramBot:
+    def __init__(self, use_proxy=False, accounts=None, metrics_port=0, watchdog_threshold=0):
+        self.use_proxy = use_proxy
+        self.metrics_port = metrics_port  # Порт эндпоинта /metrics (0 — выключен)
+        self.watchdog_threshold = watchdog_threshold  # Порог блокировки цикла событий в секундах (0 — без контроля)
+        # В рабочем процессе шарда передается только его часть аккаунтов
+        self.accounts = accounts if accounts is not None else self.load_accounts()
+        self.clients = {}
+        self.client_tasks = {}  # Задачи run_client по номеру телефона
+        self.accounts_changed = asyncio.Event()  # Набор задач клиентов изменен перезагрузкой
+        self._applying_accounts = False  # Идет замена клиентов: пустой набор задач — временный
+        self.filters = load_filters()  # Фильтры сообщений (заменяются целиком при перезагрузке)
+        self.is_running = True
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.notification_bot = None  # Инициализируем как None
+        self.presence = PresenceScheduler()  # Общий планировщик статуса онлайн
+        self.read_receipts = {}  # Агрегаторы отметок о прочтении по аккаунтам
+        self.dedup = MessageDeduplicator()  # Общий для всех аккаунтов фильтр повторов и дубликатов сообщений
+        self._entity_cache = None  # Общий кэш пользователей для всех аккаунтов (создается при первом обращении)
+        self.startup_limit = None  # Ограничение числа одновременно запускаемых клиентов
+        self.reconnect_limit = None  # Ограничение числа одновременных переподключений
+        self.background_tasks = set()
+        
+    @property
+    def entity_cache(self):
+        """Общий кэш пользователей; база данных открывается только при первом обращении"""
+        if self._entity_cache is None:
+            self._entity_cache = EntityCache(get_db())
+        return self._entity_cache
+    
+    def load_accounts(self, strict=False):
+        """Загрузка данных аккаунтов из файла (при strict=True ошибка чтения не скрывается)"""
+        if os.path.exists(ACCOUNTS_FILE):
+            try:
+                with open(ACCOUNTS_FILE, 'r') as f:
+                    accounts = json.load(f)
+                    # Проверяем наличие всех необходимых полей
+                    for account in accounts:
+                        # Добавляем путь к файлу сессии, если его нет
+                        if 'session_file' not in account:
+                            account['session_file'] = f"sessions/{account['phone']}"
+                    return accounts
+            except Exception as e:
+                if strict:
+                    raise
+                logger.error(f"Ошибка загрузки аккаунтов: {e}")
+                return []
+        return []
+    
+    def save_accounts(self):
+        """Сохранение данных аккаунтов в файл"""
+        try:
+            with open(ACCOUNTS_FILE, 'w') as f:
+                json.dump(self.accounts, f, indent=4)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения аккаунтов: {e}")
+
+    # Создаем клиента Telegram
+    def create_client(self, session_file):
+        # Создаем клиента с или без прокси
+        if self.use_proxy:
+            proxy = {
+                'proxy_type': 'socks5',
+                'addr': '127.0.0.1',
+                'port': 9050,
+                'username': '',
+                'password': '',
+                'rdns': True
+            }
+            client = TelegramClient(session_file, API_ID, API_HASH, proxy=proxy)
+            logger.info(f"{Fore.CYAN}Клиент для {session_file} создан с использованием прокси{Style.RESET_ALL}")
+        else:
+            client = TelegramClient(session_file, API_ID, API_HASH)
+            logger.info(f"{Fore.CYAN}Клиент для {session_file} создан без использования прокси{Style.RESET_ALL}")
+        return client
+
+    async def setup_client(self, account_data):
+        """Настройка и запуск клиента для одного аккаунта"""
+        phone = account_data['phone']
+        session_file = account_data['session_file']
+        
+        # Проверка существования файла сессии
+        session_exists = os.path.exists(f"{session_file}.session")
+        logger.info(f"{Fore.YELLOW}Файл сессии для {phone} существует: {session_exists}{Style.RESET_ALL}")
+        
+        # Создаем клиента
+        client = self.create_client(session_file)
+        
+        # Если клиент не был создан, выходим
+        if not client:
+            logger.error(f"{Fore.RED}[{phone}] Не удалось создать клиента{Style.RESET_ALL}")
+            return
+        
+        # Сохраняем клиента в словаре для возможного доступа извне
+        self.clients[phone] = client
+        
+        try:
+            # Запускаем клиента и авторизуемся без кэша, чтобы обновить его
+            await client.connect()
+            if not await self.bootstrap_client(client, account_data, use_cache=False):
+                return
+            
+            # Загружаем диалоги для кэширования
+            if await self.cache_dialogs(client, account_data['phone']):
+                get_db().mark_dialogs_warmed(session_file)
+            # Запуск сразу после настройки возьмет данные из кэша
+            get_db().flush(timeout=5)
+        except Exception as e:
+            logger.error(f"{Fore.RED}[{phone}] Ошибка при подключении клиента: {e}{Style.RESET_ALL}")
+            return
+        finally:
+            # Отключаем клиента после настройки, он будет подключен снова при запуске
+            await client.disconnect()
+            self.clients.pop(phone, None)
+        
+        logger.info(f"{Fore.GREEN}Клиент для {account_data['phone']} настроен и готов{Style.RESET_ALL}")
+        return True
+    
+    async def bootstrap_client(self, client, account_data, use_cache=True):
+        """Проверка авторизации и получение данных аккаунта с использованием кэша запуска
+        
+        Если в кэше есть свежие данные get_me, запросы к Telegram не выполняются,
+        а авторизация проверяется в фоне уже после выхода аккаунта в онлайн.
+        """
+        phone = account_data.get('phone', 'Неизвестный')
+        session_file = account_data['session_file']
+        
+        bootstrap = get_db().get_bootstrap(session_file) if use_cache else None
+        cache_fresh = (bootstrap is not None and time.time() - bootstrap['updated_at'] < BOOTSTRAP_CACHE_TTL
+                       and os.path.exists(f"{session_file}.session"))
+        if cache_fresh:
+            logger.info(f"{Fore.GREEN}[{phone}] Авторизован как {bootstrap['first_name']} {bootstrap['last_name'] or ''} (@{bootstrap['username'] or 'без username'}) (из кэша){Style.RESET_ALL}")
+            self.start_background(self.verify_authorization(client, account_data))
+            return bootstrap
+        
+        # Если клиент не авторизован, выполняем авторизацию
+        if not await client.is_user_authorized():
+            result = await self.authenticate_account(client, account_data)
+            if not result:
+                logger.error(f"{Fore.RED}[{phone}] Не удалось авторизовать аккаунт{Style.RESET_ALL}")
+                return None
+        
+        # Получаем информацию о пользователе
+        me = await client.get_me()
+        logger.info(f"{Fore.GREEN}[{phone}] Авторизован как {me.first_name} {me.last_name if me.last_name else ''} (@{me.username if me.username else 'без username'}){Style.RESET_ALL}")
+        get_db().save_bootstrap(session_file, me)
+        return {'user_id': me.id, 'dialogs_warmed_at': bootstrap['dialogs_warmed_at'] if bootstrap else None}
+    
+    async def verify_authorization(self, client, account_data):
+        """Фоновая проверка авторизации аккаунта, запущенного по данным из кэша"""
+        phone = account_data.get('phone', 'Неизвестный')
+        try:
+            if await client.is_user_authorized():
+                return
+        except Exception as e:
+            logger.error(f"{Fore.RED}[{phone}] Ошибка проверки авторизации: {e}{Style.RESET_ALL}")
+            return
+        
+        # Сессия больше недействительна: сбрасываем кэш и останавливаем клиента
+        logger.error(f"{Fore.RED}[{phone}] Сессия недействительна, требуется повторная авторизация (--setup){Style.RESET_ALL}")
+        get_db().delete_bootstrap(account_data['session_file'])
+        if self.clients.get(phone) is client:
+            del self.clients[phone]
+    
+    async def warm_up_dialogs(self, client, phone, session_file):
+        """Фоновая загрузка диалогов после выхода аккаунта в онлайн"""
+        async with self.startup_limit:
+            if await self.cache_dialogs(client, phone):
+                get_db().mark_dialogs_warmed(session_file)
+    
+    def start_background(self, coro):
+        """Запуск фоновой задачи с сохранением ссылки на нее"""
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+    
+    async def run_client(self, account_data):
+        """Запуск клиента с периодическим обновлением статуса online"""
+        client = None
+        try:
+            # Получаем данные аккаунта
+            name = account_data.get('name', 'Неизвестный')
+            phone = account_data.get('phone', 'Неизвестный')
+            session_file = account_data.get('session_file', f"telegram_session_{len(self.accounts) + 1}")
+            
+            logger.info(f"{Fore.CYAN}[{phone}] Запуск клиента {name}...{Style.RESET_ALL}")
+            started_at = time.monotonic()
+            
+            # Создаем клиента
+            client = self.create_client(session_file)
+            
+            # Если клиент не был создан, выходим
+            if not client:
+                logger.error(f"{Fore.RED}[{phone}] Не удалось создать клиента{Style.RESET_ALL}")
+                return
+            
+            # Сохраняем клиента в словаре для возможного доступа извне
+            self.clients[phone] = client
+            self.read_receipts[phone] = ReadReceiptAggregator(
+                client, phone, on_acknowledged=lambda: self.presence.note_activity(phone)
+            )
+            
+            # Настраиваем обработчик сообщений для этого клиента
+            client.add_event_handler(
+                lambda event: self.handle_new_message(client, event, phone),
+                events.NewMessage
+            )
+            
+            # Запускаем клиента и проверяем авторизацию (одновременно не больше STARTUP_CONCURRENCY)
+            async with self.startup_limit:
+                await client.connect()
+                bootstrap = await self.bootstrap_client(client, account_data)
+            if not bootstrap:
+                return
+            
+            def on_online():
+                logger.info(f"{Fore.GREEN}[{phone}] В сети через {time.monotonic() - started_at:.1f} с после запуска{Style.RESET_ALL}")
+            
+            # Статус онлайн обновляет общий планировщик, здесь только следим за подключением
+            self.presence.register(phone, client, on_online=on_online)
+            
+            # Диалоги загружаются в фоне и только если кэш устарел
+            warmed_at = bootstrap['dialogs_warmed_at']
+            if not warmed_at or time.time() - warmed_at > DIALOGS_WARMUP_TTL:
+                self.start_background(self.warm_up_dialogs(client, phone, session_file))
+            
+            # Клиент работает, пока бот запущен и клиент не отключен извне;
+            # при разрыве соединения переподключаемся с экспоненциальной задержкой
+            supervisor = ConnectionSupervisor(
+                client, phone, self.reconnect_limit,
+                should_run=lambda: self.is_running and self.clients.get(phone) is client,
+                # После разрыва статус мог истечь, обновляем его вне очереди
+                on_reconnected=lambda: self.presence.refresh_soon(phone)
+            )
+            await supervisor.run()
+            
+        except Exception as e:
+            logger.error(f"{Fore.RED}[{phone}] Критическая ошибка в работе клиента: {e}{Style.RESET_ALL}")
+        finally:
+            if 'phone' in locals():
+                self.presence.unregister(phone)
+            
+            # При выходе из цикла отключаем клиент
+            if client:
+                read_receipts = self.read_receipts.pop(phone, None)
+                if read_receipts:
+                    await read_receipts.close()
+                
+                try:
+                    await client.disconnect()
+                    logger.info(f"{Fore.YELLOW}[{phone}] Клиент отключен{Style.RESET_ALL}")
+                except Exception as e:
+                    logger.error(f"{Fore.RED}[{phone}] Ошибка отключения клиента: {e}{Style.RESET_ALL}")
+            
+            # Удаляем клиент из словаря
+            if 'phone' in locals() and self.clients.get(phone) is client:
+                del self.clients[phone]
+    
+    async def authenticate_account(self, client, account_data):
+        """Аутентификация аккаунта."""
+        phone = account_data.get("phone", "Неизвестный")
+        
+        try:
+            # Если сессии нет, запрашиваем номер телефона и код
+            logger.info(f"{Fore.YELLOW}Запрашиваем авторизацию для аккаунта {account_data['name']}{Style.RESET_ALL}")
+            await client.start(phone=lambda: input(f'{Fore.YELLOW}Введите номер телефона для {account_data["name"]}: {Style.RESET_ALL}'))
+            logger.info(f"{Fore.GREEN}Авторизация успешна!{Style.RESET_ALL}")
+            
+            # Обновляем номер в данных аккаунта
+            actual_user = await client.get_me()
+            if hasattr(actual_user, 'phone'):
+                account_data['phone'] = actual_user.phone
+                self.save_accounts()
+                logger.info(f"{Fore.GREEN}Номер телефона обновлен: {account_data['phone']}{Style.RESET_ALL}")
+            return True
+        except Exception as e:
+            logger.error(f"{Fore.RED}Ошибка авторизации: {e}{Style.RESET_ALL}")
+            return False
+    
+    async def cache_dialogs(self, client, phone):
+        """Загрузка диалогов для кэширования сущностей."""
+        try:
+            logger.info(f"{Fore.YELLOW}[{phone}] Загрузка диалогов для кэширования...{Style.RESET_ALL}")
+            await self.entity_cache.warm_up(client, phone)
+            return True
+        except Exception as e:
+            logger.error(f"{Fore.RED}[{phone}] Ошибка загрузки диалогов: {e}{Style.RESET_ALL}")
+            return False
+    
+    async def handle_new_message(self, client, event, phone):
+        """Обработка новых сообщений."""
+        started = time.perf_counter()
+        try:
+            if not event.is_private:
+                return  # Игнорируем групповые сообщения
+                
+            # Получаем информацию о сообщении
+            # Отправитель берется из общего кэша, без запросов к Telegram
+            sender = await self.entity_cache.resolve_sender(event)
+            if sender is None:
+                return
+            
+            # Проверяем, является ли отправитель ботом
+            if sender.bot:
+                logger.info(f"{Fore.YELLOW}[{phone}] Сообщение от бота проигнорировано{Style.RESET_ALL}")
+                return
+                
+            # Снимок фильтров: перезагрузка заменяет его целиком
+            filters = self.filters
+            
+            # Проверяем, не является ли отправитель админом
+            if sender.id == ADMIN_ID:
+                logger.info(f"{Fore.YELLOW}[{phone}] Сообщение от админа проигнорировано{Style.RESET_ALL}")
+                return
+
+            # Проверяем, не находится ли отправитель в списке игнорируемых
+            if sender.id in filters.ignored_users:
+                logger.info(f"{Fore.YELLOW}[{phone}] Сообщение от игнорируемого пользователя {sender.id} проигнорировано{Style.RESET_ALL}")
+                return
+                
+            # Описание сообщения собирается один раз и дальше передается без изменений
+            envelope = MessageEnvelope.from_event(phone, event, sender)
+            
+            # Повторная доставка того же сообщения не обрабатывается вовсе
+            verdict, first = self.dedup.check(envelope) if self.dedup else (NEW, None)
+            if verdict == REDELIVERY:
+                DUPLICATE_MESSAGES.inc(kind=verdict)
+                logger.info(f"{Fore.YELLOW}[{phone}] Повторная доставка сообщения {envelope.message_id} проигнорирована{Style.RESET_ALL}")
+                return
+            
+            # Формируем строку для логирования
+            log_message = f"{Fore.CYAN}[{phone}] Новое сообщение от {envelope.display_name}: {envelope.text}"
+            if envelope.media_kind:
+                log_message += f" {envelope.media_label}"
+            log_message += Style.RESET_ALL
+            
+            # Логируем сообщение
+            message_logger.info(log_message)
+            
+            # Отметка сообщения как прочитанного: одна отметка на чат за окно агрегации
+            read_receipts = self.read_receipts.get(phone)
+            if read_receipts:
+                read_receipts.mark_read(envelope.chat_id, envelope.message_id)
+            
+            # Сообщение, уже полученное другим аккаунтом, не сохраняется второй раз:
+            # аккаунт только добавляется в первое уведомление
+            if verdict == DUPLICATE:
+                DUPLICATE_MESSAGES.inc(kind=verdict)
+                if self.notification_bot and self.notification_bot.merge_duplicate(envelope, first):
+                    logger.info(f"{Fore.YELLOW}[{phone}] Сообщение уже получено аккаунтом {first[0]}, уведомления объединены{Style.RESET_ALL}")
+                    return
+                logger.warning(f"{Fore.YELLOW}[{phone}] Не удалось объединить с уведомлением аккаунта {first[0]}, "
+                               f"сообщение обрабатывается отдельно{Style.RESET_ALL}")
+            
+            # Теперь ВСЕ сообщения (и текстовые, и медиа) отправляются ТОЛЬКО через бота
+            if self.notification_bot:
+                try:
+                    # Если очередь уведомлений переполнена, придерживаем обработку
+                    if self.notification_bot.is_backlogged:
+                        logger.warning(f"{Fore.YELLOW}[{phone}] Очередь уведомлений переполнена, ожидание...{Style.RESET_ALL}")
+                        await self.notification_bot.wait_for_capacity()
+                    
+                    logger.info(f"{Fore.YELLOW}[{phone}] Отправляю сообщение через бота...{Style.RESET_ALL}")
+                    
+                    # Отправка сообщения через бота; клиент нужен для пересылки нового медиа.
+                    # Обработчик ждет постановки в ограниченную очередь отправки, но не самой отправки
+                    queued = asyncio.get_running_loop().create_future()
+                    task = self.start_background(self.notification_bot.send_notification(envelope, client, queued=queued))
+                    await asyncio.wait({queued, task}, return_when=asyncio.FIRST_COMPLETED)
+                except Exception as e:
+                    logger.error(f"{Fore.RED}[{phone}] Ошибка отправки сообщения через бота: {str(e)}{Style.RESET_ALL}")
+            else:
+                logger.warning(f"{Fore.YELLOW}[{phone}] Бот уведомлений не запущен, сообщение не отправлено{Style.RESET_ALL}")
+            
+            logger.info(f"{Fore.GREEN}[{phone}] Сообщение обработано{Style.RESET_ALL}")
+                
+        except Exception as e:
+            logger.error(f"{Fore.RED}[{phone}] Ошибка обработки сообщения: {str(e)[:100]}{Style.RESET_ALL}")
+        finally:
+            HANDLE_MESSAGE_SECONDS.observe(time.perf_counter() - started, account=phone)
+    
+    async def start_all_clients(self):
+        """Запуск всех клиентов"""
+        # Запускаем бота для уведомлений
+        try:
+            # Запускаем бота для уведомлений в отдельной задаче
+            notification_task = asyncio.create_task(self.start_notification_bot())
+            logger.info(f"{Fore.GREEN}Бот уведомлений запущен{Style.RESET_ALL}")
+        except Exception as e:
+            logger.error(f"{Fore.RED}Ошибка запуска бота уведомлений: {e}{Style.RESET_ALL}")
+        
+        # Аккаунты и фильтры перечитываются по SIGHUP без перезапуска остальных клиентов
+        add_reload_signal_handler(lambda: self.start_background(self.reload()))
+        
+        await self.run_clients()
+        
+        # Останавливаем бота уведомлений
+        try:
+            await self.stop_notification_bot()
+            logger.info(f"{Fore.YELLOW}Бот уведомлений остановлен{Style.RESET_ALL}")
+        except Exception as e:
+            logger.error(f"{Fore.RED}Ошибка остановки бота уведомлений: {e}{Style.RESET_ALL}")
+    
+    async def run_clients(self):
+        """Запуск клиентов всех аккаунтов этого процесса и ожидание их завершения"""
+        # Загружаем сохраненный кэш пользователей
+        self.entity_cache.load()
+        self.startup_limit = asyncio.Semaphore(STARTUP_CONCURRENCY)
+        self.reconnect_limit = asyncio.Semaphore(RECONNECT_CONCURRENCY)
+        
+        # Запускаем общий планировщик статуса онлайн
+        self.presence.start()
+        
+        # Контроль блокировок цикла событий, если он включен
+        watchdog = None
+        if self.watchdog_threshold:
+            watchdog = LoopWatchdog(self.watchdog_threshold)
+            watchdog.start()
+        
+        # HTTP-эндпоинт метрик Prometheus, если он включен
+        metrics_server = None
+        if self.metrics_port:
+            try:
+                metrics_server = await start_metrics_server(self.metrics_port)
+            except OSError as e:
+                logger.error(f"{Fore.RED}Не удалось запустить эндпоинт метрик на порту {self.metrics_port}: {e}{Style.RESET_ALL}")
+        
+        # Запускаем клиенты для всех аккаунтов
+        for account in self.accounts:
+            self.start_client(account)
+        
+        # Ожидаем завершения всех задач; при перезагрузке набор задач меняется,
+        # и пока она идет, пустой набор не означает завершения работы
+        try:
+            while self.client_tasks or self._applying_accounts:
+                changed = asyncio.create_task(self.accounts_changed.wait())
+                try:
+                    await asyncio.wait({changed, *self.client_tasks.values()}, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    changed.cancel()
+                self.accounts_changed.clear()
+        except asyncio.CancelledError:
+            logger.info(f"{Fore.YELLOW}Задачи клиентов отменены{Style.RESET_ALL}")
+        except Exception as e:
+            logger.error(f"{Fore.RED}Ошибка при выполнении задач клиентов: {e}{Style.RESET_ALL}")
+        
+        await self.presence.stop()
+        if metrics_server:
+            metrics_server.close()
+        if watchdog:
+            await watchdog.stop()
+    
+    def start_client(self, account_data):
+        """Запуск задачи run_client для аккаунта"""
+        phone = account_data.get('phone', 'Неизвестный')
+        task = asyncio.create_task(self.run_client(account_data))
+        self.client_tasks[phone] = task
+        
+        def forget(done):
+            if self.client_tasks.get(phone) is done:
+                del self.client_tasks[phone]
+        task.add_done_callback(forget)
+        return task
+    
+    async def apply_accounts(self, accounts):
+        """Применение нового списка аккаунтов: останавливаются только удаленные
+        аккаунты и аккаунты со сменившимся файлом сессии, запускаются только новые.
+        Возвращает (добавленные, удаленные) номера."""
+        old = {account.get('phone'): account for account in self.accounts}
+        new = {account.get('phone'): account for account in accounts}
+        removed = [phone for phone, account in old.items()
+                   if phone not in new or new[phone].get('session_file') != account.get('session_file')]
+        added = [phone for phone in new if phone not in old or phone in removed]
+        self.accounts = accounts
+        
+        # Клиент отключается в finally задачи run_client; новый клиент с тем же
+        # файлом сессии запускается только после этого
+        self._applying_accounts = True
+        try:
+            stopping = [self.client_tasks[phone] for phone in removed if phone in self.client_tasks]
+            for task in stopping:
+                task.cancel()
+            await asyncio.gather(*stopping, return_exceptions=True)
+            for phone in added:
+                self.start_client(new[phone])
+        finally:
+            self._applying_accounts = False
+            self.accounts_changed.set()
+        return added, removed
+    
+    async def reload(self, accounts=None):
+        """Перечитывание фильтров из config.py и аккаунтов без перезапуска остальных клиентов.
+        
+        accounts — новый список аккаунтов процесса (в рабочем процессе его
+        передает супервизор); по умолчанию читается файл аккаунтов.
+        """
+        result = []
+        try:
+            self.filters = load_filters(reload_config=True)
+            result.append(f"игнорируемых пользователей: {len(self.filters.ignored_users)}")
+        except Exception as e:
+            logger.error(f"{Fore.RED}Ошибка перечитывания конфигурации, фильтры не изменены: {e}{Style.RESET_ALL}")
+            result.append("ошибка конфигурации, фильтры не изменены")
+        
+        try:
+            if accounts is None:
+                accounts = self.load_accounts(strict=True)
+            added, removed = await self.apply_accounts(accounts)
+            result.append(f"аккаунтов добавлено: {len(added)}, остановлено: {len(removed)}")
+        except Exception as e:
+            logger.error(f"{Fore.RED}Ошибка перечитывания аккаунтов, аккаунты не изменены: {e}{Style.RESET_ALL}")
+            result.append("ошибка файла аккаунтов, аккаунты не изменены")
+        
+        summary = "Перезагрузка: " + "; ".join(result)
+        logger.info(f"{Fore.GREEN}{summary}{Style.RESET_ALL}")
+        return summary
+    
+    async def follow_supervisor(self, control_queue):
+        """Рабочий процесс: применение списков аккаунтов, которые присылает супервизор при перезагрузке"""
+        loop = asyncio.get_running_loop()
+        while self.is_running:
+            try:
+                accounts = await loop.run_in_executor(None, control_queue.get, True, 1.0)
+            except queue.Empty:
+                continue
+            await self.reload(accounts)
+    
+    async def start_notification_bot(self):
+        """Запуск бота для уведомлений"""
+        try:
+            # Единственный экземпляр бота на процесс
+            self.notification_bot = get_notification_bot()
+            self.notification_bot.on_reload = self.reload
+            await self.notification_bot.start()
+            logger.info(f"{Fore.GREEN}Бот уведомлений запущен{Style.RESET_ALL}")
+            return True
+        except Exception as e:
+            logger.error(f"{Fore.RED}Ошибка запуска бота уведомлений: {e}{Style.RESET_ALL}")
+            self.notification_bot = None  # Обнуляем при ошибке
+            return False
+
+    async def stop_notification_bot(self):
+        """Остановка бота для уведомлений"""
+        try:
+            if hasattr(self, 'notification_bot') and self.notification_bot:
+                await self.notification_bot.stop()
+                self.notification_bot = None  # Обнуляем после остановки
+                logger.info(f"{Fore.GREEN}Бот уведомлений остановлен{Style.RESET_ALL}")
+        except Exception as e:
+            logger.error(f"{Fore.RED}Ошибка остановки бота уведомлений: {e}{Style.RESET_ALL}")
+    
+    def add_account(self):
+        """Добавление нового аккаунта с немедленной авторизацией"""
+        if MAX_ACCOUNTS and len(self.accounts) >= MAX_ACCOUNTS:
+            print(f"{Fore.RED}Достигнут максимальный лимит аккаунтов ({MAX_ACCOUNTS}){Style.RESET_ALL}")
+            return False
+        
+        account_name = input(f"{Fore.YELLOW}Введите название аккаунта (для вашего удобства): {Style.RESET_ALL}")
+        
+        # Создаем данные аккаунта
+        account_data = {
+            "name": account_name,
+            "phone": "новый",
+            "session_file": f"telegram_session_{len(self.accounts) + 1}"
+        }
+        
+        # Сначала добавляем аккаунт в список
+        self.accounts.append(account_data)
+        self.save_accounts()
+        
+        print(f"{Fore.YELLOW}Выполняем авторизацию для аккаунта {account_name}...{Style.RESET_ALL}")
+        
+        # Выполняем авторизацию и сохраняем данные аккаунта в кэш запуска
+        success = self.loop.run_until_complete(self.setup_client(account_data))
+        
+        if success:
+            print(f"{Fore.GREEN}Аккаунт {account_name} успешно добавлен и авторизован{Style.RESET_ALL}")
+            return True
+        else:
+            # Если авторизация не удалась, удаляем аккаунт из списка
+            self.accounts.pop()
+            self.save_accounts()
+            print(f"{Fore.RED}Не удалось авторизовать аккаунт {account_name}. Аккаунт не добавлен.{Style.RESET_ALL}")
+            return False
+    
+    def remove_account(self):
+        """Удаление существующего аккаунта"""
+        if not self.accounts:
+            print(f"{Fore.RED}Нет добавленных аккаунтов{Style.RESET_ALL}")
+            return False
+        
+        print(f"{Fore.YELLOW}Список аккаунтов:{Style.RESET_ALL}")
+        for i, account in enumerate(self.accounts, 1):
+            print(f"{i}. {account['name']} ({account['phone']})")
+        
+        try:
+            choice = int(input(f"{Fore.YELLOW}Выберите номер аккаунта для удаления (0 для отмены): {Style.RESET_ALL}"))
+            if choice == 0:
+                return False
+            if 1 <= choice <= len(self.accounts):
+                account = self.accounts.pop(choice - 1)
+                self.save_accounts()
+                
+                # Удаление файлов сессии
+                session_file = account['session_file']
+                try:
+                    if os.path.exists(f"{session_file}.session"):
+                        os.remove(f"{session_file}.session")
+                    if os.path.exists(f"{session_file}.db"):
+                        os.remove(f"{session_file}.db")
+                except Exception as e:
+                    logger.error(f"{Fore.RED}Ошибка удаления файлов сессии: {e}{Style.RESET_ALL}")
+                
+                print(f"{Fore.GREEN}Аккаунт {account['name']} удален{Style.RESET_ALL}")
+                return True
+            else:
+                print(f"{Fore.RED}Неверный выбор{Style.RESET_ALL}")
+        except ValueError:
+            print(f"{Fore.RED}Пожалуйста, введите число{Style.RESET_ALL}")
+        
+        return False
+    
+    def show_menu(self):
+        """Показать меню управления аккаунтами"""
+        while True:
+            print(f"\n{Fore.CYAN}======== УПРАВЛЕНИЕ АККАУНТАМИ ========{Style.RESET_ALL}")
+            limit = f"/{MAX_ACCOUNTS}" if MAX_ACCOUNTS else ""
+            print(f"{Fore.YELLOW}Текущие аккаунты ({len(self.accounts)}{limit}):{Style.RESET_ALL}")
+            
+            if not self.accounts:
+                print("Нет добавленных аккаунтов")
+            else:
+                for i, account in enumerate(self.accounts, 1):
+                    print(f"{i}. {account['name']} ({account['phone']})")
+            
+            print(f"\n{Fore.CYAN}Выберите действие:{Style.RESET_ALL}")
+            print(f"{Fore.WHITE}1. Добавить аккаунт{Style.RESET_ALL}")
+            print(f"{Fore.WHITE}2. Удалить аккаунт{Style.RESET_ALL}")
+            print(f"{Fore.WHITE}3. Запустить бота{Style.RESET_ALL}")
+            print(f"{Fore.WHITE}4. Выйти{Style.RESET_ALL}")
+            
+            try:
+                choice = int(input(f"{Fore.CYAN}Ваш выбор: {Style.RESET_ALL}"))
+                if choice == 1:
+                    self.add_account()
+                elif choice == 2:
+                    self.remove_account()
+                elif choice == 3:
+                    if not self.accounts:
+                        print(f"{Fore.RED}Сначала добавьте хотя бы один аккаунт{Style.RESET_ALL}")
+                    else:
+                        print(f"{Fore.GREEN}Запуск бота...{Style.RESET_ALL}")
+                        return True
+                elif choice == 4:
+                    return False
+                else:
+                    print(f"{Fore.RED}Неверный выбор{Style.RESET_ALL}")
+            except ValueError:
+                print(f"{Fore.RED}Пожалуйста, введите число{Style.RESET_ALL}")
+
+def run_shard_worker(shard_index, accounts, use_proxy, events_queue, metrics_port=0, watchdog_threshold=0,
+                     control_queue=None):
+    """Точка входа рабочего процесса: запуск части аккаунтов в собственном цикле событий"""
+    # Ctrl+C и SIGHUP обрабатывает супервизор, рабочий процесс останавливается по SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    
+    # Процесс запущен через spawn: логирование и colorama настраиваются заново
+    init()
+    setup_logging()
+    
+    # Метрики шарда отдаются на отдельном порту: порт супервизора + 1 + номер шарда
+    bot = MultiAccountTelegramBot(use_proxy=use_proxy, accounts=accounts,
+                                  metrics_port=metrics_port + 1 + shard_index if metrics_port else 0,
+                                  watchdog_threshold=watchdog_threshold)
+    bot.notification_bot = QueueNotifier(events_queue, shard_index)
+    # Дубликаты между аккаунтами разных шардов отбрасывает супервизор
+    bot.dedup = None
+    
+    def stop(signum, frame):
+        bot.is_running = False
+    signal.signal(signal.SIGTERM, stop)
+    
+    async def run():
+        # Новые списки аккаунтов шарда приходят от супервизора при перезагрузке
+        if control_queue is not None:
+            bot.start_background(bot.follow_supervisor(control_queue))
+        await bot.run_clients()
+    
+    logger.info(f"{Fore.GREEN}[шард {shard_index}] Запуск {len(accounts)} аккаунтов{Style.RESET_ALL}")
+    try:
+        asyncio.run(run())
+    finally:
+        # Поток записи — демон: без закрытия базы записи кэшей из очереди потеряются
+        close_services()
+        logger.info(f"{Fore.YELLOW}[шард {shard_index}] Процесс завершен{Style.RESET_ALL}")
@@ -1,26 +1,63 @@
 import re
 import os
+import html
+import time
 import asyncio
 import logging
-from datetime import datetime
+import tempfile
+from collections import OrderedDict
+from datetime import datetime, timedelta
 from telethon import TelegramClient, events, functions, types
 from telethon.tl.custom import Button
-from telethon.tl.types import User, MessageMediaPhoto, MessageMediaDocument
-from config import API_ID, API_HASH, BOT_TOKEN, ADMIN_ID
-from database import db
+from config import (API_ID, API_HASH, BOT_TOKEN, ADMIN_ID, HISTORY_PAGE_SIZE,
+                    NOTIFICATION_BURST_WINDOW, NOTIFICATION_EDIT_DELAY, DEDUP_WINDOW, DEDUP_MAX_ENTRIES)
+from outbound import OutboundQueue, PRIORITY_TEXT, PRIORITY_EDIT, PRIORITY_MEDIA, mark_queued
+from envelope import MEDIA_LABELS, MessageEnvelope
+from export import EXPORT_FORMATS, export_file_name, parse_time_bound, write_export
+from media_relay import MediaRelay
+from metrics import NOTIFICATION_SEND_SECONDS
+from retention import RetentionManager
 
 # Настройка логирования
 logger = logging.getLogger('notification_bot')
 
+# Ограничение длины страницы истории (лимит сообщения Telegram — 4096 символов)
+HISTORY_PAGE_CHARS = 3500
+
+# Ограничение длины текста объединенного уведомления
+NOTIFICATION_TEXT_CHARS = 3500
+
+# Сколько последних сообщений серии хранится для текста уведомления
+NOTIFICATION_BURST_TEXTS = 100
+
+# Период дневной статистики в /stats и число самых активных контактов
+STATS_DAYS = 7
+STATS_TOP_CONTACTS = 10
+
 class NotificationBot:
-    def __init__(self):
+    def __init__(self, database):
         # Create sessions directory if it doesn't exist
         os.makedirs('sessions', exist_ok=True)
         
+        self.db = database  # База данных сообщений (общая с аккаунтами)
+        
         self.bot = TelegramClient('sessions/notification_bot', API_ID, API_HASH)
         self.bot.parse_mode = 'html'
         self.is_running = False
         self.search_mode = False
+        # Серии сообщений от одного отправителя: (аккаунт, ID отправителя) -> состояние уведомления
+        self._bursts = {}
+        # Аккаунты, получившие одно и то же сообщение: (аккаунт, ID) первого сообщения ->
+        # список аккаунтов и уведомление, в котором он показан
+        self._receivers = OrderedDict()
+        # Очередь исходящих сообщений админу с учетом лимитов Telegram
+        self.outbound = OutboundQueue()
+        # Доставка медиа админу с кэшем уже пересланных файлов
+        self.media_relay = MediaRelay(self.bot, self.outbound)
+        # Архивация и сжатие истории выполняются в процессе бота — он единственный в любом режиме запуска
+        self.retention = RetentionManager(self.db)
+        # Перезагрузка аккаунтов и фильтров (/reload); задает владелец бота
+        self.on_reload = None
         
     async def start(self):
         """Запуск бота."""
@@ -31,6 +68,9 @@ class NotificationBot:
         try:
             # Подключение к боту
             await self.bot.start(bot_token=BOT_TOKEN)
+            self.outbound.start()
+            await self.media_relay.start()
+            self.retention.start()
             self.is_running = True
             
             # Регистрируем обработчики команд
@@ -55,7 +95,11 @@ class NotificationBot:
                 await event.respond("👋 Привет! Я бот для уведомлений о новых сообщениях.\n\n"
                                    "Команды:\n"
                                    "/start - Показать это сообщение\n"
-                                   "/поиск - Поиск пользователя по имени/юзернейму")
+                                   "/поиск - Поиск пользователя по имени/юзернейму\n"
+                                   "/найти текст - Поиск по тексту сообщений\n"
+                                   "/экспорт [csv] [users] [@username] [YYYY-MM-DD [YYYY-MM-DD]] - Выгрузка истории\n"
+                                   "/stats [@username] - Статистика сообщений (/stats rebuild - пересчитать)\n"
+                                   "/reload - Перечитать аккаунты и список игнорируемых без перезапуска")
             
             # Обработчик команды /поиск
             @self.bot.on(events.NewMessage(pattern='/поиск'))
@@ -67,6 +111,93 @@ class NotificationBot:
                 self.search_mode = True
                 await event.respond("Введите имя пользователя, фамилию или @username для поиска")
             
+            # Обработчик команды /найти — полнотекстовый поиск по сообщениям
+            @self.bot.on(events.NewMessage(pattern=r'/найти(?:\s+(.+))?'))
+            async def find_command(event):
+                if event.chat_id != ADMIN_ID:
+                    return  # Игнорируем команды не от админа
+                
+                query = (event.pattern_match.group(1) or "").strip()
+                if not query:
+                    await event.respond("Использование: /найти текст")
+                    return
+                
+                messages = self.db.search_messages(query)
+                # Поиск идет только по основной базе, перенесенные в архив месяцы в него не входят
+                months = self.db.archive.months()
+                archive_note = (f"\n<i>Архив ({months[0]} — {months[-1]}) в поиск не входит</i>"
+                                if months else "")
+                if not messages:
+                    await event.respond(f"По запросу «{html.escape(query)}» ничего не найдено{archive_note}")
+                    return
+                
+                parts = [f"Найдено сообщений: {len(messages)} 🔎{archive_note}\n"]
+                for msg in messages:
+                    if msg['username']:
+                        contact = f"@{msg['username']}"
+                    else:
+                        contact = f"{msg['first_name'] or ''} {msg['last_name'] or ''}".strip() or f"user_id:{msg['user_id']}"
+                    text = msg['message_text'] or ""
+                    if len(text) > 300:
+                        text = text[:300] + "…"
+                    parts.append(f"<b>{html.escape(contact)}</b> · {str(msg['timestamp'])[:19]}\n{html.escape(text)}\n")
+                
+                # Отправляем частями, если текст слишком длинный
+                chunk = ""
+                for part in parts:
+                    if len(chunk) + len(part) > 3000:
+                        await event.respond(chunk)
+                        chunk = ""
+                    chunk += part + "\n"
+                if chunk:
+                    await event.respond(chunk)
+            
+            # Обработчик команды /экспорт — выгрузка истории файлом
+            @self.bot.on(events.NewMessage(pattern=r'/экспорт(?:\s+(.+))?'))
+            async def export_command(event):
+                if event.chat_id != ADMIN_ID:
+                    return  # Игнорируем команды не от админа
+                
+                await self.send_export(event, (event.pattern_match.group(1) or "").split())
+            
+            # Обработчик команды /stats — сводная статистика из заранее посчитанных таблиц
+            @self.bot.on(events.NewMessage(pattern=r'/stats(?:\s+(.+))?'))
+            async def stats_command(event):
+                if event.chat_id != ADMIN_ID:
+                    return  # Игнорируем команды не от админа
+                
+                arg = (event.pattern_match.group(1) or "").strip()
+                if arg == 'rebuild':
+                    await event.respond("⏳ Пересчитываю статистику по истории…")
+                    try:
+                        total = await asyncio.wrap_future(self.db.rebuild_stats())
+                        await event.respond(f"Статистика пересчитана, учтено сообщений: {total}")
+                    except Exception as e:
+                        logger.error(f"Ошибка пересчета статистики: {e}")
+                        await event.respond(f"Ошибка пересчета статистики: {html.escape(str(e))}")
+                    return
+                
+                if arg:
+                    user = self.db.get_user_by_username(arg.lstrip('@')) if not arg.isdigit() else {'id': int(arg)}
+                    stats = self.db.get_contact_stats(user['id'], self.stats_since()) if user else None
+                    if not stats:
+                        await event.respond(f"Статистика для {html.escape(arg)} не найдена")
+                        return
+                    await event.respond(self.format_contact_stats(html.escape(arg), stats))
+                else:
+                    await event.respond(self.format_stats())
+            
+            # Обработчик команды /reload — перезагрузка аккаунтов и фильтров
+            @self.bot.on(events.NewMessage(pattern='/reload'))
+            async def reload_command(event):
+                if event.chat_id != ADMIN_ID:
+                    return  # Игнорируем команды не от админа
+                
+                if not self.on_reload:
+                    await event.respond("Перезагрузка недоступна")
+                    return
+                await event.respond(await self.on_reload())
+            
             # Обработчик всех сообщений от админа
             @self.bot.on(events.NewMessage(from_users=ADMIN_ID))
             async def handle_admin_message(event):
@@ -83,12 +214,15 @@ class NotificationBot:
                         search_query = search_query[1:]
                     
                     # Выполняем поиск по базе данных
-                    user = db.get_user_by_username(search_query)
+                    user = self.db.get_user_by_username(search_query)
+                    
+                    # Если username не найден, ищем по имени и фамилии,
+                    # а затем по префиксам через полнотекстовый индекс
+                    if not user:
+                        users = self.db.get_users_by_name(search_query, limit=1) or self.db.search_users(search_query, limit=1)
+                        user = users[0] if users else None
                     
                     if user:
-                        # Получаем историю сообщений
-                        messages = db.get_messages_by_user_id(user['id'])
-                        
                         # Формируем информацию о пользователе
                         user_info = f"Найден пользователь 👑\n\n"
                         if user['username']:
@@ -100,28 +234,10 @@ class NotificationBot:
                         
                         await event.respond(user_info)
                         
-                        # Отправляем историю сообщений
-                        if messages:
-                            history_text = "История сообщений:\n\n"
-                            for msg in messages:
-                                direction = "➡️" if msg['is_incoming'] else "⬅️"
-                                timestamp = msg['timestamp']
-                                # Форматируем дату
-                                try:
-                                    date_obj = datetime.fromisoformat(timestamp)
-                                    date_str = date_obj.strftime("%Y-%m-%d %H:%M:%S")
-                                except:
-                                    date_str = timestamp
-                                
-                                history_text += f"{direction} {msg['message_text']}\n{date_str}\n\n"
-                                
-                                # Отправляем частями, если текст слишком длинный
-                                if len(history_text) > 3000:
-                                    await event.respond(history_text)
-                                    history_text = ""
-                            
-                            if history_text:
-                                await event.respond(history_text)
+                        # Отправляем последнюю страницу истории с кнопками навигации
+                        history_text, buttons = self.render_history_page(user['id'])
+                        if history_text:
+                            await event.respond(history_text, buttons=buttons)
                         else:
                             await event.respond("История сообщений пуста")
                     else:
@@ -130,10 +246,190 @@ class NotificationBot:
                     # Выходим из режима поиска
                     self.search_mode = False
             
+            # Обработчик кнопок навигации по истории
+            @self.bot.on(events.CallbackQuery(pattern=rb'h:'))
+            async def history_callback(event):
+                if event.sender_id != ADMIN_ID:
+                    return  # Игнорируем нажатия не от админа
+                
+                try:
+                    _, user_id, direction, message_id = event.data.decode().split(':')
+                    user_id, message_id = int(user_id), int(message_id)
+                except ValueError:
+                    await event.answer("Некорректные данные кнопки")
+                    return
+                
+                if direction == 'o':
+                    history_text, buttons = self.render_history_page(user_id, before_id=message_id)
+                else:
+                    history_text, buttons = self.render_history_page(user_id, after_id=message_id)
+                
+                if not history_text:
+                    await event.answer("Больше сообщений нет")
+                    return
+                
+                await event.edit(history_text, buttons=buttons)
+                await event.answer()
+            
             logger.info("Обработчики команд бота зарегистрированы")
         except Exception as e:
             logger.error(f"Ошибка регистрации обработчиков команд: {str(e)}")
     
+    async def send_export(self, event, args):
+        """Выгрузка истории по аргументам команды /экспорт и отправка файла админу.
+        
+        Аргументы в любом порядке: формат (jsonl/csv), users — выгрузить
+        пользователей, @username или ID, до двух дат — начало и конец периода.
+        Файл пишется во временный каталог в отдельном потоке и сжимается gzip.
+        """
+        fmt, table, user_id, dates = 'jsonl', 'messages', None, []
+        try:
+            for arg in args:
+                if arg.lower() in EXPORT_FORMATS:
+                    fmt = arg.lower()
+                elif arg.lower() in ('users', 'пользователи'):
+                    table = 'users'
+                elif re.fullmatch(r'\d{4}-\d{2}-\d{2}', arg):
+                    dates.append(arg)
+                elif arg.isdigit():
+                    user_id = int(arg)
+                else:
+                    user = self.db.get_user_by_username(arg.lstrip('@'))
+                    if not user:
+                        await event.respond(f"Пользователь {html.escape(arg)} не найден")
+                        return
+                    user_id = user['id']
+            since = parse_time_bound(dates[0]) if dates else None
+            until = parse_time_bound(dates[1], end=True) if len(dates) > 1 else None
+        except ValueError:
+            await event.respond("Использование: /экспорт [jsonl|csv] [users] [@username|ID] [YYYY-MM-DD] [YYYY-MM-DD]")
+            return
+        
+        await event.respond("⏳ Готовлю выгрузку…")
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, export_file_name(table, fmt, compress=True))
+            try:
+                count = await asyncio.to_thread(
+                    write_export, self.db, path, fmt=fmt, compress=True, table=table,
+                    user_id=user_id, since=since, until=until
+                )
+                await (await self.outbound.submit(
+                    PRIORITY_MEDIA, ADMIN_ID,
+                    lambda: self.bot.send_file(ADMIN_ID, path, caption=f"Выгружено строк: {count}", force_document=True)
+                ))
+            except Exception as e:
+                logger.error(f"Ошибка выгрузки истории: {e}")
+                await event.respond(f"Ошибка выгрузки истории: {html.escape(str(e))}")
+    
+    @staticmethod
+    def stats_since() -> str:
+        """Первый день периода дневной статистики."""
+        return (datetime.now() - timedelta(days=STATS_DAYS - 1)).strftime("%Y-%m-%d")
+    
+    def format_stats(self) -> str:
+        """Общая статистика: по дням, по аккаунтам и самые активные контакты."""
+        since = self.stats_since()
+        daily = self.db.get_daily_totals(since)
+        today = datetime.now().strftime("%Y-%m-%d")
+        
+        lines = [f"📊 <b>Статистика</b>\n",
+                 f"Сегодня: {daily.get(today, 0)}, за {STATS_DAYS} дн.: {sum(daily.values())}"]
+        for day, count in daily.items():
+            lines.append(f"  {day}: {count}")
+        
+        accounts = self.db.get_account_totals(since)
+        if accounts:
+            lines.append(f"\n<b>По аккаунтам за {STATS_DAYS} дн.:</b>")
+            for account, count in accounts.items():
+                lines.append(f"  {html.escape(account or 'неизвестно')}: {count}")
+        
+        contacts = self.db.get_top_contacts(STATS_TOP_CONTACTS)
+        if contacts:
+            lines.append("\n<b>Самые активные контакты:</b>")
+            for contact in contacts:
+                if contact['username']:
+                    name = f"@{contact['username']}"
+                else:
+                    name = f"{contact['first_name'] or ''} {contact['last_name'] or ''}".strip() or f"user_id:{contact['user_id']}"
+                lines.append(f"  {html.escape(name)} — {contact['messages']} (последнее {str(contact['last_seen'])[:16]})")
+        return "\n".join(lines)
+    
+    @staticmethod
+    def format_contact_stats(name: str, stats) -> str:
+        """Статистика одного контакта."""
+        lines = [f"📊 <b>{name}</b>\n",
+                 f"Всего сообщений: {stats['messages']}",
+                 f"Первое: {str(stats['first_seen'])[:16]}",
+                 f"Последнее: {str(stats['last_seen'])[:16]}"]
+        if stats['daily']:
+            lines.append(f"\n<b>По дням за {STATS_DAYS} дн.:</b>")
+            for day, count in stats['daily'].items():
+                lines.append(f"  {day}: {count}")
+        if stats['media']:
+            lines.append("\n<b>По типам:</b>")
+            for kind, count in stats['media'].items():
+                lines.append(f"  {MEDIA_LABELS.get(kind, '💬 Текст')}: {count}")
+        return "\n".join(lines)
+    
+    @staticmethod
+    def format_history_entry(msg) -> str:
+        """Форматирование одного сообщения истории."""
+        direction = "➡️" if msg['is_incoming'] else "⬅️"
+        timestamp = msg['timestamp']
+        # Форматируем дату
+        try:
+            date_str = datetime.fromisoformat(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+        except (TypeError, ValueError):
+            date_str = timestamp
+        
+        text = msg['message_text'] or ""
+        if len(text) > 500:
+            text = text[:500] + "…"
+        return f"{direction} {html.escape(text)}\n{date_str}\n\n"
+    
+    def render_history_page(self, user_id: int, before_id: int = None, after_id: int = None):
+        """Формирование одной страницы истории с кнопками «Старше»/«Новее».
+        
+        Без курсора показывается последняя страница. Сообщения читаются из
+        генератора, пока не заполнится страница, поэтому время и память не
+        зависят от длины переписки. Возвращает (текст, кнопки) или (None, None).
+        """
+        newer_first = after_id is None
+        history = self.db.iter_history(user_id, before_id=before_id, after_id=after_id, include_archive=True)
+        entries = []
+        size = 0
+        has_more = False
+        try:
+            for msg in history:
+                entry = self.format_history_entry(msg)
+                if len(entries) >= HISTORY_PAGE_SIZE or (entries and size + len(entry) > HISTORY_PAGE_CHARS):
+                    has_more = True
+                    break
+                entries.append((msg['id'], entry))
+                size += len(entry)
+        except Exception as e:
+            logger.error(f"Ошибка чтения истории сообщений: {e}")
+        finally:
+            history.close()
+        
+        if not entries:
+            return None, None
+        
+        # На странице сообщения идут в хронологическом порядке
+        if newer_first:
+            entries.reverse()
+        has_older = has_more if newer_first else True
+        has_newer = (before_id is not None) if newer_first else has_more
+        
+        navigation = []
+        if has_older:
+            navigation.append(Button.inline("⬅️ Старше", data=f"h:{user_id}:o:{entries[0][0]}".encode()))
+        if has_newer:
+            navigation.append(Button.inline("Новее ➡️", data=f"h:{user_id}:n:{entries[-1][0]}".encode()))
+        
+        history_text = "История сообщений:\n\n" + "".join(entry for _, entry in entries)
+        return history_text, [navigation] if navigation else None
+    
     async def stop(self):
         """Остановка бота."""
         if not self.is_running:
@@ -141,176 +437,73 @@ class NotificationBot:
             return
             
         try:
+            await self.retention.stop()
+            await self.outbound.stop()
             await self.bot.disconnect()
             self.is_running = False
             logger.info("Бот уведомлений остановлен")
         except Exception as e:
             logger.error(f"Ошибка остановки бота уведомлений: {e}")
             
-    async def send_notification(self, user_info: User, message_text: str, message_count: int = 1, event=None):
-        """Отправка уведомления о новом сообщении администратору."""
+    async def send_notification(self, envelope: MessageEnvelope, client=None, message_count: int = 1,
+                                queued: asyncio.Future = None):
+        """Отправка уведомления о новом сообщении администратору.
+        
+        client — клиент аккаунта, получившего сообщение; нужен только для
+        пересылки медиа, которого еще нет в кэше бота. queued завершается,
+        когда уведомление поставлено в очередь отправки (или обработка
+        закончилась раньше): обработчик ждет его, а не самой отправки.
+        """
         if not self.is_running:
             logger.warning("Бот уведомлений не запущен, уведомление не отправлено")
             return
         
+        started = time.perf_counter()
         try:
-            # Получаем информацию о пользователе
-            username = getattr(user_info, 'username', None)
-            user_id = getattr(user_info, 'id', 'неизвестно')
-            first_name = getattr(user_info, 'first_name', '')
-            last_name = getattr(user_info, 'last_name', '')
-            
             # Проверяем, не является ли отправитель самим админом
-            if user_id == ADMIN_ID:
+            if envelope.sender_id == ADMIN_ID:
                 logger.info(f"Пропущено уведомление о сообщении от админа (ID: {ADMIN_ID})")
                 return False
             
-            # Формируем отображаемое имя пользователя
-            display_name = ""
-            if username:
-                display_name = f"@{username}"
-            else:
-                # Если нет username, используем имя и фамилию
-                if first_name or last_name:
-                    display_name = f"{first_name} {last_name}".strip()
-                else:
-                    # Если вообще нет информации, используем ID
-                    display_name = f"user_id:{user_id}"
-            
-            # Проверяем, является ли сообщение стикером или медиа
-            is_media = False
-            original_message = None
-            media_text = None
-            
-            # Получаем оригинальное сообщение
-            if event and hasattr(event, 'message'):
-                original_message = event.message
-            elif hasattr(user_info, '_message') and user_info._message:
-                original_message = user_info._message
+            display_name = envelope.display_name
+            message_text = envelope.notification_text
+            # Дубликаты с других аккаунтов могли прийти раньше, чем началась отправка
+            receivers = self._receivers_entry((envelope.account, envelope.message_id))
             
-            # Определяем тип сообщения, если есть оригинальное сообщение
-            if original_message:
-                # Проверяем на стикер
-                if hasattr(original_message, 'sticker') and original_message.sticker:
-                    is_media = True
-                    media_text = "📱 [Стикер]"
-                
-                # Проверяем на различные типы медиа
-                elif hasattr(original_message, 'media') and original_message.media:
-                    is_media = True
-                    media = original_message.media
-                    
-                    if isinstance(media, MessageMediaPhoto):
-                        media_text = "📷 [Фото]"
-                    elif isinstance(media, MessageMediaDocument):
-                        # Проверяем mime-тип, если доступен
-                        if hasattr(media.document, 'mime_type'):
-                            mime_type = media.document.mime_type
-                            if 'video' in mime_type:
-                                media_text = "🎬 [Видео]"
-                            elif 'audio' in mime_type:
-                                media_text = "🎵 [Аудио]"
-                            elif 'image' in mime_type:
-                                media_text = "📷 [Изображение]"
-                            else:
-                                media_text = "📱 [Медиа]"
-                        else:
-                            media_text = "📱 [Медиа]"
-                    else:
-                        media_text = "📱 [Медиа]"
-                
-                # Если это медиа, используем определенный тип для текста сообщения
-                if is_media and media_text:
-                    message_text = media_text
+            # Сохраняем сообщение в базе данных (медиа — с подписью его типа)
+            self.db.save_envelope(envelope)
             
-            # ПРОСТАЯ ПРЯМАЯ ПЕРЕСЫЛКА МЕДИА
+            # Доставка медиа: из кэша бота одним запросом или через пересылку аккаунтом
             media_forwarded = False
-            if is_media and original_message and event and hasattr(event, '_client'):
-                try:
-                    logger.info(f"Пересылаю медиа ({media_text}) напрямую в бота...")
-                    
-                    # Получаем клиент и ID сообщения
-                    client = event._client
-                    message_id = original_message.id
-                    chat_id = event.chat_id
-                    
-                    # Получаем ID бота из токена (первая часть до двоеточия)
-                    bot_id = int(BOT_TOKEN.split(':')[0])
-                    logger.info(f"ID бота для пересылки: {bot_id}")
-                    
-                    # ПРЯМАЯ ПЕРЕСЫЛКА через forward_messages В БОТА
-                    forwarded = await client.forward_messages(
-                        entity=bot_id,         # ID бота
-                        messages=message_id,   # ID сообщения для пересылки
-                        from_peer=chat_id      # ID чата отправителя
-                    )
-                    
-                    if forwarded:
-                        logger.info(f"Медиа успешно переслано в бота!")
-                        
-                        # Теперь пересылаем от бота админу
-                        try:
-                            await self.bot.forward_messages(
-                                entity=ADMIN_ID,         # ID админа
-                                messages=forwarded.id,   # ID только что пересланного сообщения
-                                from_peer=bot_id         # ID бота (откуда пересылать)
-                            )
-                            logger.info(f"Медиа успешно переслано от бота админу!")
-                            media_forwarded = True
-                        except Exception as e2:
-                            logger.error(f"Ошибка при пересылке от бота админу: {e2}")
-                    else:
-                        logger.error(f"Что-то пошло не так при пересылке в бота")
-                
-                except Exception as e:
-                    logger.error(f"Ошибка при пересылке медиа в бота: {e}")
+            if envelope.media_kind:
+                receivers['caption'] = f"{envelope.media_label} ({display_name})"
+                sent_accounts = len(receivers['accounts'])
+                media_message = await self.media_relay.relay(
+                    client, envelope,
+                    caption=receivers['caption'] + self.format_accounts(receivers['accounts']),
+                    queued=queued
+                )
+                if media_message is not None:
+                    media_forwarded = True
+                    receivers['media'], receivers['sent_accounts'] = media_message, sent_accounts
+                    # Аккаунты, добавленные во время доставки, дописываются в подпись
+                    self._show_receivers(receivers)
             
             # Отправляем текстовое уведомление только если это не медиа или медиа не удалось переслать
-            if not is_media or not media_forwarded:
-                # Форматируем уведомление в зависимости от количества сообщений
-                if message_count == 1:
-                    notification_text = (
-                        f"<b>Новое сообщение!</b>👑\n"
-                        f"{message_text}🗨️\n\n"
-                        f"<b>Контакт:</b> ({display_name})💛"
-                    )
-                else:
-                    notification_text = (
-                        f"<b>Сообщение ({message_count})!</b>👑\n"
-                        f"{message_text}🗨️\n\n"
-                        f"<b>Контакт:</b> ({display_name})💛"
-                    )
-                
-                # Сохраняем сообщение в базе данных
-                db.save_message(
-                    user_id=user_id,
-                    username=username or "",
-                    first_name=first_name,
-                    last_name=last_name,
-                    message_text=message_text,
-                    is_incoming=True
-                )
-                
+            if not media_forwarded:
                 # Создаем кнопки для перехода к пользователю
                 buttons = []
                 
                 # Если есть username, добавляем ссылку на t.me/username
-                if username:
-                    buttons.append(Button.url("Перейти к диалогу 🚀", f"https://t.me/{username}"))
+                if envelope.username:
+                    buttons.append(Button.url("Перейти к диалогу 🚀", f"https://t.me/{envelope.username}"))
                 else:
                     # Для пользователей без username используем tg://user?id
-                    if isinstance(user_id, int) or (isinstance(user_id, str) and user_id.isdigit()):
-                        buttons.append(Button.url("Перейти к диалогу 🚀", f"tg://user?id={user_id}"))
+                    buttons.append(Button.url("Перейти к диалогу 🚀", f"tg://user?id={envelope.sender_id}"))
                 
-                try:
-                    await self.bot.send_message(
-                        ADMIN_ID, 
-                        notification_text, 
-                        buttons=buttons if buttons else None, 
-                        parse_mode='html'
-                    )
-                except Exception as e:
-                    logger.error(f"Ошибка при отправке уведомления: {str(e)}")
+                # Несколько сообщений подряд от одного отправителя объединяются в одно уведомление
+                if not await self.notify_burst((envelope.account, envelope.sender_id), message_text, message_count,
+                                               display_name, buttons, receivers, queued):
                     return False
             
             logger.info(f"Сообщение от {display_name} успешно обработано")
@@ -319,6 +512,238 @@ class NotificationBot:
         except Exception as e:
             logger.error(f"Ошибка обработки уведомления: {str(e)}")
             return False
+        finally:
+            mark_queued(queued)
+            NOTIFICATION_SEND_SECONDS.observe(time.perf_counter() - started,
+                                              kind='media' if envelope.media_kind else 'text')
+
+
+    def merge_duplicate(self, envelope: MessageEnvelope, first) -> bool:
+        """Добавление аккаунта в уведомление о таком же сообщении first = (аккаунт, ID сообщения).
 
-# Создаем глобальный экземпляр бота
-notification_bot = NotificationBot()
+        Сообщение не сохраняется и не отправляется повторно: уведомление
+        только дополняется списком получивших его аккаунтов. Если первое
+        уведомление еще не отправлено, аккаунт запоминается и попадет в него
+        при отправке. False — бот не запущен и объединить не с чем.
+        """
+        if not self.is_running:
+            return False
+        receivers = self._receivers_entry(first)
+        if envelope.account not in receivers['accounts']:
+            receivers['accounts'].append(envelope.account)
+            self._show_receivers(receivers)
+        return True
+    
+    def _receivers_entry(self, first) -> dict:
+        """Запись об аккаунтах, получивших сообщение first (создается при первом обращении)."""
+        receivers = self._receivers.get(first)
+        if receivers is not None:
+            return receivers
+        now = time.monotonic()
+        # Дубликаты приходят в пределах окна фильтра, более старые записи не нужны
+        while self._receivers:
+            key, entry = next(iter(self._receivers.items()))
+            if len(self._receivers) < DEDUP_MAX_ENTRIES and now - entry['at'] <= DEDUP_WINDOW:
+                break
+            del self._receivers[key]
+        receivers = self._receivers[first] = {
+            'at': now,
+            'accounts': [first[0]],
+            'burst': None,  # Текстовое уведомление (ключ, серия), в котором показано сообщение
+            'media': None,  # Или сообщение с медиа в чате админа и его подпись
+            'caption': None,
+            'sent_accounts': 1,
+            'edit_task': None,
+        }
+        return receivers
+    
+    def _show_receivers(self, receivers: dict):
+        """Планирование правки уведомления, в котором еще нет всех получивших сообщение аккаунтов."""
+        if receivers['burst'] is not None:
+            key, burst = receivers['burst']
+            for account in receivers['accounts']:
+                if account not in burst['accounts']:
+                    burst['accounts'].append(account)
+            # Пока первое уведомление не отправлено, правку запланирует отправитель
+            if burst['message'] is not None and burst['edit_task'] is None and self._burst_changed(burst):
+                burst['edit_task'] = asyncio.create_task(self._edit_burst(key, burst))
+        elif (receivers['media'] is not None and receivers['edit_task'] is None
+              and len(receivers['accounts']) != receivers['sent_accounts']):
+            receivers['edit_task'] = asyncio.create_task(self._edit_caption(receivers))
+    
+    async def _edit_caption(self, receivers: dict):
+        """Дополнение подписи медиа списком получивших его аккаунтов."""
+        try:
+            async def edit():
+                accounts = len(receivers['accounts'])
+                await self.bot.edit_message(
+                    ADMIN_ID,
+                    receivers['media'],
+                    receivers['caption'] + self.format_accounts(receivers['accounts']),
+                    parse_mode='html'
+                )
+                receivers['sent_accounts'] = accounts
+            
+            while len(receivers['accounts']) != receivers['sent_accounts']:
+                await asyncio.sleep(NOTIFICATION_EDIT_DELAY)
+                await (await self.outbound.submit(PRIORITY_EDIT, ADMIN_ID, edit))
+        except Exception as e:
+            logger.error(f"Ошибка обновления подписи медиа: {str(e)}")
+        finally:
+            receivers['edit_task'] = None
+    
+    @property
+    def is_backlogged(self) -> bool:
+        """Очередь исходящих уведомлений почти заполнена."""
+        return self.outbound.is_congested
+    
+    async def wait_for_capacity(self):
+        """Ожидание освобождения очереди исходящих уведомлений."""
+        await self.outbound.wait_for_capacity()
+    
+    @staticmethod
+    def format_accounts(accounts) -> str:
+        """Строка со списком аккаунтов, если сообщение получили несколько аккаунтов."""
+        if len(accounts) <= 1:
+            return ""
+        return f"\n<b>Получено аккаунтами:</b> {', '.join(html.escape(str(account)) for account in accounts)}"
+    
+    @staticmethod
+    def format_notification(texts, message_count: int, display_name: str, accounts=()) -> str:
+        """Форматирование уведомления в зависимости от количества сообщений и получивших их аккаунтов."""
+        message_text = "\n".join(texts)
+        if len(message_text) > NOTIFICATION_TEXT_CHARS:
+            # Оставляем последние сообщения серии
+            message_text = "…" + message_text[-NOTIFICATION_TEXT_CHARS:]
+        
+        if message_count == 1:
+            header = "<b>Новое сообщение!</b>👑"
+        else:
+            header = f"<b>Сообщение ({message_count})!</b>👑"
+        return (
+            f"{header}\n"
+            f"{message_text}🗨️\n\n"
+            f"<b>Контакт:</b> ({display_name})💛"
+        ) + NotificationBot.format_accounts(accounts)
+    
+    async def notify_burst(self, key, message_text: str, message_count: int, display_name: str, buttons,
+                           receivers=None, queued: asyncio.Future = None) -> bool:
+        """Отправка уведомления с объединением серии сообщений от одного отправителя.
+        
+        Первое сообщение серии отправляется сразу, следующие в пределах окна
+        NOTIFICATION_BURST_WINDOW дописываются в то же уведомление, которое
+        редактируется не чаще раза в NOTIFICATION_EDIT_DELAY секунд.
+        receivers — запись об аккаунтах, получивших сообщение (см. merge_duplicate);
+        queued завершается после постановки отправки в очередь (см. send_notification).
+        """
+        now = time.monotonic()
+        burst = self._bursts.get(key)
+        accounts = list(receivers['accounts']) if receivers else [key[0]]
+        
+        if burst and now - burst['last_at'] <= NOTIFICATION_BURST_WINDOW:
+            if receivers:
+                receivers['burst'] = (key, burst)
+            burst['texts'].append(message_text)
+            for account in accounts:
+                if account not in burst['accounts']:
+                    burst['accounts'].append(account)
+            # Для текста уведомления достаточно последних сообщений серии
+            del burst['texts'][:-NOTIFICATION_BURST_TEXTS]
+            burst['count'] += message_count
+            burst['last_at'] = now
+            burst['display_name'] = display_name
+            # Пока первое уведомление не отправлено, правку запланирует отправитель
+            if burst['message'] is not None and burst['edit_task'] is None:
+                burst['edit_task'] = asyncio.create_task(self._edit_burst(key, burst))
+            return True
+        
+        if len(self._bursts) > 256:
+            self._prune_bursts(now)
+        burst = {
+            'message': None,
+            'texts': [message_text],
+            'count': message_count,
+            'sent_count': message_count,
+            'last_at': now,
+            'display_name': display_name,
+            'buttons': buttons,
+            'accounts': accounts,
+            'sent_accounts': 1,
+            'edit_task': None,
+        }
+        self._bursts[key] = burst
+        if receivers:
+            # Связь устанавливается до отправки: аккаунты-дубликаты попадут в этот же burst
+            receivers['burst'] = (key, burst)
+        
+        async def send():
+            count, accounts = burst['count'], len(burst['accounts'])
+            message = await self.bot.send_message(
+                ADMIN_ID,
+                self.format_notification(burst['texts'], count, burst['display_name'], burst['accounts']),
+                buttons=buttons,
+                parse_mode='html'
+            )
+            burst['sent_count'], burst['sent_accounts'] = count, accounts
+            return message
+        
+        while True:
+            attempted = burst['count']
+            try:
+                sent = await self.outbound.submit(PRIORITY_TEXT, ADMIN_ID, send)
+                mark_queued(queued)
+                burst['message'] = await sent
+                break
+            except Exception as e:
+                logger.error(f"Ошибка при отправке уведомления: {str(e)}")
+            # Сообщения, дописанные в серию во время отправки, уже считаются принятыми:
+            # отправляем уведомление заново со всем накопленным
+            if burst['count'] != attempted:
+                logger.warning(f"Повторная отправка уведомления: {burst['count']} сообщ. от {burst['display_name']}")
+                continue
+            if self._bursts.get(key) is burst:
+                del self._bursts[key]
+            if burst['count'] > message_count:
+                logger.error(f"Уведомление о {burst['count']} сообщ. от {burst['display_name']} не отправлено, "
+                             f"в том числе о {burst['count'] - message_count} дописанных в серию")
+            return False
+        
+        # За время отправки могли прийти новые сообщения серии
+        if self._burst_changed(burst) and burst['edit_task'] is None:
+            burst['edit_task'] = asyncio.create_task(self._edit_burst(key, burst))
+        return True
+    
+    async def _edit_burst(self, key, burst):
+        """Обновление объединенного уведомления после паузы."""
+        try:
+            async def edit():
+                # Текст формируется в момент отправки, чтобы учесть все сообщения из очереди
+                count, accounts = burst['count'], len(burst['accounts'])
+                await self.bot.edit_message(
+                    ADMIN_ID,
+                    burst['message'],
+                    self.format_notification(burst['texts'], count, burst['display_name'], burst['accounts']),
+                    buttons=burst['buttons'],
+                    parse_mode='html'
+                )
+                burst['sent_count'], burst['sent_accounts'] = count, accounts
+            
+            while self._burst_changed(burst):
+                await asyncio.sleep(NOTIFICATION_EDIT_DELAY)
+                await (await self.outbound.submit(PRIORITY_EDIT, ADMIN_ID, edit))
+        except Exception as e:
+            logger.error(f"Ошибка обновления уведомления: {str(e)}")
+        finally:
+            burst['edit_task'] = None
+    
+    @staticmethod
+    def _burst_changed(burst) -> bool:
+        """В серии есть сообщения или аккаунты, которых еще нет в отправленном уведомлении."""
+        return burst['count'] != burst['sent_count'] or len(burst['accounts']) != burst['sent_accounts']
+    
+    def _prune_bursts(self, now: float):
+        """Удаление завершенных серий, окно которых истекло."""
+        expired = [key for key, burst in self._bursts.items()
+                   if now - burst['last_at'] > NOTIFICATION_BURST_WINDOW and burst['edit_task'] is None]
+        for key in expired:
+            del self._bursts[key]
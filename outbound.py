@@ -0,0 +1,168 @@
+import asyncio
+import itertools
+import logging
+import time
+
+from telethon.errors import FloodWaitError
+
+from metrics import OUTBOUND_QUEUE_WAIT_SECONDS, OUTBOUND_QUEUE_DEPTH, FLOOD_WAITS, FLOOD_WAIT_SECONDS
+from config import (OUTBOUND_QUEUE_SIZE, OUTBOUND_GLOBAL_RATE, OUTBOUND_GLOBAL_BURST,
+                    OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST, OUTBOUND_MAX_RETRIES)
+
+logger = logging.getLogger('notification_bot')
+
+# Приоритеты отправки: меньшее значение отправляется раньше
+PRIORITY_TEXT = 0
+PRIORITY_EDIT = 1
+PRIORITY_MEDIA = 2
+
+# Доля заполнения очереди, после которой обработчики притормаживают
+HIGH_WATER_RATIO = 0.8
+LOW_WATER_RATIO = 0.5
+
+
+def mark_queued(queued: asyncio.Future):
+    """Сигнал ожидающему обработчику: запрос поставлен в очередь (queued может быть None)."""
+    if queued is not None and not queued.done():
+        queued.set_result(None)
+
+
+class TokenBucket:
+    """Ограничитель скорости «ведро токенов»: rate запросов в секунду с запасом burst."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Ожидание свободного токена."""
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class OutboundQueue:
+    """Ограниченная очередь исходящих запросов бота.
+
+    Запросы выполняются одним обработчиком в порядке приоритета с учетом
+    общего лимита бота и лимита на чат. FloodWaitError приостанавливает
+    отправку на указанное Telegram время, после чего запрос повторяется.
+    Заполненность очереди видна вызывающему коду через is_congested.
+    """
+
+    def __init__(self, maxsize: int = OUTBOUND_QUEUE_SIZE):
+        self.maxsize = maxsize
+        self._queue = None
+        self._worker = None
+        self._seq = itertools.count()
+        self._global = TokenBucket(OUTBOUND_GLOBAL_RATE, OUTBOUND_GLOBAL_BURST)
+        self._chats = {}
+        self._paused_until = 0.0
+        self._capacity = None
+
+    def start(self):
+        """Запуск обработчика очереди в текущем цикле событий."""
+        if self._worker and not self._worker.done():
+            return
+        self._queue = asyncio.PriorityQueue(maxsize=self.maxsize)
+        self._capacity = asyncio.Event()
+        self._capacity.set()
+        self._worker = asyncio.create_task(self._run())
+        OUTBOUND_QUEUE_DEPTH.set_function(lambda: self.depth)
+
+    async def stop(self):
+        """Остановка обработчика; неотправленные запросы отменяются."""
+        if self._worker:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+        while self._queue and not self._queue.empty():
+            future = self._queue.get_nowait()[4]
+            future.cancel()
+        # Ожидающие места в очереди не должны зависнуть после остановки
+        if self._capacity:
+            self._capacity.set()
+
+    @property
+    def depth(self) -> int:
+        """Текущее число запросов в очереди."""
+        return self._queue.qsize() if self._queue else 0
+
+    @property
+    def is_congested(self) -> bool:
+        """Очередь почти заполнена — новые уведомления стоит придержать."""
+        return self.depth >= self.maxsize * HIGH_WATER_RATIO
+
+    async def wait_for_capacity(self):
+        """Ожидание, пока очередь не освободится до нижней границы."""
+        if self._capacity and self.is_congested:
+            self._capacity.clear()
+            await self._capacity.wait()
+
+    async def submit(self, priority: int, chat_id: int, factory) -> asyncio.Future:
+        """Постановка запроса в очередь.
+
+        factory — функция без аргументов, возвращающая корутину запроса; она
+        вызывается заново при повторе после FloodWait. Возвращает future с
+        результатом запроса. Если очередь заполнена, ожидает места.
+        После stop() новые запросы не принимаются: RuntimeError.
+        """
+        if self._worker is None:
+            raise RuntimeError("очередь исходящих запросов остановлена")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((priority, next(self._seq), chat_id, factory, future, time.monotonic()))
+        # Очередь остановили, пока запрос ждал места: выполнять его уже некому
+        if self._worker is None:
+            future.cancel()
+        return future
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST)
+        return bucket
+
+    async def _run(self):
+        while True:
+            priority, _, chat_id, factory, future, queued_at = await self._queue.get()
+            OUTBOUND_QUEUE_WAIT_SECONDS.observe(time.monotonic() - queued_at, priority=priority)
+            if self._capacity and not self._capacity.is_set() and self.depth <= self.maxsize * LOW_WATER_RATIO:
+                self._capacity.set()
+            if future.cancelled():
+                continue
+            try:
+                future.set_result(await self._execute(chat_id, factory))
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+
+    async def _execute(self, chat_id, factory):
+        """Выполнение запроса с соблюдением лимитов и повтором после FloodWait."""
+        for attempt in range(OUTBOUND_MAX_RETRIES + 1):
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            await self._global.acquire()
+            await self._chat_bucket(chat_id).acquire()
+            try:
+                return await factory()
+            except FloodWaitError as e:
+                FLOOD_WAITS.inc(source='bot')
+                FLOOD_WAIT_SECONDS.inc(e.seconds, source='bot')
+                if attempt >= OUTBOUND_MAX_RETRIES:
+                    raise
+                logger.warning(f"FloodWait {e.seconds} с, отправка уведомлений приостановлена")
+                self._paused_until = time.monotonic() + e.seconds
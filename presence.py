@@ -0,0 +1,185 @@
+import asyncio
+import heapq
+import logging
+import random
+import time
+
+from colorama import Fore, Style
+from telethon import functions
+from telethon.errors import FloodWaitError
+
+from config import (ONLINE_STATUS_TTL, PRESENCE_REFRESH_MARGIN, PRESENCE_JITTER,
+                    PRESENCE_MIN_GAP, PRESENCE_RETRY_DELAY)
+from metrics import PRESENCE_REFRESH_SECONDS, PRESENCE_REFRESH_ERRORS, FLOOD_WAITS, FLOOD_WAIT_SECONDS
+
+logger = logging.getLogger('telegram_online')
+
+
+class PresenceScheduler:
+    """Общий планировщик статуса online для всех аккаунтов.
+
+    Telegram держит аккаунт в статусе online ещё несколько минут после
+    UpdateStatusRequest, поэтому планировщик хранит время истечения статуса
+    каждого аккаунта и обновляет его незадолго до окончания (со случайным
+    сдвигом), разнося обновления разных аккаунтов во времени.
+    """
+
+    def __init__(self, ttl=ONLINE_STATUS_TTL, margin=PRESENCE_REFRESH_MARGIN,
+                 jitter=PRESENCE_JITTER, min_gap=PRESENCE_MIN_GAP,
+                 retry_delay=PRESENCE_RETRY_DELAY):
+        self.ttl = ttl
+        self.margin = margin
+        self.jitter = jitter
+        self.min_gap = min_gap
+        self.retry_delay = retry_delay
+        self._accounts = {}  # phone -> состояние аккаунта
+        self._heap = []      # (время обновления, порядковый номер, phone, поколение)
+        self._seq = 0
+        self._wakeup = None
+        self._task = None
+        self._refresh_tasks = set()
+
+    def start(self):
+        """Запуск планировщика в текущем цикле событий."""
+        if self._task and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"{Fore.GREEN}Планировщик статуса онлайн запущен "
+                    f"(TTL {self.ttl} с, запас {self.margin} с){Style.RESET_ALL}")
+
+    async def stop(self):
+        """Остановка планировщика и незавершённых обновлений."""
+        tasks = list(self._refresh_tasks)
+        if self._task:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._refresh_tasks.clear()
+
+    def register(self, phone, client, on_online=None):
+        """Добавление аккаунта: первое обновление статуса выполняется сразу.
+
+        on_online вызывается один раз после первого успешного обновления статуса.
+        """
+        self._accounts[phone] = {
+            'client': client,
+            'expires_at': 0.0,
+            'last_activity': 0.0,
+            'generation': 0,
+            'on_online': on_online,
+        }
+        self._schedule(phone, time.monotonic())
+
+    def unregister(self, phone):
+        """Удаление аккаунта из планировщика."""
+        self._accounts.pop(phone, None)
+
+    def note_activity(self, phone):
+        """Отметка о запросе аккаунта, который уже считается активностью."""
+        state = self._accounts.get(phone)
+        if state:
+            state['last_activity'] = time.monotonic()
+
+    def refresh_soon(self, phone):
+        """Внеочередное обновление статуса (например, после переподключения)."""
+        if phone in self._accounts:
+            self._schedule(phone, time.monotonic())
+
+    def is_online(self, phone):
+        """Проверка, что статус online аккаунта ещё не истёк."""
+        state = self._accounts.get(phone)
+        if not state:
+            return False
+        return self._effective_expiry(state) > time.monotonic()
+
+    def _effective_expiry(self, state):
+        return max(state['expires_at'], state['last_activity'] + self.ttl)
+
+    def _plan(self, expires_at):
+        """Время следующего обновления: до истечения статуса с запасом и сдвигом."""
+        return expires_at - self.margin - random.uniform(0, self.jitter)
+
+    def _schedule(self, phone, when):
+        state = self._accounts[phone]
+        # Новое поколение делает устаревшими ранее запланированные записи
+        state['generation'] += 1
+        self._seq += 1
+        heapq.heappush(self._heap, (when, self._seq, phone, state['generation']))
+        if self._wakeup:
+            self._wakeup.set()
+
+    async def _run(self):
+        """Основной цикл: запуск обновлений по времени с минимальным интервалом между ними."""
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            when, _, phone, generation = self._heap[0]
+            delay = when - time.monotonic()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            state = self._accounts.get(phone)
+            if state is None or state['generation'] != generation:
+                continue
+
+            task = asyncio.create_task(self._refresh(phone, state))
+            self._refresh_tasks.add(task)
+            task.add_done_callback(self._refresh_tasks.discard)
+
+            # Разносим обновления разных аккаунтов, чтобы не было всплесков запросов
+            await asyncio.sleep(self.min_gap)
+
+    async def _refresh(self, phone, state):
+        """Обновление статуса online одного аккаунта."""
+        now = time.monotonic()
+
+        # Недавняя активность аккаунта уже продлила статус, запрос не нужен
+        activity_expiry = state['last_activity'] + self.ttl
+        if activity_expiry - self.margin > now:
+            self._reschedule(phone, state, self._plan(activity_expiry))
+            return
+
+        client = state['client']
+        if not client.is_connected():
+            self._reschedule(phone, state, now + self.retry_delay)
+            return
+
+        try:
+            with PRESENCE_REFRESH_SECONDS.time(account=phone):
+                await client(functions.account.UpdateStatusRequest(offline=False))
+        except Exception as e:
+            PRESENCE_REFRESH_ERRORS.inc(account=phone)
+            if isinstance(e, FloodWaitError):
+                FLOOD_WAITS.inc(source='account')
+                FLOOD_WAIT_SECONDS.inc(e.seconds, source='account')
+            logger.error(f"{Fore.RED}[{phone}] Ошибка обновления статуса: {e}{Style.RESET_ALL}")
+            self._reschedule(phone, state, time.monotonic() + self.retry_delay)
+            return
+
+        state['expires_at'] = time.monotonic() + self.ttl
+        on_online = state.pop('on_online', None)
+        if on_online:
+            on_online()
+        next_refresh = self._plan(state['expires_at'])
+        self._reschedule(phone, state, next_refresh)
+        logger.info(f"{Fore.CYAN}[{phone}] Статус онлайн обновлен, следующее обновление "
+                    f"через {next_refresh - time.monotonic():.0f} с{Style.RESET_ALL}",
+                    extra={'account': phone, 'sample_key': 'presence_refresh'})
+
+    def _reschedule(self, phone, state, when):
+        # Аккаунт мог быть удалён, пока выполнялся запрос
+        if self._accounts.get(phone) is state:
+            self._schedule(phone, when)
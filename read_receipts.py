@@ -0,0 +1,85 @@
+import asyncio
+import logging
+
+from colorama import Fore, Style
+from telethon import functions
+
+from config import READ_ACK_WINDOW
+
+logger = logging.getLogger('telegram_online')
+message_logger = logging.getLogger('message_logger')
+
+# Способы отметки прочтения: стандартный API и сырой запрос ReadHistoryRequest
+METHOD_ACKNOWLEDGE = 'acknowledge'
+METHOD_READ_HISTORY = 'read_history'
+
+
+class ReadReceiptAggregator:
+    """Объединение отметок о прочтении для одного аккаунта.
+
+    Вместо запроса на каждое сообщение собирает наибольший ID сообщения по
+    каждому чату за окно READ_ACK_WINDOW и отправляет одну отметку на чат.
+    Для каждого чата запоминается способ отметки, который сработал, чтобы
+    не повторять заведомо неудачный.
+    """
+
+    def __init__(self, client, phone, window: float = READ_ACK_WINDOW, on_acknowledged=None):
+        self.client = client
+        self.phone = phone
+        self.window = window
+        self.on_acknowledged = on_acknowledged
+        self._pending = {}  # chat_id -> наибольший ID непрочитанного сообщения
+        self._methods = {}  # chat_id -> способ отметки, сработавший последним
+        self._task = None
+
+    def mark_read(self, chat_id, message_id):
+        """Добавление сообщения в ближайшую отметку о прочтении."""
+        if message_id > self._pending.get(chat_id, 0):
+            self._pending[chat_id] = message_id
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self.window)
+        finally:
+            self._task = None
+        await self.flush()
+
+    async def flush(self):
+        """Отправка накопленных отметок о прочтении."""
+        pending, self._pending = self._pending, {}
+        for chat_id, max_id in pending.items():
+            await self._acknowledge(chat_id, max_id)
+
+    async def close(self):
+        """Отмена ожидания и отправка оставшихся отметок."""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._pending and self.client.is_connected():
+            await self.flush()
+
+    async def _acknowledge(self, chat_id, max_id):
+        preferred = self._methods.get(chat_id, METHOD_ACKNOWLEDGE)
+        fallback = METHOD_READ_HISTORY if preferred == METHOD_ACKNOWLEDGE else METHOD_ACKNOWLEDGE
+
+        for method in (preferred, fallback):
+            try:
+                if method == METHOD_ACKNOWLEDGE:
+                    await self.client.send_read_acknowledge(chat_id, max_id=max_id)
+                else:
+                    await self.client(functions.messages.ReadHistoryRequest(peer=chat_id, max_id=max_id))
+            except Exception as e:
+                logger.error(f"{Fore.YELLOW}[{self.phone}] Отметка прочтения ({method}) не удалась: {str(e)}{Style.RESET_ALL}")
+                continue
+
+            self._methods[chat_id] = method
+            if self.on_acknowledged:
+                self.on_acknowledged()
+            message_logger.info(f"{Fore.GREEN}[{self.phone}] Сообщения в чате {chat_id} до {max_id} отмечены как прочитанные{Style.RESET_ALL}",
+                                extra={'account': self.phone, 'chat_id': chat_id, 'sample_key': 'read_ack'})
+            return True
+
+        logger.error(f"{Fore.RED}[{self.phone}] Не удалось отметить сообщения в чате {chat_id} как прочитанные{Style.RESET_ALL}")
+        return False
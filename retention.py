@@ -0,0 +1,102 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from colorama import Fore, Style
+
+from config import (RETENTION_DAYS, RETENTION_MAX_MB, RETENTION_INTERVAL, RETENTION_BATCH_SIZE,
+                    VACUUM_STEP_PAGES, RETENTION_STEP_PAUSE)
+from database import AUTO_VACUUM_INCREMENTAL
+
+logger = logging.getLogger('telegram_online')
+
+
+class RetentionManager:
+    """Применение политик хранения к основной базе сообщений.
+
+    Раз в interval переносит в помесячный архив сообщения старше max_age_days
+    и самые старые сообщения, пока данные базы больше max_size_mb, а затем
+    возвращает освободившиеся страницы через incremental_vacuum. Каждый шаг —
+    не больше batch_size сообщений или vacuum_pages страниц в потоке записи
+    с паузой между шагами, поэтому запись новых сообщений не останавливается.
+    """
+
+    def __init__(self, database, max_age_days: float = RETENTION_DAYS, max_size_mb: float = RETENTION_MAX_MB,
+                 interval: float = RETENTION_INTERVAL, batch_size: int = RETENTION_BATCH_SIZE,
+                 vacuum_pages: int = VACUUM_STEP_PAGES, step_pause: float = RETENTION_STEP_PAUSE):
+        self.db = database
+        self.max_age_days = max_age_days
+        self.max_size_mb = max_size_mb
+        self.interval = interval
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        self.step_pause = step_pause
+        self._task = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.max_age_days or self.max_size_mb)
+
+    def start(self):
+        """Запуск периодического обслуживания в текущем цикле событий."""
+        if self._task is None and self.enabled:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановка обслуживания; текущий шаг в потоке записи завершается сам."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"{Fore.RED}Ошибка обслуживания истории сообщений: {e}{Style.RESET_ALL}")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> dict:
+        """Один проход: архивация по возрасту, по размеру и сжатие. Возвращает статистику прохода."""
+        result = {'archived_by_age': 0, 'archived_by_size': 0, 'vacuumed_pages': 0}
+
+        if self.max_age_days:
+            cutoff = (datetime.now() - timedelta(days=self.max_age_days)).isoformat(' ')
+            while True:
+                moved = await asyncio.wrap_future(self.db.archive_messages(self.batch_size, cutoff))
+                result['archived_by_age'] += moved
+                if moved < self.batch_size:
+                    break
+                await asyncio.sleep(self.step_pause)
+
+        stats = await asyncio.wrap_future(self.db.storage_stats())
+        if self.max_size_mb:
+            limit = self.max_size_mb * 1024 * 1024
+            # Удаленные строки освобождают страницы не сразу, поэтому размер
+            # пересчитывается после каждого шага по занятым, а не всем страницам
+            while stats['used_bytes'] > limit:
+                moved = await asyncio.wrap_future(self.db.archive_messages(self.batch_size))
+                result['archived_by_size'] += moved
+                if not moved:
+                    break
+                await asyncio.sleep(self.step_pause)
+                stats = await asyncio.wrap_future(self.db.storage_stats())
+
+        if stats['auto_vacuum'] == AUTO_VACUUM_INCREMENTAL:
+            free_pages = stats['free_pages']
+            while free_pages:
+                remaining = await asyncio.wrap_future(self.db.incremental_vacuum(self.vacuum_pages))
+                result['vacuumed_pages'] += free_pages - remaining
+                if remaining >= free_pages:
+                    break
+                free_pages = remaining
+                await asyncio.sleep(self.step_pause)
+
+        if any(result.values()):
+            logger.info(f"{Fore.CYAN}Обслуживание истории: в архив по возрасту {result['archived_by_age']}, "
+                        f"по размеру {result['archived_by_size']}, освобождено страниц {result['vacuumed_pages']}"
+                        f"{Style.RESET_ALL}")
+        return result
@@ -0,0 +1,677 @@
+import fcntl
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from archive import ARCHIVE_SCHEMA
+from config import SEGMENT_DIR, SEGMENT_SIZE_MB, EXPORT_CHUNK_SIZE
+from database import EXPORT_MESSAGE_FIELDS, MessageDatabase, WriteJob, rollup_backfill
+
+logger = logging.getLogger('telegram_online')
+
+# Заголовок записи журнала: CRC32 остатка записи, ID сообщения, ID пользователя,
+# время в микросекундах от 1970-01-01 (без часового пояса, как в SQLite),
+# признак входящего сообщения и длина текста в байтах UTF-8; за ним — текст
+RECORD_HEADER = struct.Struct('<IqqqBI')
+_RECORD_BODY = struct.Struct('<qqqBI')
+
+_FILE_RE = re.compile(r'^messages_(\d{6})\.seg$')
+# Файл блокировки: журнал пишет только процесс, удерживающий на нем flock
+_LOCK_FILE = 'writer.lock'
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+# Позиция записи в индексе: номер сегмента в старших 32 битах, смещение — в младших
+_OFFSET_BITS = 32
+_OFFSET_MASK = (1 << _OFFSET_BITS) - 1
+
+# Число записей, переносимых из таблицы messages или в статистику за один шаг
+_IMPORT_CHUNK = 10000
+
+
+def to_micros(moment) -> int:
+    """Время сообщения (datetime или строка SQLite) в микросекундах от 1970-01-01."""
+    if moment is None:
+        return 0
+    if not isinstance(moment, datetime):
+        moment = datetime.fromisoformat(str(moment))
+    return (moment.replace(tzinfo=None) - _EPOCH) // _MICROSECOND
+
+
+def from_micros(micros: int) -> str:
+    """Время в формате, в котором его хранит SQLite (datetime.isoformat(' '))."""
+    return (_EPOCH + micros * _MICROSECOND).isoformat(' ')
+
+
+class SegmentLog:
+    """Журнал сообщений в сегментных файлах только с дозаписью.
+
+    Записи добавляются в конец текущего сегмента messages_NNNNNN.seg;
+    заполненный сегмент больше не меняется. Файл сегмента сразу создается
+    размером segment_bytes и отображается в память один раз, поэтому чтение
+    новых записей не требует повторного mmap. Для каждого пользователя в
+    памяти хранится массив позиций его записей (8 байт на сообщение) в
+    порядке записи; он строится одним последовательным проходом при открытии.
+
+    Журнал открывается только для чтения. Писать может один процесс: первый
+    вызов acquire() берет исключительную блокировку каталога, остальные
+    процессы (воркеры шардов, экспорт) только читают и подхватывают новые
+    записи владельца при обращении к индексу. В процессе-владельце пишет
+    только поток записи MessageDatabase; читать можно из любого потока.
+    """
+
+    def __init__(self, directory: str = SEGMENT_DIR, segment_bytes: int = SEGMENT_SIZE_MB * 1024 * 1024):
+        self.directory = directory
+        self.segment_bytes = max(segment_bytes, 1024 * 1024)
+        self.next_id = 1
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()  # Одно обновление индекса за раз; захват журнала ждет его
+        self._index: Dict[int, array] = {}  # ID пользователя -> позиции записей
+        self._maps: Dict[int, mmap.mmap] = {}  # номер сегмента -> отображение файла
+        self._sizes: Dict[int, int] = {}  # номер сегмента -> размер записанных данных
+        self._active = None
+        self._file = None
+        self._lock_file = None
+        self.open()
+
+    def path_for(self, number: int) -> str:
+        return os.path.join(self.directory, f"messages_{number:06d}.seg")
+
+    @property
+    def writable(self) -> bool:
+        """Журнал открыт для записи этим процессом."""
+        return self._lock_file is not None
+
+    def open(self):
+        """Открытие сегментов и восстановление индекса (только для чтения)."""
+        os.makedirs(self.directory, exist_ok=True)
+        self.refresh()
+        if self._sizes:
+            logger.info(f"Журнал сообщений: {len(self._sizes)} сегм., {self.count} сообщений")
+
+    def acquire(self) -> bool:
+        """Захват журнала для записи; False, если журнал пишет другой процесс.
+
+        Недописанный хвост текущего сегмента отбрасывается только владельцем:
+        пока блокировку держит другой процесс, хвост может быть записью в работе.
+        """
+        with self._refresh_lock:
+            if self.writable:
+                return True
+            lock_file = open(os.path.join(self.directory, _LOCK_FILE), 'a+b')
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+            # Прежний владелец завершился: дочитываем то, что он успел записать
+            self._refresh()
+            with self._lock:
+                numbers = sorted(self._sizes)
+            self._open_active(numbers[-1] if numbers else 1)
+            self._lock_file = lock_file
+            return True
+
+    def refresh(self):
+        """Чтение записей, добавленных владельцем журнала после прошлого обновления.
+
+        Заполненные сегменты не меняются, поэтому просматриваются только
+        последний известный сегмент и новые. Сегменты, удаленные владельцем
+        при переносе в архив, убираются из индекса.
+        """
+        with self._refresh_lock:
+            # Владелец сам добавляет свои записи в индекс
+            if not self.writable:
+                self._refresh()
+
+    def _refresh(self):
+        numbers = sorted(int(match.group(1)) for match in map(_FILE_RE.match, os.listdir(self.directory)) if match)
+        with self._lock:
+            known = sorted(self._sizes)
+        for number in known:
+            if number not in numbers:
+                self._forget(number)
+        last = known[-1] if known else 0
+        for number in numbers:
+            if number >= last:
+                self._load(number)
+
+    def _load(self, number: int):
+        """Дочитывание сегмента с последней известной позиции.
+
+        Записи читаются из файла, а не из отображения: владелец может в это
+        время обрезать сегмент, и чтение отображения за концом файла
+        завершило бы процесс по SIGBUS.
+        """
+        path = self.path_for(number)
+        with self._lock:
+            offset = self._sizes.get(number, 0)
+        added = []
+        next_id = self.next_id
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            f.seek(offset)
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                crc, message_id, user_id, _, _, length = RECORD_HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or crc != zlib.crc32(payload, zlib.crc32(header[4:])):
+                    break
+                added.append((user_id, number << _OFFSET_BITS | offset))
+                next_id = max(next_id, message_id + 1)
+                offset += RECORD_HEADER.size + length
+            size = os.fstat(f.fileno()).st_size
+            with self._lock:
+                mapped = self._maps.get(number)
+            # Отображение, снятое до того, как владелец снова расширил сегмент, не покрывает новые записи
+            if size and (mapped is None or len(mapped) < offset):
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with self._lock:
+            if mapped is not None:
+                self._maps[number] = mapped
+            self._sizes[number] = offset
+            self.next_id = next_id
+            for user_id, position in added:
+                positions = self._index.get(user_id)
+                if positions is None:
+                    positions = self._index[user_id] = array('Q')
+                positions.append(position)
+
+    def _open_active(self, number: int):
+        """Открытие сегмента для дозаписи с заранее выделенным местом (только владельцем)."""
+        path = self.path_for(number)
+        self._file = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+        size = self._sizes.get(number, 0)
+        if os.fstat(self._file.fileno()).st_size < self.segment_bytes:
+            self._file.truncate(self.segment_bytes)
+        # После запаса места в конце сегмента идут нули; все остальное — недописанная запись
+        self._file.seek(size)
+        if self._file.read(RECORD_HEADER.size).strip(b'\0'):
+            logger.warning(f"Журнал сообщений: поврежденный хвост сегмента {path} после {size} байт отброшен")
+        self._file.seek(size)
+        self._file.write(b'\0' * RECORD_HEADER.size)
+        self._file.seek(size)
+        with self._lock:
+            self._maps[number] = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._sizes[number] = size
+            self._active = number
+
+    def _roll(self):
+        """Закрытие заполненного сегмента (файл обрезается по данным) и переход к следующему."""
+        number = self._active
+        self._file.flush()
+        self._file.truncate(self._sizes[number])
+        self._file.close()
+        with self._lock:
+            with open(self.path_for(number), 'rb') as f:
+                self._maps[number] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._open_active(number + 1)
+
+    def append(self, records: Iterable[Tuple[Optional[int], int, str, Any, bool]]) -> int:
+        """Дозапись сообщений (ID или None, ID пользователя, текст, время, входящее).
+
+        Новые записи становятся видны читателям после записи всего пакета.
+        Возвращает число записанных сообщений.
+        """
+        if not self.writable:
+            raise RuntimeError("журнал сообщений открыт только для чтения (его пишет другой процесс)")
+        added = []
+        number, offset = self._active, self._sizes[self._active]
+        for message_id, user_id, text, moment, is_incoming in records:
+            if message_id is None:
+                message_id = self.next_id
+            self.next_id = max(self.next_id, message_id + 1)
+            payload = (text or '').encode('utf-8')
+            body = _RECORD_BODY.pack(message_id, user_id, to_micros(moment), bool(is_incoming), len(payload))
+            size = 4 + len(body) + len(payload)
+            if offset and offset + size > self.segment_bytes:
+                self._publish(number, offset, added)
+                added = []
+                self._roll()
+                number, offset = self._active, 0
+            self._file.write(struct.pack('<I', zlib.crc32(payload, zlib.crc32(body))) + body + payload)
+            added.append((user_id, number << _OFFSET_BITS | offset))
+            offset += size
+        self._publish(number, offset, added)
+        return len(added)
+
+    def _publish(self, number: int, offset: int, added: list):
+        self._file.flush()
+        with self._lock:
+            self._sizes[number] = offset
+            for user_id, position in added:
+                positions = self._index.get(user_id)
+                if positions is None:
+                    positions = self._index[user_id] = array('Q')
+                positions.append(position)
+
+    def _sync(self):
+        """Подхват записей владельца перед чтением индекса (в процессе-читателе)."""
+        if not self.writable:
+            self.refresh()
+
+    @property
+    def count(self) -> int:
+        self._sync()
+        with self._lock:
+            return sum(len(positions) for positions in self._index.values())
+
+    @property
+    def size(self) -> int:
+        """Объем записанных данных во всех сегментах, в байтах."""
+        self._sync()
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def positions(self, user_id: int) -> array:
+        """Снимок позиций записей пользователя (от старых к новым)."""
+        self._sync()
+        with self._lock:
+            positions = self._index.get(user_id)
+            return positions[:] if positions is not None else array('Q')
+
+    def segments(self) -> List[int]:
+        self._sync()
+        with self._lock:
+            return sorted(self._sizes)
+
+    def read(self, position: int) -> Optional[Dict[str, Any]]:
+        """Запись по позиции как строка таблицы messages; None, если сегмент уже в архиве.
+
+        Заголовок разбирается прямо в отображенной памяти, текст декодируется
+        из среза memoryview без промежуточной копии байтов.
+        """
+        mapped = self._maps.get(position >> _OFFSET_BITS)
+        if mapped is None:
+            return None
+        return self._record(mapped, position & _OFFSET_MASK)[0]
+
+    @staticmethod
+    def _record(mapped, offset: int) -> Tuple[Dict[str, Any], int]:
+        """Запись по смещению и смещение следующей записи."""
+        _, message_id, user_id, micros, is_incoming, length = RECORD_HEADER.unpack_from(mapped, offset)
+        start = offset + RECORD_HEADER.size
+        with memoryview(mapped) as view:
+            text = str(view[start:start + length], 'utf-8')
+        return {
+            'id': message_id,
+            'user_id': user_id,
+            'message_text': text,
+            'timestamp': from_micros(micros),
+            'is_incoming': is_incoming,
+        }, start + length
+
+    def message_id(self, position: int) -> int:
+        return RECORD_HEADER.unpack_from(self._maps[position >> _OFFSET_BITS], (position & _OFFSET_MASK) + 4)[0]
+
+    def find(self, positions: array, message_id: int) -> int:
+        """Индекс первой записи с ID не меньше message_id (ID в журнале растут)."""
+        lo, hi = 0, len(positions)
+        while lo < hi:
+            middle = (lo + hi) // 2
+            if self.message_id(positions[middle]) < message_id:
+                lo = middle + 1
+            else:
+                hi = middle
+        return lo
+
+    def scan(self, number: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """Последовательное чтение всех записей (или одного сегмента) в порядке записи."""
+        for segment in ([number] if number is not None else self.segments()):
+            with self._lock:
+                mapped, size = self._maps.get(segment), self._sizes.get(segment, 0)
+            offset = 0
+            while mapped is not None and offset < size:
+                record, offset = self._record(mapped, offset)
+                yield record
+
+    def last_micros(self, number: int) -> Optional[int]:
+        """Время последней записи сегмента (записи идут по времени)."""
+        last = None
+        for record in self.scan(number):
+            last = record['timestamp']
+        return to_micros(last) if last is not None else None
+
+    def drop(self, number: int):
+        """Удаление заполненного сегмента из индекса и с диска.
+
+        Отображение не закрывается явно: читатель, успевший взять его, дочитает
+        запись, а память освободится вместе с последней ссылкой.
+        """
+        if not self.writable:
+            raise RuntimeError("журнал сообщений открыт только для чтения (его пишет другой процесс)")
+        if number == self._active:
+            raise ValueError("текущий сегмент нельзя удалить")
+        self._forget(number)
+        os.remove(self.path_for(number))
+
+    def _forget(self, number: int):
+        """Удаление самого старого сегмента из индекса."""
+        boundary = (number + 1) << _OFFSET_BITS
+        with self._lock:
+            for user_id in list(self._index):
+                positions = self._index[user_id]
+                # Удаляемый сегмент — самый старый, его записи в начале массива
+                cut = bisect_left(positions, boundary)
+                if cut == len(positions):
+                    del self._index[user_id]
+                elif cut:
+                    self._index[user_id] = positions[cut:]
+            self._maps.pop(number, None)
+            self._sizes.pop(number, None)
+
+    def close(self):
+        """Закрытие журнала; владелец обрезает запас места в конце текущего сегмента."""
+        if self._file is not None:
+            self._file.flush()
+            self._file.truncate(self._sizes[self._active])
+            self._file.close()
+            self._file = None
+        if self._lock_file is not None:
+            # Блокировка снимается вместе с закрытием файла
+            self._lock_file.close()
+            self._lock_file = None
+        with self._lock:
+            maps, self._maps = self._maps, {}
+        for mapped in maps.values():
+            try:
+                mapped.close()
+            except BufferError:
+                pass
+
+
+class SegmentMessageDatabase(MessageDatabase):
+    """MessageDatabase, в которой сообщения хранятся в журнале SegmentLog.
+
+    Пользователи, статистика, кэши и архив остаются в SQLite; в основной базе
+    нет только строк messages. Сообщения, накопленные в таблице messages до
+    переключения, при первом запуске переносятся в журнал с теми же ID.
+    Запись пакета — последовательная дозапись в сегмент, история
+    пользователя читается по его позициям прямо из отображенных файлов.
+    """
+
+    def __init__(self, segment_dir: str = SEGMENT_DIR, segment_size_mb: float = SEGMENT_SIZE_MB, **kwargs):
+        self.segments = SegmentLog(segment_dir, int(segment_size_mb * 1024 * 1024))
+        super().__init__(**kwargs)
+
+    def _own_segments(self) -> bool:
+        """Захват журнала для записи при первой записи сообщений (в потоке записи).
+
+        Процессы, которые не пишут сообщения (воркеры шардов, экспорт,
+        пересчет статистики), журнал не захватывают и sqlite_sequence не трогают.
+        """
+        if self.segments.writable:
+            return True
+        if not self.segments.acquire():
+            return False
+        try:
+            self._import_messages()
+        except Exception as e:
+            logger.error(f"Ошибка переноса сообщений в журнал: {e}")
+        return True
+
+    def _write_batch(self, conn, batch):
+        if any(not isinstance(item, WriteJob) for item in batch) and not self._own_segments():
+            logger.error(f"Журнал сообщений {self.segments.directory} пишет другой процесс, "
+                         f"сообщения пакета не будут сохранены")
+        super()._write_batch(conn, batch)
+
+    def _import_messages(self):
+        """Перенос строк таблицы messages в журнал при захвате журнала (до записи первого пакета).
+
+        ID журнала и AUTOINCREMENT таблицы messages идут одной
+        последовательностью, поэтому строки с ID меньше следующего ID журнала
+        уже перенесены (например, до сбоя в прошлый запуск).
+        """
+        conn = self.conn
+        first_id = self.segments.next_id
+        with conn:
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) SELECT 'messages', 0 "
+                         "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'messages')")
+        seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'messages'").fetchone()[0]
+        self.segments.next_id = max(first_id, seq + 1)
+        total = conn.execute("SELECT count(*) FROM messages").fetchone()[0]
+        if not total:
+            return
+        cursor = conn.execute(
+            "SELECT id, user_id, message_text, timestamp, is_incoming FROM messages WHERE id >= ? ORDER BY id",
+            (first_id,)
+        )
+        moved = 0
+        while True:
+            rows = cursor.fetchmany(_IMPORT_CHUNK)
+            if not rows:
+                break
+            moved += self.segments.append(tuple(row) for row in rows)
+        self.segments._file.flush()
+        os.fsync(self.segments._file.fileno())
+        with conn:
+            conn.execute("DELETE FROM messages")
+        logger.info(f"Сообщения из таблицы messages перенесены в журнал: {moved}")
+
+    def _insert_messages(self, conn, batch):
+        self.segments.append((None, rec[0], rec[5], rec[6], rec[7]) for rec in batch)
+        # Последовательность ID общая с таблицей messages на случай возврата к хранилищу SQLite
+        conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'messages'", (self.segments.next_id - 1,))
+
+    def _storage_stats(self, conn) -> Dict[str, int]:
+        stats = super()._storage_stats(conn)
+        stats['used_bytes'] += self.segments.size
+        return stats
+
+    def archive_messages(self, limit: int, cutoff: Optional[str] = None) -> Future:
+        """Перенос самого старого заполненного сегмента в архив (limit не используется — сегмент переносится целиком).
+
+        С cutoff сегмент переносится, только если все его сообщения старше cutoff.
+        """
+        return self.run_in_writer(lambda conn: self._archive_segment(conn, cutoff))
+
+    def _archive_segment(self, conn, cutoff: Optional[str]) -> int:
+        # Сегменты удаляет только владелец журнала
+        if not self._own_segments():
+            return 0
+        segments = self.segments.segments()
+        if len(segments) < 2:
+            return 0
+        number = segments[0]
+        if cutoff is not None:
+            last = self.segments.last_micros(number)
+            if last is not None and last >= to_micros(cutoff):
+                return 0
+
+        months = {}
+        for record in self.segments.scan(number):
+            months.setdefault(record['timestamp'][:7], []).append(
+                (record['id'], record['user_id'], record['message_text'], record['timestamp'], record['is_incoming'])
+            )
+        os.makedirs(self.archive.archive_dir, exist_ok=True)
+        for month, rows in sorted(months.items()):
+            conn.execute("ATTACH DATABASE ? AS archive", (self.archive.path_for(month),))
+            try:
+                for statement in ARCHIVE_SCHEMA:
+                    conn.execute(statement.format(schema='archive'))
+                # INSERT OR IGNORE делает повтор после сбоя (до удаления сегмента) безопасным
+                with conn:
+                    conn.executemany(
+                        "INSERT OR IGNORE INTO archive.messages (id, user_id, message_text, timestamp, is_incoming) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        rows
+                    )
+            finally:
+                conn.execute("DETACH DATABASE archive")
+        self.segments.drop(number)
+        return sum(len(rows) for rows in months.values())
+
+    def _backfill_rollups(self, conn):
+        """Пересчет статистики по журналу: записи порциями проходят через временную таблицу messages."""
+        conn.execute("ATTACH DATABASE ':memory:' AS segment")
+        try:
+            conn.execute("CREATE TABLE segment.messages (user_id INTEGER, message_text TEXT, timestamp TIMESTAMP)")
+            records = self.segments.scan()
+            while True:
+                rows = [(record['user_id'], record['message_text'], record['timestamp'])
+                        for record in islice(records, _IMPORT_CHUNK)]
+                if not rows:
+                    break
+                with conn:
+                    conn.executemany("INSERT INTO segment.messages VALUES (?, ?, ?)", rows)
+                    for statement in rollup_backfill('segment'):
+                        conn.execute(statement)
+                    conn.execute("DELETE FROM segment.messages")
+        finally:
+            conn.execute("DETACH DATABASE segment")
+
+    def _with_users(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Добавление данных отправителя (username, имя, фамилия) к записям журнала."""
+        ids = list({message['user_id'] for message in messages})
+        users = {}
+        with self.readers.connection() as conn:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT id, username, first_name, last_name FROM users WHERE id IN ({', '.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                users.update((row['id'], row) for row in rows)
+        result = []
+        for message in messages:
+            user = users.get(message['user_id'])
+            for field in ('username', 'first_name', 'last_name'):
+                message[field] = user[field] if user else None
+            result.append({field: message[field] for field in EXPORT_MESSAGE_FIELDS})
+        return result
+
+    def search_messages(self, query: str, limit: int = 20, prefix: bool = True) -> List[Dict[str, Any]]:
+        """Поиск сообщений, содержащих все слова запроса, от новых к старым.
+
+        Полнотекстового индекса у журнала нет: сегменты просматриваются
+        последовательно прямо в отображенной памяти.
+        """
+        words = [word.casefold() for word in re.findall(r'\w+', query)]
+        if not words:
+            return []
+        # Как у FTS: слово запроса совпадает с началом слова текста (prefix) или со словом целиком
+        patterns = [re.compile(rf'\b{re.escape(word)}' + ('' if prefix else r'\b')) for word in words]
+        try:
+            found = deque(maxlen=limit)
+            for record in self.segments.scan():
+                text = record['message_text'].casefold()
+                # Проверка вхождения подстроки быстро отсеивает большинство записей
+                if all(word in text for word in words) and all(pattern.search(text) for pattern in patterns):
+                    found.append(record)
+            return self._with_users(list(reversed(found)))
+        except Exception as e:
+            logger.error(f"Ошибка поиска сообщений в журнале: {e}")
+            return []
+
+    def get_messages_by_user_id(self, user_id: int, limit: int = 100,
+                                include_archive: bool = False) -> List[Dict[str, Any]]:
+        """Получение истории сообщений пользователя (с архивом — начиная с архивных)."""
+        try:
+            messages = []
+            if include_archive:
+                archived = self.archive.iter_history(user_id, ascending=True)
+                try:
+                    for message in archived:
+                        if len(messages) >= limit:
+                            break
+                        messages.append(message)
+                finally:
+                    archived.close()
+            for position in self.segments.positions(user_id)[:max(0, limit - len(messages))]:
+                message = self.segments.read(position)
+                if message is not None:
+                    messages.append(message)
+            return messages
+        except Exception as e:
+            logger.error(f"Ошибка получения истории сообщений: {e}")
+            return []
+
+    def iter_history(self, user_id: int, before_id: Optional[int] = None, after_id: Optional[int] = None,
+                     chunk_size: int = 50, include_archive: bool = False) -> Iterator[Dict[str, Any]]:
+        """Ленивое чтение истории пользователя с курсором по ID сообщения.
+
+        Порядок и продолжение в архиве — как у MessageDatabase.iter_history;
+        позиция курсора в журнале находится двоичным поиском по ID.
+        """
+        positions = self.segments.positions(user_id)
+        cursor_id = after_id if after_id is not None else before_id
+        key = None
+        index = None
+        if cursor_id is not None:
+            found = self.segments.find(positions, cursor_id)
+            if found < len(positions) and self.segments.message_id(positions[found]) == cursor_id:
+                index = found
+                record = self.segments.read(positions[found])
+                key = (record['timestamp'], record['id'])
+            elif include_archive:
+                key = self.archive.find_key(cursor_id)
+            if key is None:
+                return
+
+        if after_id is not None:
+            if include_archive:
+                yield from self.archive.iter_history(user_id, after=key, ascending=True, chunk_size=chunk_size)
+            # Курсор в архиве: все сообщения журнала новее него
+            selected = positions[index + 1:] if index is not None else positions
+        elif key is None:
+            selected = positions[::-1]
+        else:
+            # Курсор в архиве: сообщения журнала новее него и пропускаются
+            selected = positions[index - 1::-1] if index else array('Q')
+
+        for position in selected:
+            message = self.segments.read(position)
+            if message is not None:
+                yield message
+
+        if include_archive and after_id is None:
+            yield from self.archive.iter_history(user_id, before=key, chunk_size=chunk_size)
+
+    def iter_export(self, user_id: Optional[int] = None, since: Optional[str] = None, until: Optional[str] = None,
+                    include_archive: bool = True, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+        """Потоковое чтение сообщений для экспорта: архив, затем журнал в порядке записи."""
+        if include_archive:
+            # Таблица messages основной базы пуста, поэтому базовый экспорт читает только архив
+            yield from super().iter_export(user_id, since, until, include_archive=True, chunk_size=chunk_size)
+
+        low = to_micros(since) if since else None
+        high = to_micros(until) if until else None
+        if user_id is not None:
+            records = (self.segments.read(position) for position in self.segments.positions(user_id))
+        else:
+            records = self.segments.scan()
+        chunk = []
+        for record in records:
+            if record is None:
+                continue
+            if low is not None or high is not None:
+                moment = to_micros(record['timestamp'])
+                if (low is not None and moment < low) or (high is not None and moment >= high):
+                    continue
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                yield from self._with_users(chunk)
+                chunk = []
+        if chunk:
+            yield from self._with_users(chunk)
+
+    def close(self):
+        super().close()
+        self.segments.close()
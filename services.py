@@ -0,0 +1,41 @@
+"""Общие сервисы приложения, создаваемые при первом обращении.
+
+База данных и бот уведомлений нужны не во всех режимах запуска (--help,
+меню настройки), поэтому они создаются лениво и в одном экземпляре на
+процесс; закрывает их close_services() при завершении программы.
+"""
+
+_db = None
+_notification_bot = None
+
+
+def get_db():
+    """База данных сообщений (открывается при первом вызове; хранилище сообщений — MESSAGE_STORE)."""
+    global _db
+    if _db is None:
+        from config import MESSAGE_STORE
+        if MESSAGE_STORE == 'segments':
+            from segment_store import SegmentMessageDatabase
+            _db = SegmentMessageDatabase()
+        else:
+            from database import MessageDatabase
+            _db = MessageDatabase()
+    return _db
+
+
+def get_notification_bot():
+    """Бот уведомлений (клиент и файл сессии создаются при первом вызове)."""
+    global _notification_bot
+    if _notification_bot is None:
+        from notification_bot import NotificationBot
+        _notification_bot = NotificationBot(get_db())
+    return _notification_bot
+
+
+def close_services():
+    """Закрытие созданных сервисов: запись оставшихся сообщений и закрытие БД."""
+    global _db, _notification_bot
+    _notification_bot = None
+    if _db is not None:
+        _db.close()
+        _db = None
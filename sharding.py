@@ -0,0 +1,267 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+import time
+
+from colorama import Fore, Style
+
+from config import SHARD_EVENT_QUEUE_SIZE, SHARD_RESTART_DELAY
+from dedup import NEW, REDELIVERY, MessageDeduplicator
+from hot_reload import add_reload_signal_handler
+from loop_watchdog import LoopWatchdog
+from metrics import DUPLICATE_MESSAGES, start_metrics_server
+from outbound import mark_queued
+
+logger = logging.getLogger('telegram_online')
+
+
+def split_accounts(accounts, shards):
+    """Распределение аккаунтов по процессам по кругу (порядок аккаунтов сохраняется)."""
+    shards = max(1, min(shards, len(accounts)))
+    return [accounts[i::shards] for i in range(shards)]
+
+
+class QueueNotifier:
+    """Замена NotificationBot в рабочем процессе.
+
+    Вместо отправки через бота уведомление передаётся супервизору через
+    очередь между процессами, где его обрабатывает единственный экземпляр
+    бота уведомлений и базы данных.
+    """
+
+    def __init__(self, events_queue, shard_index):
+        self.events_queue = events_queue
+        self.shard_index = shard_index
+
+    @property
+    def is_backlogged(self):
+        """Очередь событий супервизора почти заполнена."""
+        try:
+            return self.events_queue.qsize() >= SHARD_EVENT_QUEUE_SIZE * 0.8
+        except NotImplementedError:
+            # qsize() недоступен на macOS
+            return False
+
+    async def wait_for_capacity(self):
+        """Ожидание, пока супервизор не разберет очередь."""
+        while self.is_backlogged:
+            await asyncio.sleep(0.5)
+
+    async def send_notification(self, envelope, client=None, message_count=1, queued=None):
+        """Передача уведомления супервизору (клиент аккаунта в другой процесс не передается)."""
+        try:
+            self.events_queue.put_nowait((envelope, message_count))
+            return True
+        except queue.Full:
+            logger.error(f"{Fore.RED}[шард {self.shard_index}] Очередь событий переполнена, уведомление пропущено{Style.RESET_ALL}")
+            return False
+        finally:
+            mark_queued(queued)
+
+
+class ShardSupervisor:
+    """Супервизор рабочих процессов с аккаунтами.
+
+    Распределяет аккаунты по нескольким процессам, в каждом из которых
+    работает свой цикл событий с частью задач run_client, перезапускает
+    упавшие процессы и обрабатывает их уведомления через общий бот и БД.
+    """
+
+    def __init__(self, accounts, shards, worker, use_proxy=False, metrics_port=0, watchdog_threshold=0,
+                 load_accounts=None):
+        self.shards = split_accounts(accounts, shards)
+        self.load_accounts = load_accounts  # Чтение файла аккаунтов при перезагрузке
+        self.worker = worker
+        self.use_proxy = use_proxy
+        self.metrics_port = metrics_port
+        self.watchdog_threshold = watchdog_threshold
+        self.is_running = True
+        self.notification_bot = None
+        self.dedup = MessageDeduplicator()  # Фильтр повторов и дубликатов по аккаунтам всех шардов
+        self._ctx = multiprocessing.get_context('spawn')
+        self._events = self._ctx.Queue(maxsize=SHARD_EVENT_QUEUE_SIZE)
+        # Очереди команд рабочим процессам: новый список аккаунтов шарда при перезагрузке
+        self._controls = [self._ctx.Queue() for _ in self.shards]
+        self._processes = {}
+        self._restart_at = {}
+        self._tasks = set()
+
+    def _start_worker(self, index):
+        """Запуск рабочего процесса для одного шарда."""
+        process = self._ctx.Process(
+            target=self.worker,
+            args=(index, self.shards[index], self.use_proxy, self._events, self.metrics_port, self.watchdog_threshold,
+                  self._controls[index]),
+            name=f"shard-{index}",
+            daemon=True
+        )
+        process.start()
+        self._processes[index] = process
+        self._restart_at.pop(index, None)
+        logger.info(f"{Fore.GREEN}[шард {index}] Процесс запущен (PID {process.pid}, аккаунтов: {len(self.shards[index])}){Style.RESET_ALL}")
+
+    def _check_workers(self):
+        """Перезапуск завершившихся рабочих процессов с задержкой."""
+        now = time.monotonic()
+        for index, process in list(self._processes.items()):
+            if process.is_alive():
+                continue
+            if index not in self._restart_at:
+                logger.error(f"{Fore.RED}[шард {index}] Процесс завершился с кодом {process.exitcode}, "
+                             f"перезапуск через {SHARD_RESTART_DELAY} с{Style.RESET_ALL}")
+                self._restart_at[index] = now + SHARD_RESTART_DELAY
+            elif now >= self._restart_at[index]:
+                self._start_worker(index)
+
+    async def reload(self):
+        """Перезагрузка аккаунтов и фильтров без перезапуска процессов.
+        
+        Аккаунты остаются в своих шардах, удаленные убираются, новые
+        добавляются в наименее загруженный шард. Каждый рабочий процесс
+        получает свой список, сам перечитывает фильтры и запускает или
+        останавливает только изменившиеся аккаунты. Опустевший шард
+        останавливается, а шард, получивший аккаунты, запускается снова.
+        """
+        try:
+            accounts = self.load_accounts(strict=True)
+        except Exception as e:
+            logger.error(f"{Fore.RED}Ошибка перечитывания аккаунтов, аккаунты не изменены: {e}{Style.RESET_ALL}")
+            return "Перезагрузка: ошибка файла аккаунтов, аккаунты не изменены"
+
+        new = {account.get('phone'): account for account in accounts}
+        known = set()
+        shards = []
+        for shard in self.shards:
+            kept = [new[account.get('phone')] for account in shard if account.get('phone') in new]
+            known.update(account.get('phone') for account in kept)
+            shards.append(kept)
+        added = [account for phone, account in new.items() if phone not in known]
+        for account in added:
+            min(shards, key=len).append(account)
+        removed = sum(len(shard) for shard in self.shards) - len(known)
+        self.shards = shards
+
+        loop = asyncio.get_running_loop()
+        for index, shard in enumerate(self.shards):
+            process = self._processes.get(index)
+            if not shard:
+                if process:
+                    await loop.run_in_executor(None, self._stop_worker, index)
+            elif process is None:
+                self._start_worker(index)
+            else:
+                self._controls[index].put(shard)
+
+        summary = f"Перезагрузка: аккаунтов добавлено: {len(added)}, удалено: {removed}, шардов: {len(self._processes)}"
+        logger.info(f"{Fore.GREEN}{summary}{Style.RESET_ALL}")
+        return summary
+
+    def _stop_worker(self, index):
+        """Остановка рабочего процесса шарда без перезапуска."""
+        process = self._processes.pop(index, None)
+        self._restart_at.pop(index, None)
+        if process and process.is_alive():
+            process.terminate()
+            process.join(timeout=15)
+            if process.is_alive():
+                process.kill()
+        logger.info(f"{Fore.YELLOW}[шард {index}] Процесс остановлен: в шарде не осталось аккаунтов{Style.RESET_ALL}")
+
+    async def _consume_events(self):
+        """Обработка уведомлений из рабочих процессов."""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                envelope, message_count = await loop.run_in_executor(None, self._events.get, True, 1.0)
+            except queue.Empty:
+                continue
+
+            if not self.notification_bot:
+                continue
+
+            # Повторная доставка отбрасывается, дубликат с другого аккаунта дополняет первое уведомление
+            verdict, first = self.dedup.check(envelope)
+            if verdict != NEW:
+                DUPLICATE_MESSAGES.inc(kind=verdict)
+                if verdict == REDELIVERY or self.notification_bot.merge_duplicate(envelope, first):
+                    continue
+                logger.warning(f"{Fore.YELLOW}Не удалось объединить с уведомлением аккаунта {first[0]}, "
+                               f"сообщение обрабатывается отдельно{Style.RESET_ALL}")
+
+            # Отправка идет через очередь бота; при её заполнении перестаем забирать события
+            if self.notification_bot.is_backlogged:
+                await self.notification_bot.wait_for_capacity()
+            # Медиа из кэша бота отправляется как обычно, новое — подписью его типа
+            queued = loop.create_future()
+            task = asyncio.create_task(self.notification_bot.send_notification(envelope, message_count=message_count,
+                                                                               queued=queued))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            # Следующее событие забирается только после постановки этого в очередь отправки
+            await asyncio.wait({queued, task}, return_when=asyncio.FIRST_COMPLETED)
+
+    async def run(self):
+        """Запуск бота уведомлений, рабочих процессов и контроль их работы."""
+        from services import get_notification_bot
+
+        # Каждый процесс контролирует блокировки своего цикла событий и пишет свой отчет
+        watchdog = None
+        if self.watchdog_threshold:
+            watchdog = LoopWatchdog(self.watchdog_threshold)
+            watchdog.start()
+
+        # Супервизор отдает метрики бота и БД, рабочие процессы — метрики своих аккаунтов
+        metrics_server = None
+        if self.metrics_port:
+            try:
+                metrics_server = await start_metrics_server(self.metrics_port)
+            except OSError as e:
+                logger.error(f"{Fore.RED}Не удалось запустить эндпоинт метрик на порту {self.metrics_port}: {e}{Style.RESET_ALL}")
+
+        self.notification_bot = get_notification_bot()
+        if not await self.notification_bot.start():
+            self.notification_bot = None
+        elif self.load_accounts:
+            self.notification_bot.on_reload = self.reload
+
+        # Аккаунты перечитываются по SIGHUP, фильтры — рабочими процессами
+        if self.load_accounts:
+            add_reload_signal_handler(self._reload_in_background)
+
+        for index in range(len(self.shards)):
+            self._start_worker(index)
+
+        consumer = asyncio.create_task(self._consume_events())
+        try:
+            while self.is_running:
+                self._check_workers()
+                await asyncio.sleep(1)
+        finally:
+            consumer.cancel()
+            await asyncio.gather(consumer, return_exceptions=True)
+            self.stop_workers()
+            if metrics_server:
+                metrics_server.close()
+            if self.notification_bot:
+                await self.notification_bot.stop()
+            if watchdog:
+                await watchdog.stop()
+
+    def _reload_in_background(self):
+        task = asyncio.create_task(self.reload())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def stop_workers(self):
+        """Остановка всех рабочих процессов."""
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+        for index, process in self._processes.items():
+            process.join(timeout=15)
+            if process.is_alive():
+                logger.warning(f"{Fore.YELLOW}[шард {index}] Процесс не завершился, принудительная остановка{Style.RESET_ALL}")
+                process.kill()
+        self._processes.clear()
+        logger.info(f"{Fore.YELLOW}Рабочие процессы остановлены{Style.RESET_ALL}")
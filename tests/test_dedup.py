@@ -0,0 +1,69 @@
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from dedup import DUPLICATE, NEW, REDELIVERY, MessageDeduplicator
+from envelope import MessageEnvelope
+
+
+def envelope(account, message_id, text='привет', sender_id=5, chat_id=5):
+    return MessageEnvelope(account, chat_id, message_id, sender_id, 'user', 'Имя', 'Фамилия', text,
+                           None, None, datetime(2024, 1, 1))
+
+
+class MessageDeduplicatorTest(unittest.TestCase):
+    """Повторная доставка, дубликаты между аккаунтами и вытеснение записей."""
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('dedup.time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.dedup = MessageDeduplicator(window=60, max_entries=100)
+
+    def test_redelivery_of_same_message(self):
+        self.assertEqual(self.dedup.check(envelope('A', 1)), (NEW, None))
+        self.assertEqual(self.dedup.check(envelope('A', 1)), (REDELIVERY, None))
+
+    def test_duplicate_from_other_account(self):
+        self.dedup.check(envelope('A', 1))
+        self.assertEqual(self.dedup.check(envelope('B', 7)), (DUPLICATE, ('A', 1)))
+        # Тот же аккаунт повторно получает то же сообщение — это повторная доставка, не дубликат
+        self.assertEqual(self.dedup.check(envelope('B', 7)), (REDELIVERY, None))
+        self.assertEqual(self.dedup.check(envelope('C', 9)), (DUPLICATE, ('A', 1)))
+
+    def test_same_text_again_from_same_account_is_new(self):
+        self.dedup.check(envelope('A', 1))
+        self.assertEqual(self.dedup.check(envelope('A', 2)), (NEW, None))
+        # Новое сообщение становится первым для следующих дубликатов
+        self.assertEqual(self.dedup.check(envelope('B', 7)), (DUPLICATE, ('A', 2)))
+
+    def test_different_sender_or_text_is_new(self):
+        self.dedup.check(envelope('A', 1))
+        self.assertEqual(self.dedup.check(envelope('B', 7, text='другое')), (NEW, None))
+        self.assertEqual(self.dedup.check(envelope('B', 8, sender_id=6, chat_id=6)), (NEW, None))
+
+    def test_window_expiry(self):
+        self.dedup.check(envelope('A', 1))
+        self.now += 61
+        self.assertEqual(self.dedup.check(envelope('B', 7)), (NEW, None))
+        # Ключ доставки тоже истек: это уже не повторная доставка, а дубликат нового сообщения B
+        self.assertEqual(self.dedup.check(envelope('A', 1)), (DUPLICATE, ('B', 7)))
+
+    def test_max_entries(self):
+        dedup = MessageDeduplicator(window=60, max_entries=3)
+        for message_id in range(1, 6):
+            dedup.check(envelope('A', message_id, text=str(message_id)))
+        self.assertLessEqual(len(dedup), 3)
+        # Самые старые записи вытеснены
+        self.assertEqual(dedup.check(envelope('A', 1, text='1')), (NEW, None))
+        self.assertEqual(dedup.check(envelope('A', 5, text='5')), (REDELIVERY, None))
+
+    def test_disabled(self):
+        dedup = MessageDeduplicator(window=0)
+        self.assertEqual(dedup.check(envelope('A', 1)), (NEW, None))
+        self.assertEqual(dedup.check(envelope('A', 1)), (NEW, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
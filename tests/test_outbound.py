@@ -0,0 +1,171 @@
+import asyncio
+import time
+import unittest
+from unittest import mock
+
+from telethon.errors import FloodWaitError
+
+from outbound import PRIORITY_EDIT, PRIORITY_MEDIA, PRIORITY_TEXT, OutboundQueue, TokenBucket
+
+
+class TokenBucketTest(unittest.IsolatedAsyncioTestCase):
+    """Запас burst расходуется сразу, дальше токены приходят со скоростью rate."""
+
+    async def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=50, burst=3)
+        started = time.monotonic()
+        for _ in range(3):
+            await bucket.acquire()
+        self.assertLess(time.monotonic() - started, 0.01)
+        for _ in range(5):
+            await bucket.acquire()
+        # Пять токенов сверх запаса при 50 в секунду — около 0.1 с
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+
+    def test_refill_is_capped(self):
+        now = [100.0]
+        with mock.patch('outbound.time.monotonic', lambda: now[0]):
+            bucket = TokenBucket(rate=10, burst=2)
+            bucket.tokens = 0
+            now[0] += 60
+            bucket._refill()
+        self.assertEqual(bucket.tokens, 2)
+
+
+class OutboundQueueTest(unittest.IsolatedAsyncioTestCase):
+    """Порядок приоритетов, FloodWait, границы заполнения и остановка."""
+
+    async def asyncSetUp(self):
+        self.queue = self.make_queue()
+
+    async def asyncTearDown(self):
+        await self.queue.stop()
+
+    @staticmethod
+    def make_queue(maxsize=100):
+        queue = OutboundQueue(maxsize)
+        queue.start()
+        # Лимиты Telegram в тестах не нужны
+        queue._global = TokenBucket(10000, 10000)
+        queue._chat_bucket = lambda chat_id: queue._global
+        return queue
+
+    async def test_priority_order(self):
+        done = []
+        gate = asyncio.Event()
+
+        async def blocker():
+            await gate.wait()
+
+        def request(name):
+            async def call():
+                done.append(name)
+                return name
+            return call
+
+        first = await self.queue.submit(PRIORITY_TEXT, 1, blocker)
+        await asyncio.sleep(0)
+        futures = [
+            await self.queue.submit(PRIORITY_MEDIA, 1, request('media')),
+            await self.queue.submit(PRIORITY_EDIT, 1, request('edit')),
+            await self.queue.submit(PRIORITY_TEXT, 1, request('text')),
+        ]
+        gate.set()
+        await first
+        self.assertEqual(await asyncio.gather(*futures), ['media', 'edit', 'text'])
+        self.assertEqual(done, ['text', 'edit', 'media'])
+
+    async def test_flood_wait_pauses_and_retries(self):
+        attempts = []
+
+        async def call():
+            attempts.append(time.monotonic())
+            if len(attempts) == 1:
+                raise FloodWaitError(request=None, capture=1)
+            return 'ok'
+
+        self.assertEqual(await (await self.queue.submit(PRIORITY_TEXT, 1, call)), 'ok')
+        self.assertEqual(len(attempts), 2)
+        self.assertGreaterEqual(attempts[1] - attempts[0], 0.9)
+
+    async def test_flood_wait_gives_up_after_retries(self):
+        async def call():
+            raise FloodWaitError(request=None, capture=0)
+
+        with mock.patch('outbound.OUTBOUND_MAX_RETRIES', 2):
+            future = await self.queue.submit(PRIORITY_TEXT, 1, call)
+            await asyncio.wait({future})
+        self.assertIsInstance(future.exception(), FloodWaitError)
+
+    async def test_error_is_set_on_future(self):
+        async def call():
+            raise ValueError('ошибка')
+
+        # assertRaises очистил бы кадры трассировки, среди которых кадр обработчика очереди
+        future = await self.queue.submit(PRIORITY_TEXT, 1, call)
+        await asyncio.wait({future})
+        self.assertIsInstance(future.exception(), ValueError)
+
+        # Обработчик продолжает работу после ошибки запроса
+        async def ok():
+            return 1
+        self.assertEqual(await (await self.queue.submit(PRIORITY_TEXT, 1, ok)), 1)
+
+    async def test_watermarks(self):
+        await self.queue.stop()
+        self.queue = self.make_queue(maxsize=10)
+        gate = asyncio.Event()
+
+        async def call():
+            await gate.wait()
+
+        for _ in range(9):
+            await self.queue.submit(PRIORITY_TEXT, 1, call)
+        await asyncio.sleep(0)
+        # Один запрос выполняется, восемь ждут: верхняя граница 8 из 10
+        self.assertTrue(self.queue.is_congested)
+        waiter = asyncio.create_task(self.queue.wait_for_capacity())
+        await asyncio.sleep(0)
+        self.assertFalse(waiter.done())
+
+        gate.set()
+        await asyncio.wait_for(waiter, 1)
+        # Ожидание заканчивается на нижней границе, а не после полной разгрузки
+        self.assertLessEqual(self.queue.depth, 5)
+        self.assertFalse(self.queue.is_congested)
+
+    async def test_stop_cancels_pending_and_rejects_submit(self):
+        gate = asyncio.Event()
+
+        async def call():
+            await gate.wait()
+
+        running = await self.queue.submit(PRIORITY_TEXT, 1, call)
+        pending = await self.queue.submit(PRIORITY_TEXT, 1, call)
+        await asyncio.sleep(0)
+        await self.queue.stop()
+        self.assertTrue(running.cancelled())
+        self.assertTrue(pending.cancelled())
+        with self.assertRaises(RuntimeError):
+            await self.queue.submit(PRIORITY_TEXT, 1, call)
+
+    async def test_stop_while_waiting_for_space(self):
+        await self.queue.stop()
+        self.queue = self.make_queue(maxsize=1)
+        gate = asyncio.Event()
+
+        async def call():
+            await gate.wait()
+
+        await self.queue.submit(PRIORITY_TEXT, 1, call)
+        await asyncio.sleep(0)
+        await self.queue.submit(PRIORITY_TEXT, 1, call)
+        blocked = asyncio.create_task(self.queue.submit(PRIORITY_TEXT, 1, call))
+        await asyncio.sleep(0)
+        await self.queue.stop()
+        # Запрос, дождавшийся места после остановки, не зависает
+        self.assertTrue((await asyncio.wait_for(blocked, 1)).cancelled())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+from segment_store import SegmentLog
+
+SEGMENT_BYTES = 1024 * 1024
+
+
+class TwoOpenersTest(unittest.TestCase):
+    """Два процесса (здесь — два SegmentLog) открывают один каталог сегментов."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directory = self.tmp.name
+        self.owner = SegmentLog(self.directory, SEGMENT_BYTES)
+        self.assertTrue(self.owner.acquire())
+        self.reader = SegmentLog(self.directory, SEGMENT_BYTES)
+
+    def tearDown(self):
+        self.reader.close()
+        self.owner.close()
+        self.tmp.cleanup()
+
+    def append(self, log, user_id, text):
+        return log.append([(None, user_id, text, datetime(2024, 1, 1), True)])
+
+    def texts(self, log, user_id):
+        return [log.read(position)['message_text'] for position in log.positions(user_id)]
+
+    def test_second_opener_cannot_write(self):
+        self.assertFalse(self.reader.acquire())
+        self.assertFalse(self.reader.writable)
+        with self.assertRaises(RuntimeError):
+            self.append(self.reader, 1, 'чужая запись')
+
+    def test_reader_sees_owner_records(self):
+        self.append(self.owner, 1, 'первое')
+        self.append(self.owner, 2, 'второе')
+        self.assertEqual(self.texts(self.reader, 1), ['первое'])
+        self.append(self.owner, 1, 'третье')
+        self.assertEqual(self.texts(self.reader, 1), ['первое', 'третье'])
+        self.assertEqual(self.reader.count, 3)
+
+    def test_reader_does_not_touch_active_segment(self):
+        self.append(self.owner, 1, 'до читателя')
+        path = self.owner.path_for(self.owner.segments()[-1])
+        size = os.path.getsize(path)
+        late = SegmentLog(self.directory, SEGMENT_BYTES)
+        late.close()
+        self.reader.close()
+        self.assertEqual(os.path.getsize(path), size)
+        # Запись владельца продолжается с того же места, ничего не затерто
+        self.append(self.owner, 1, 'после читателя')
+        self.assertEqual(self.texts(self.owner, 1), ['до читателя', 'после читателя'])
+
+    def test_reader_follows_roll_and_reopen(self):
+        text = 'x' * (SEGMENT_BYTES // 3)
+        for _ in range(4):
+            self.append(self.owner, 1, text)
+        self.assertGreater(len(self.owner.segments()), 1)
+        self.assertEqual(len(self.reader.positions(1)), 4)
+
+        # Владелец завершился и обрезал сегмент; новый владелец дописывает в него же
+        self.owner.close()
+        self.owner = SegmentLog(self.directory, SEGMENT_BYTES)
+        self.assertTrue(self.owner.acquire())
+        self.append(self.owner, 1, 'после перезапуска')
+        self.assertEqual(len(self.reader.positions(1)), 5)
+        self.assertEqual(self.texts(self.reader, 1)[-1], 'после перезапуска')
+        self.assertEqual(self.owner.next_id, 6)
+
+
+if __name__ == '__main__':
+    unittest.main()